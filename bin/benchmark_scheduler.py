@@ -0,0 +1,120 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append("..")
+from src import GlobalConfig
+from src import ProcessPool
+from src import ReportConsumer
+from src import Terminal
+from src.Launcher import SubprocessLauncher
+
+"""
+    Measures the throughput of hpFX's scheduler and report post-processing on any platform, using fake_terminal.py
+    instead of MT4. Nothing but a temporary folder is touched, no global configuration is needed.
+
+    Sample run: python benchmark_scheduler.py -n 4 -s 28 --duration 2 --jitter 0.5 --order longest
+"""
+
+
+def make_config(shared_folder, args):
+    conf = GlobalConfig()
+    conf.global_shared_folder = shared_folder
+    conf.mt4_results_folder = "hpFX_results"
+    conf.abs_mt4_results_folder = os.path.join(shared_folder, 'tester', conf.mt4_results_folder)
+    conf.broker_server = "Fake-Server"
+    conf.broker_login = "0"
+    conf.broker_password = "0"
+
+    # Every fake terminal uses the shared folder as its data folder, which is what the hard links achieve with MT4
+    fake_terminal = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_terminal.py")
+    command = [sys.executable, fake_terminal, "--duration", str(args.duration), "--jitter", str(args.jitter),
+               "--trades", str(args.trades)]
+    for t in range(args.terminals):
+        conf.terminals.append(Terminal("Fake_Core_{}".format(t + 1), shared_folder, fake_terminal, shared_folder,
+                                       SubprocessLauncher(command=command)))
+    conf.num_terminals = args.terminals
+    conf.workers = conf.terminals.copy()
+
+    conf.testCategory = "BENCHMARK"
+    conf.category_results_folder = os.path.join(conf.mt4_results_folder, conf.testCategory)
+    conf.testUniqueName = os.path.join("fake_terminal", "20210101-20240101")
+    conf.abs_test_specific_folder = os.path.join(shared_folder, 'tester', conf.category_results_folder,
+                                                 conf.testUniqueName)
+    conf.relative_test_specific_folder = os.path.join(conf.category_results_folder, conf.testUniqueName)
+    conf.expert = "hpFX_Engine.ex4"
+    conf.expert_config = os.path.join(conf.mt4_results_folder, "benchmark.set")
+    conf.symbols = ["SYM{:03d}".format(s + 1) for s in range(args.symbols)]
+    conf.time_frame = "Daily"
+    conf.test_model = 0
+    conf.spread = 50
+    conf.optimization = 'false'
+    conf.date_from = "2021.01.01"
+    conf.date_to = "2024.01.01"
+    conf.is_delete = True
+    conf.parser_workers = args.parser_workers
+    conf.streaming_parser = True
+    conf.dispatch_order = args.order
+    conf.test_timeout = args.timeout
+
+    # Expert parameters and test configuration files, only copied around by prepare_test_environment()
+    os.makedirs(conf.abs_mt4_results_folder)
+    with open(os.path.join(shared_folder, 'tester', conf.expert_config), 'w') as set_file:
+        set_file.write("MT4_ID=0\n")
+    conf.test_config = os.path.join(shared_folder, "benchmark.yaml")
+    with open(conf.test_config, 'w') as yaml_file:
+        yaml_file.write("TestCategory: BENCHMARK\n")
+    os.makedirs(conf.abs_test_specific_folder)
+
+    return conf
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hpFX's scheduler using fake terminals.")
+    parser.add_argument("-n", "--terminals", type=int, default=4, help="Number of (fake) terminals")
+    parser.add_argument("-s", "--symbols", type=int, default=28, help="Number of symbols (tests) in the batch")
+    parser.add_argument("--duration", type=float, default=1.0, help="Average duration of a test in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Relative variation of test durations per symbol")
+    parser.add_argument("--trades", type=int, default=200, help="Number of trades in each generated report")
+    parser.add_argument("--order", type=str, default='listed', help="Dispatch order, see 'DispatchOrder'")
+    parser.add_argument("--parser-workers", type=int, default=1, help="Number of processes parsing the reports")
+    parser.add_argument("--timeout", type=float, default=0, help="Per-test timeout in seconds, see 'TestTimeout'")
+    parser.add_argument("--runs", type=int, default=1, help="Number of runs, e.g. 2 to measure 'longest' with history")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='hpFX_bench_') as shared_folder:
+        for run in range(args.runs):
+            conf = make_config(os.path.join(shared_folder, "run_{}".format(run)), args)
+            # Keep the duration history across runs
+            if os.path.exists(os.path.join(shared_folder, "DURATIONS.csv")):
+                os.replace(os.path.join(shared_folder, "DURATIONS.csv"),
+                           os.path.join(conf.abs_mt4_results_folder, "DURATIONS.csv"))
+            conf.prepare_test_environment()
+
+            p = ProcessPool(conf)
+            consumer = ReportConsumer(conf, on_summary=p.record_summary)
+            s_time = time.time()
+            p.run(on_complete=lambda batch, symbol: consumer.submit(symbol))
+            run_time = time.time() - s_time
+            consumer.finish()
+            total_time = time.time() - s_time
+
+            test_time = sum(p.actual.values())
+            print("\n=== Benchmark run {} ({} tests, {} terminals, '{}' order) ===".format(
+                run + 1, len(conf.symbols), len(conf.terminals), conf.dispatch_order))
+            print("Sum of test durations  : {:.2f} secs".format(test_time))
+            print("Ideal makespan         : {:.2f} secs".format(test_time / len(conf.terminals)))
+            print("Actual makespan        : {:.2f} secs".format(run_time))
+            print("Including parsing      : {:.2f} secs".format(total_time))
+            print("Scheduler efficiency   : {:.1%}".format(test_time / len(conf.terminals) / run_time))
+            print("Throughput             : {:.2f} tests/sec".format(len(conf.symbols) / total_time))
+
+            if os.path.exists(os.path.join(conf.abs_mt4_results_folder, "DURATIONS.csv")):
+                os.replace(os.path.join(conf.abs_mt4_results_folder, "DURATIONS.csv"),
+                           os.path.join(shared_folder, "DURATIONS.csv"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import glob
+import os
+import sys
+
+sys.path.append("..")
+from src import SharpeEngine
+
+# Sample run: python calculate_sharpe.py -i "C:\hpFX_Shared\tester\hpFX_results\TEST\C1_ASH\20160101-20200101\htm_reports"
+#             -from 2016.01.01 -to 2020.01.01 --rfr 0.02
+# Accepts <SYMBOL>_TRADES.csv files, or folders that include them.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates Sharpe Ratios from the trades exported by hpFX.")
+    parser.add_argument("-i", "--input", type=str, nargs='+', required=True,
+                        help="<SYMBOL>_TRADES.csv file(s), or folder(s) that include them")
+    parser.add_argument("-from", "--from", type=str, required=True, help="Test 'From' Date in 'YYYY.MM.DD' format.")
+    parser.add_argument("-to", "--to", type=str, required=True, help="Test 'To' Date in 'YYYY.MM.DD' format.")
+    parser.add_argument("--rfr", type=float, default=0.0, help="Annual risk-free rate as decimal (e.g. 0.02 for 2%%)")
+    args = vars(parser.parse_args())
+
+    trades_csvs = []
+    for i in args['input']:
+        if os.path.isdir(i):
+            trades_csvs += sorted(glob.glob(os.path.join(i, "*_TRADES.csv")))
+        else:
+            trades_csvs.append(i)
+
+    engine = SharpeEngine(args['from'], args['to'], args['rfr'])
+    print("{:<12}{:>12}{:>12}".format("Symbol", "Shrp(A-mo)", "Shrp(Yr)"))
+    for trades_csv in trades_csvs:
+        for symbol, sharpe in engine.sharpe_of_trades_csv(trades_csv).items():
+            print("{:<12}{:>12}{:>12}".format(symbol, sharpe['monthly'], sharpe['annual']))
+
+
+if __name__ == "__main__":
+    main()
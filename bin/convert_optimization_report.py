@@ -0,0 +1,55 @@
+import sys
+
+sys.path.append("..")
+from src import OptimizationReader
+from src import PassSelector
+from src.PassSelector import METRICS
+from src.Utils import dict_to_csv
+import argparse
+import os
+
+# Sample run: python convert_optimization_report.py -i "C:\hpFX_Shared\tester\OptimizationReport.htm"
+#             python convert_optimization_report.py -i OptimizationReport.htm -m Profit -t 20
+#             python convert_optimization_report.py -i OptimizationReport.htm -m Profit "Drawdown %"
+
+"""
+    Converts an MT4 Optimization Report to CSV, one row per pass. The passes are written as the report is read, so even
+    reports with hundreds of thousands of passes don't need to fit in memory.
+
+    With -m, only the best passes are written: the top -t passes by a single metric, or the Pareto front over several.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts an MT4 Optimization Report (HTM) to CSV.")
+    parser.add_argument("-i", "--input", type=str, required=True, help="Optimization Report (HTM)")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="CSV file, defaults to the name of the report with a .csv extension")
+    parser.add_argument("-a", "--append", action='store_true', help="Append to the CSV file rather than overwriting it")
+    parser.add_argument("-m", "--metrics", type=str, nargs='+', choices=list(METRICS), default=None,
+                        help="Only write the best passes by these metrics: top -t passes for a single metric, the "
+                             "Pareto front for several")
+    parser.add_argument("-t", "--top", type=int, default=0,
+                        help="Number of passes to keep (limits the Pareto front if more than one metric is given)")
+    args = parser.parse_args()
+    if args.metrics is not None and len(args.metrics) == 1 and args.top <= 0:
+        parser.error("-t is needed to select the best passes by a single metric")
+
+    output_csv = args.output if args.output is not None else os.path.splitext(args.input)[0] + ".csv"
+    reader = OptimizationReader(args.input)
+    if args.metrics is None:
+        num_passes = reader.to_csv(output_csv, overwrite=not args.append)
+    else:
+        best = PassSelector(args.metrics, args.top).select(reader.rows())
+        num_passes = len(best)
+        if len(best) > 0:
+            # Passes may list inputs the first one doesn't, the header has to include all of them
+            header = reader.columns + sorted(set().union(*best).difference(reader.columns))
+            dict_to_csv([{c: p.get(c, '') for c in header} for p in best], output_csv, overwrite=not args.append)
+    print("{} passes of {} written to: {}".format(num_passes, reader.symbol, output_csv))
+    if reader.input_names:
+        print("Inputs: {}".format(", ".join(reader.input_names)))
+
+
+if __name__ == "__main__":
+    main()
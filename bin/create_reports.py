@@ -1,8 +1,11 @@
-from src import GlobalConfig
+import sys
+
+sys.path.append("..")
+from src import HTMParser, ReportCache
+from multiprocessing import Pool
 import argparse
-from src import HTMParser
-from src.Utils import dict_to_csv
-import glob
+import csv
+import logging
 import os
 
 # Sample run: C:\Users\User\Documents\Programming\hpFX>python create_reports.py -d "C:\\Users\\User\\Documents\\hpFX_Shared\\tester\\f\\STANDALONE_RUNS\\___OPTIMIZATION_WINNING_MACD-4H-V10_b1x0+STOCHASTICRVI_b1xb2\\20160101-20200101\
@@ -15,29 +18,171 @@ import os
 # EURCAD
 # USDJPY
 
+"""
+    Merges the results of all HTM reports under a directory (including its subdirectories) into a single CSV file.
+
+    Reports are parsed by a pool of processes. The size and modification time of each report merged so far are kept in
+    a manifest next to the CSV file (<CSV>.manifest), so running it again only parses the reports that were added or
+    changed since: the rows of the others are carried over as they are. With a report cache (-c), reports that were
+    parsed before, e.g. when the results are merged again from scratch (-f), aren't parsed again either.
+"""
+
+MANIFEST_FIELDS = ['Report', 'Size', 'Mtime', 'Rows']
+
+
+def find_reports(htm_dir):
+    """
+    :return: HTM reports under htm_dir, as paths relative to it, in a stable order
+    """
+    reports = []
+    for root, dirs, files in os.walk(htm_dir):
+        dirs.sort()
+        for fn in sorted(files):
+            if os.path.splitext(fn)[1].lower() == '.htm':
+                reports.append(os.path.relpath(os.path.join(root, fn), htm_dir))
+    return reports
+
+
+def report_stamp(htm_dir, report):
+    stat = os.stat(os.path.join(htm_dir, report))
+    return str(stat.st_size), str(stat.st_mtime_ns)
+
+
+def read_manifest(manifest_fn, output_csv):
+    """
+    :return: List of the manifest entries, in the order of their rows in the CSV file
+    """
+    # A manifest without its CSV file describes nothing anymore
+    if not os.path.exists(manifest_fn) or not os.path.exists(output_csv):
+        return []
+    with open(manifest_fn, 'r', newline='') as manifest_file:
+        return list(csv.DictReader(manifest_file))
+
+
+def write_manifest(manifest_fn, entries):
+    with open(manifest_fn + ".tmp", 'w', newline='') as manifest_file:
+        csv_buffer = csv.DictWriter(manifest_file, MANIFEST_FIELDS)
+        csv_buffer.writeheader()
+        csv_buffer.writerows(entries)
+    os.replace(manifest_fn + ".tmp", manifest_fn)
+
+
+def parse_report(job):
+    """
+    Pool worker: parses a single report.
+    :return: (report, results, error), error is None on success
+    """
+    htm_dir, report, streaming, cache_folder, cache_size = job
+    try:
+        if cache_folder is not None:
+            cache = ReportCache(cache_folder, cache_size)
+            try:
+                results, _ = cache.htm_to_csv(os.path.join(htm_dir, report), streaming=streaming)
+            finally:
+                cache.close()
+        else:
+            results, _ = HTMParser(os.path.join(htm_dir, report), streaming=streaming).htm_to_csv()
+        return report, results, None
+    # HTMParser calls sys.exit() on unreadable reports, which would otherwise kill a pool worker
+    except (Exception, SystemExit) as e:
+        return report, None, e
+
+
+def retained_rows(output_csv, manifest, retained):
+    """
+    Yields the rows of the existing CSV file that belong to the retained reports.
+    """
+    with open(output_csv, 'r', newline='') as csv_file:
+        rows = csv.DictReader(csv_file)
+        for entry in manifest:
+            keep = entry['Report'] in retained
+            for _ in range(int(entry['Rows'])):
+                row = next(rows, None)
+                if keep and row is not None:
+                    yield row
+
 
 def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--directory", type=str, help="Absolute path to the directory that includes HTM files")
+    parser = argparse.ArgumentParser(description="Merges the results of the HTM reports under a directory into a "
+                                                 "single CSV file.")
+    parser.add_argument("-d", "--directory", type=str, required=True,
+                        help="Path to the directory that includes HTM files (subdirectories are included)")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Merged CSV file, defaults to MERGED_RESULTS.csv in the directory")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of processes parsing reports (defaults to the number of CPUs)")
+    parser.add_argument("-s", "--streaming", action='store_true',
+                        help="Use the single pass streaming parser (recommended for large, every tick reports)")
+    parser.add_argument("-f", "--full", action='store_true',
+                        help="Parse all reports again, rather than only those added or changed since the last merge")
+    parser.add_argument("-c", "--cache", type=str, default=None,
+                        help="Folder of the parsed report cache, reports found in it aren't parsed again")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Size of the parsed report cache in MB, the least recently used reports are dropped "
+                             "beyond it (defaults to 1024)")
     args = parser.parse_args()
     htm_dir = args.directory
-    # not needed so far... conf = GlobalConfig()
 
-    output_csv = os.path.join(htm_dir, "MERGED_RESULTS.csv")
-    htm_search_key = htm_dir + "\\*.htm"
-    htm_files = glob.glob(htm_search_key)
+    output_csv = args.output if args.output is not None else os.path.join(htm_dir, "MERGED_RESULTS.csv")
+    manifest_fn = output_csv + ".manifest"
+    manifest = [] if args.full else read_manifest(manifest_fn, output_csv)
+
+    reports = find_reports(htm_dir)
+    stamps = {r: report_stamp(htm_dir, r) for r in reports}
+    retained = set(e['Report'] for e in manifest if stamps.get(e['Report']) == (e['Size'], e['Mtime']))
+    to_parse = [r for r in reports if r not in retained]
+    print("Found {} HTM reports, {} of them added or changed since the last merge".format(len(reports),
+                                                                                        len(to_parse)))
+    if len(to_parse) == 0 and len(retained) == len(manifest):
+        print("Results are up to date: ", output_csv)
+        return
+
+    new_manifest = [e for e in manifest if e['Report'] in retained]
+    # Reports that were only added are appended, anything else requires writing the CSV file again
+    is_append = len(new_manifest) == len(manifest) and len(manifest) > 0
+    fieldnames = None
+    if len(manifest) > 0:
+        with open(output_csv, 'r', newline='') as csv_file:
+            fieldnames = next(csv.reader(csv_file), None)
 
-    # print(htm_files)
+    write_fn = output_csv if is_append else output_csv + ".tmp"
+    num_workers = max(1, min(args.workers, len(to_parse)))
+    jobs = [(htm_dir, r, args.streaming, args.cache, args.cache_size * (1 << 20)) for r in to_parse]
+    pool = Pool(num_workers) if num_workers > 1 else None
+    try:
+        parsed_reports = pool.imap(parse_report, jobs, chunksize=4) if pool is not None else map(parse_report, jobs)
+        with open(write_fn, 'a' if is_append else 'w', newline='') as output_file:
+            csv_buffer = None
+            if fieldnames is not None:
+                csv_buffer = csv.DictWriter(output_file, fieldnames, restval='', extrasaction='ignore')
+                if not is_append:
+                    csv_buffer.writeheader()
+                    csv_buffer.writerows(retained_rows(output_csv, manifest, retained))
 
-    for h in htm_files:
-        print("Processing: {}".format(h))
-        parsed_results = HTMParser(h)
-        test_output = parsed_results.htm_to_csv()
-        dict_to_csv(test_output, output_csv)
+            for report, results, error in parsed_reports:
+                if error is not None:
+                    logging.error("Error processing {}: {}".format(report, error))
+                    print("ERROR: Failed to process {}".format(report))
+                    continue
+                if csv_buffer is None and len(results) > 0:
+                    csv_buffer = csv.DictWriter(output_file, results[0].keys(), restval='', extrasaction='ignore')
+                    csv_buffer.writeheader()
+                if csv_buffer is not None:
+                    csv_buffer.writerows(results)
+                new_manifest.append({'Report': report, 'Size': stamps[report][0], 'Mtime': stamps[report][1],
+                                     'Rows': len(results)})
+                print("Processed: {}".format(report))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if not is_append:
+        os.replace(write_fn, output_csv)
+    write_manifest(manifest_fn, new_manifest)
 
     print("Results are written on: ", output_csv)
 
 
 if __name__ == "__main__":
     main()
-
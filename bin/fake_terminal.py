@@ -0,0 +1,138 @@
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+"""
+    A stand-in for MT4's terminal.exe. It reads the ini file generated by hpFX, sleeps for a while as if it was running
+    the test, then writes a synthetic Strategy Tester Report where MT4 would (TestReport, relative to the data folder
+    the terminal is started in).
+
+    This allows running the scheduling and post-processing parts of hpFX on any platform, e.g. to benchmark them on a
+    Linux box using the 'subprocess' launcher:
+        SubprocessLauncher(command=[sys.executable, "fake_terminal.py", "--duration", "2"])
+    See benchmark_scheduler.py for a complete example.
+"""
+
+
+def read_ini(ini_fn):
+    ini_config = {}
+    with open(ini_fn, 'r') as ini_file:
+        for line in ini_file:
+            if line.startswith(';') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            ini_config[key.strip()] = value.strip()
+    return ini_config
+
+
+def make_report(symbol, date_from, date_to, num_trades, rng, initial_deposit=10000.0):
+    """
+    :return: HTM report in the same layout as MT4's Strategy Tester Report, with random trades
+    """
+    start = datetime.datetime.strptime(date_from, '%Y.%m.%d')
+    end = datetime.datetime.strptime(date_to, '%Y.%m.%d')
+    step = (end - start) / max(2 * num_trades + 1, 1)
+
+    trade_rows = []
+    balance = initial_deposit
+    profits = []
+    t = start
+    for order in range(1, num_trades + 1):
+        t += step
+        trade_rows.append('<tr bgcolor="#FFFFFF" align=right><td>{}</td><td class=msdate>{}</td><td>buy</td>'
+                          '<td>{}</td><td class=mspt>0.50</td><td>1.10000</td><td>1.09000</td><td>1.12000</td>'
+                          '<td colspan=2></td></tr>'.format(2 * order - 1, t.strftime('%Y.%m.%d %H:%M'), order))
+        t += step
+        profit = round(rng.uniform(-250.0, 300.0), 2)
+        profits.append(profit)
+        balance = round(balance + profit, 2)
+        trade_rows.append('<tr bgcolor="#E0E0E0" align=right><td>{}</td><td class=msdate>{}</td><td>{}</td>'
+                          '<td>{}</td><td class=mspt>0.50</td><td>1.11000</td><td>1.09000</td><td>1.12000</td>'
+                          '<td class=mspt>{:.2f}</td><td class=mspt>{:.2f}</td></tr>'
+                          .format(2 * order, t.strftime('%Y.%m.%d %H:%M'), 's/l' if profit < 0 else 't/p', order,
+                                  profit, balance))
+
+    wins = [p for p in profits if p >= 0]
+    losses = [p for p in profits if p < 0]
+    gross_profit = sum(wins)
+    gross_loss = sum(losses)
+    net_profit = gross_profit + gross_loss
+    profit_factor = gross_profit / -gross_loss if gross_loss else 0.0
+    max_dd = max(-gross_loss, 0.01)
+
+    def pct(count):
+        return 100.0 * count / num_trades if num_trades else 0.0
+
+    summary = [
+        ('Symbol', '{} (synthetic)'.format(symbol)),
+        ('Period', 'Daily (D1) {} - {}'.format(date_from, date_to)),
+        ('Model', 'Every tick (fake terminal)'),
+    ]
+    rows = ['<tr align=left><td colspan=2>{}</td><td colspan=4>{}</td></tr>'.format(k, v) for k, v in summary]
+    rows += [
+        '<tr align=left><td>Bars in test</td><td align=right>{}</td><td>Ticks modelled</td><td align=right>{}</td>'
+        '<td>Modelling quality</td><td align=right>n/a</td></tr>'.format((end - start).days, 1000 * num_trades),
+        '<tr align=left><td colspan=2>Mismatched charts errors</td><td align=right>0</td></tr>',
+        '<tr align=left><td colspan=2>Initial deposit</td><td align=right>{:.2f}</td><td></td>'
+        '<td align=right>Spread</td><td align=right>50</td></tr>'.format(initial_deposit),
+        '<tr align=left><td>Total net profit</td><td align=right>{:.2f}</td><td>Gross profit</td>'
+        '<td align=right>{:.2f}</td><td>Gross loss</td><td align=right>{:.2f}</td></tr>'
+        .format(net_profit, gross_profit, gross_loss),
+        '<tr align=left><td>Profit factor</td><td align=right>{:.2f}</td><td>Expected payoff</td>'
+        '<td align=right>{:.2f}</td><td></td><td align=right></td></tr>'
+        .format(profit_factor, net_profit / num_trades if num_trades else 0.0),
+        '<tr align=left><td>Absolute drawdown</td><td align=right>{:.2f}</td><td>Maximal drawdown</td>'
+        '<td align=right>{:.2f} ({:.2f}%)</td><td>Relative drawdown</td><td align=right>{:.2f}% ({:.2f})</td></tr>'
+        .format(max_dd, max_dd, 100 * max_dd / initial_deposit, 100 * max_dd / initial_deposit, max_dd),
+        '<tr align=left><td>Total trades</td><td align=right>{}</td><td>Short positions (won %)</td>'
+        '<td align=right>0 (0.00%)</td><td>Long positions (won %)</td><td align=right>{} ({:.2f}%)</td></tr>'
+        .format(num_trades, num_trades, pct(len(wins))),
+        '<tr align=left><td colspan=2></td><td>Profit trades (% of total)</td><td align=right>{} ({:.2f}%)</td>'
+        '<td>Loss trades (% of total)</td><td align=right>{} ({:.2f}%)</td></tr>'
+        .format(len(wins), pct(len(wins)), len(losses), pct(len(losses))),
+        '<tr align=left><td>Maximum</td><td>consecutive wins (profit in money)</td><td align=right>1 (0.00)</td>'
+        '<td>consecutive losses (loss in money)</td><td align=right>1 (0.00)</td></tr>',
+        '<tr align=left><td>Average</td><td>consecutive wins</td><td align=right>1</td>'
+        '<td>consecutive losses</td><td align=right>1</td></tr>',
+    ]
+
+    return ('<html><head><title>Strategy Tester: hpFX_Engine</title></head>\n'
+            '<body topmargin=1 marginheight=1><div align=center>\n'
+            '<div style="font: 20pt Times New Roman"><b>Strategy Tester Report</b></div>\n'
+            '<table width=820 cellspacing=1 cellpadding=3 border=0>\n{}\n</table><br>\n'
+            '<table width=820 cellspacing=1 cellpadding=3 border=0>\n'
+            '<tr bgcolor="#C0C0C0" align=right><td>#</td><td>Time</td><td>Type</td><td>Order</td><td>Size</td>'
+            '<td>Price</td><td>S / L</td><td>T / P</td><td>Profit</td><td>Balance</td></tr>\n{}\n</table>\n'
+            '</div></body></html>\n').format("\n".join(rows), "\n".join(trade_rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for MT4's terminal.exe, for testing/benchmarking hpFX.")
+    parser.add_argument("--duration", type=float, default=1.0, help="Seconds to 'run' each test")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Relative, per symbol variation of the duration, e.g. 0.5 for +/-50%%. The same symbol "
+                             "always gets the same duration, so slow symbols remain slow.")
+    parser.add_argument("--trades", type=int, default=50, help="Number of trades in the generated report")
+    parser.add_argument("ini", type=str, help="Test configuration (ini) file generated by hpFX")
+    args = parser.parse_args()
+
+    ini_config = read_ini(args.ini)
+    symbol = ini_config['TestSymbol']
+    rng = random.Random(symbol)
+
+    time.sleep(max(args.duration * (1 + args.jitter * rng.uniform(-1.0, 1.0)), 0.0))
+
+    # Just like MT4, TestReport is relative to the data folder, i.e. the working directory of the terminal
+    report_fn = os.path.join(os.getcwd(), ini_config['TestReport'].replace('\\', os.sep))
+    os.makedirs(os.path.dirname(report_fn), exist_ok=True)
+    with open(report_fn, 'w') as report_file:
+        report_file.write(make_report(symbol, ini_config['TestFromDate'], ini_config['TestToDate'], args.trades, rng))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
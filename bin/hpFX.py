@@ -3,7 +3,8 @@ import sys
 sys.path.append("..")
 from src import GlobalConfig
 from src import ProcessPool
-from src.Utils import postprocess_results, kill_all_terminals
+from src import ReportConsumer
+from src.Utils import postprocess_results, signal_handler
 from functools import partial
 import time
 import logging
@@ -11,14 +12,6 @@ import signal
 import datetime
 
 
-def signal_handler(conf, sig, frame):
-    if input("Are you sure you'd like to terminate all tests and exit? (y/n)").upper() == "Y":
-        kill_all_terminals(conf)
-        sys.exit(0)
-    else:
-        return
-
-
 #  #!/usr/bin/env python
 #  import signal
 #  import sys
@@ -34,14 +27,19 @@ def signal_handler(conf, sig, frame):
 def main():
     conf = GlobalConfig()
     conf.ingest_args()
-    conf.prepare_test_environment()
+    if not conf.prepare_test_environment():
+        sys.exit(0)
     p = ProcessPool(conf)
     signal.signal(signal.SIGINT, partial(signal_handler, conf))
 
     s_time = time.time()
-    p.run()
-
-    postprocess_results(conf)
+    if conf.parse_while_running:
+        consumer = ReportConsumer(conf, on_summary=p.record_summary)
+        p.run(on_complete=lambda batch, symbol: consumer.submit(symbol))
+        consumer.finish()
+    else:
+        p.run()
+        postprocess_results(conf)
 
     elapsed_time = time.time() - s_time
     now = datetime.datetime.now()
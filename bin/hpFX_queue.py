@@ -0,0 +1,158 @@
+import argparse
+import glob
+import logging
+import os
+import shutil
+import signal
+import sys
+import time
+import datetime
+from functools import partial
+
+sys.path.append("..")
+from src import GlobalConfig
+from src import ProcessPool
+from src.ProcessPool import DISPATCH_ORDERS
+from src.ReportConsumer import BatchReportConsumers
+from src.Utils import read_queue_file, signal_handler
+
+"""
+    Runs many test configurations (YAML) as a single queue: every (configuration, symbol) test goes to the next free
+    terminal, so terminals don't wait for the slowest symbol of each batch and aren't restarted between batches.
+
+    Each configuration is loaded exactly like 'python hpFX.py -c <config> -r' would (or -d, see below) and its results
+    end up in the same place.
+
+    Sample runs:
+        python hpFX_queue.py -c C1_ASH.yaml C1_RSI.yaml
+        python hpFX_queue.py -l experiments.txt            (one YAML file per line, as created by test_case_maker.py)
+        python hpFX_queue.py -w C:\\hpFX_spool               (keeps running, picking up YAML files dropped in there)
+"""
+
+
+class BatchLoader:
+    """
+    Loads and prepares test configurations, giving each its own range of MT4_IDs since they share the terminals.
+    """
+    def __init__(self, mode_args):
+        self.mode_args = mode_args
+        self.next_mt4_id = 1
+
+    def load(self, test_config):
+        """
+        :return: The prepared configuration, or None if it fails to load or has nothing to run
+        """
+        conf = GlobalConfig()
+        conf.mt4_id_start = self.next_mt4_id
+        try:
+            conf.ingest_args(["-c", test_config] + self.mode_args)
+            if not conf.prepare_test_environment():
+                return None
+        except SystemExit:
+            # Configuration errors are logged where they're found, they shouldn't stop the other batches
+            logging.error("Skipping test configuration {}".format(test_config))
+            return None
+        self.next_mt4_id += len(conf.symbols)
+        print("Queued {} symbol(s) from {}".format(len(conf.work_inputs), test_config))
+        return conf
+
+
+class SpoolFolder:
+    """
+    Watches a folder for new test configurations. YAML files dropped in there are moved to 'running' once queued, and
+    to 'done' (or 'failed') afterwards.
+    """
+    def __init__(self, folder, loader):
+        self.folder = folder
+        self.loader = loader
+        self.yaml_fn = {}
+        for sub_folder in 'running', 'done', 'failed':
+            os.makedirs(os.path.join(folder, sub_folder), exist_ok=True)
+
+    def poll(self):
+        batches = []
+        for test_config in sorted(glob.glob(os.path.join(self.folder, "*.yaml")), key=os.path.getmtime):
+            running_fn = os.path.join(self.folder, 'running', os.path.basename(test_config))
+            shutil.move(test_config, running_fn)
+            conf = self.loader.load(running_fn)
+            if conf is None:
+                shutil.move(running_fn, os.path.join(self.folder, 'failed', os.path.basename(test_config)))
+                continue
+            self.yaml_fn[conf] = running_fn
+            batches.append(conf)
+        return batches
+
+    def done(self, conf):
+        running_fn = self.yaml_fn.pop(conf, None)
+        if running_fn is not None:
+            shutil.move(running_fn, os.path.join(self.folder, 'done', os.path.basename(running_fn)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs many hpFX test configurations in a single queue.")
+    parser.add_argument("-c", "--testconfigs", type=str, nargs='+', default=[], help="Test configuration files (YAML)")
+    parser.add_argument("-l", "--list", type=str, help="File listing test configuration files, one per line")
+    parser.add_argument("-w", "--watch", type=str, help="Keep running and queue test configurations (YAML) copied to "
+                                                        "this folder")
+    parser.add_argument("-d", "--delete", action='store_true', help="Delete existing results and run all tests from "
+                                                                    "scratch, rather than repairing them (-r)")
+    parser.add_argument("-n", "--nocache", action='store_true', help="Run all tests, even those with results in the "
+                                                                     "result cache")
+    parser.add_argument("-o", "--order", type=str, default='listed', help="Dispatch order across all configurations "
+                                                                          "({})".format(", ".join(DISPATCH_ORDERS)))
+    parser.add_argument("--retries", type=int, default=1, help="How many times a timed out test is run again")
+    args = parser.parse_args()
+
+    test_configs = args.testconfigs
+    if args.list is not None:
+        test_configs += read_queue_file(args.list)
+    if len(test_configs) == 0 and args.watch is None:
+        parser.print_help()
+        logging.error("Please provide test configuration files (-c/-l) or a folder to watch (-w)")
+        sys.exit(35)
+    if args.order not in DISPATCH_ORDERS:
+        logging.error("Dispatch order must be one of: {}".format(", ".join(DISPATCH_ORDERS)))
+        sys.exit(36)
+
+    # Terminals and the queue-wide settings, the test specific settings come with each configuration
+    conf = GlobalConfig()
+    conf.ingest_global_config()
+    conf.dispatch_order = args.order
+    conf.test_retries = args.retries
+
+    loader = BatchLoader((["-d"] if args.delete else ["-r"]) + (["-n"] if args.nocache else []))
+    batches = [b for b in (loader.load(t) for t in test_configs) if b is not None]
+    if len(batches) == 0 and args.watch is None:
+        print("Nothing to run.")
+        sys.exit(0)
+
+    spool = None
+    if args.watch is not None:
+        spool = SpoolFolder(args.watch, loader)
+        print("Watching {} for test configurations, press Ctrl+C to stop.".format(args.watch))
+
+    p = ProcessPool(conf, batches)
+    consumers = BatchReportConsumers(on_summary=p.record_summary)
+
+    def on_batch_complete(batch):
+        consumers.on_batch_complete(batch)
+        if spool is not None:
+            spool.done(batch)
+        now = datetime.datetime.now()
+        print("\n[{}] Done with {}".format(now.strftime("%Y-%m-%d %H:%M:%S"), batch.test_config))
+
+    signal.signal(signal.SIGINT, partial(signal_handler, conf))
+
+    s_time = time.time()
+    p.run(on_complete=consumers.on_complete, on_batch_complete=on_batch_complete,
+          more_batches=spool.poll if spool is not None else None)
+    consumers.close()
+
+    elapsed_time = time.time() - s_time
+    now = datetime.datetime.now()
+    print("\n[{}] All done! Processing {} configuration(s) took {:.2f} secs".format(now.strftime("%Y-%m-%d %H:%M:%S"),
+                                                                                   len(p.batches), elapsed_time))
+
+
+if __name__ == "__main__":
+    main()
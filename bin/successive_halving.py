@@ -0,0 +1,191 @@
+import argparse
+import datetime
+import logging
+import math
+import random
+import signal
+import sys
+import time
+from functools import partial
+
+sys.path.append("..")
+from src import GlobalConfig
+from src import ProcessPool
+from src.ReportConsumer import BatchReportConsumers
+from src.Utils import csv_to_dict, dict_to_csv, read_queue_file, signal_handler
+
+"""
+    Successive halving over many test configurations (YAML), e.g. the indicator combinations created by
+    test_case_maker.py. Rather than running each of them on all symbols with the configured (every tick) model, they
+    are first screened with cheap open price tests (TestModel=2) on a few symbols. Only the best 1/eta of them are
+    promoted to the next round, and only those surviving all screening rounds are run as configured.
+
+    E.g. 1000 configurations, 28 symbols, eta=4 and 2 rounds on 4 then 8 symbols: 4000 + 1000 open price tests and
+    63x28 = 1764 full tests, instead of 28000 full tests.
+
+    Each round runs in a single queue, like hpFX_queue.py. Screening results are kept apart from the full results, under
+    <TestUniqueName>_SH_M<model>, and repaired (-r) from one round to the next: as each round screens on more of the
+    same symbols, only the new ones are tested. Configurations are ranked by the mean of a RESULTS.csv column over the
+    screened symbols, and the ranking of each round is written to HALVING.csv (-o).
+
+    Sample runs:
+        python successive_halving.py -l run_all_tests.txt -s EURUSD,GBPUSD,USDJPY,AUDUSD
+        python successive_halving.py -l run_all_tests.txt -s EURUSD,GBPUSD,USDJPY,AUDUSD --rounds 2 --eta 4
+        python successive_halving.py -l run_all_tests.txt -s EURUSD,GBPUSD --sample 200 --seed 1
+"""
+
+# RESULTS.csv columns where lower values are better, all others are ranked highest first
+LOWER_IS_BETTER = ('Max DD', 'Max DD %')
+
+
+class Round:
+    """
+    Loads test configurations with the settings of a round and runs them in a single queue.
+    """
+    def __init__(self, conf, mode_args):
+        self.conf = conf
+        self.mode_args = mode_args
+
+    def load(self, test_configs):
+        """
+        :return: Dictionary of test configuration -> prepared GlobalConfig (None if it fails to load), and the list of
+                 those with tests to run
+        """
+        batches = {}
+        to_run = []
+        next_mt4_id = 1
+        for test_config in test_configs:
+            batch = GlobalConfig()
+            batch.mt4_id_start = next_mt4_id
+            try:
+                batch.ingest_args(["-c", test_config] + self.mode_args)
+                if batch.prepare_test_environment():
+                    to_run.append(batch)
+                    next_mt4_id += len(batch.symbols)
+            except SystemExit:
+                # Configuration errors are logged where they're found, they shouldn't stop the other configurations
+                logging.error("Skipping test configuration {}".format(test_config))
+                batch = None
+            batches[test_config] = batch
+        return batches, to_run
+
+    def run(self, test_configs):
+        batches, to_run = self.load(test_configs)
+        print("\n{} configuration(s) to run, {} test(s)".format(len(to_run), sum(len(b.work_inputs) for b in to_run)))
+        if len(to_run) == 0:
+            return batches
+
+        p = ProcessPool(self.conf, to_run)
+        consumers = BatchReportConsumers(on_summary=p.record_summary)
+        p.run(on_complete=consumers.on_complete, on_batch_complete=consumers.on_batch_complete)
+        consumers.close()
+        return batches
+
+
+def score(batch, symbols, metric):
+    """
+    :return: Mean of the metric over the given symbols in RESULTS.csv of the batch, None if there's no valid value
+    """
+    if batch is None:
+        return None
+    try:
+        rows = csv_to_dict(batch.test_report_csv)
+    except (IOError, OSError):
+        return None
+    values = []
+    for row in rows:
+        if row.get('Symbol') not in symbols:
+            continue
+        try:
+            value = float(row[metric])
+        except (KeyError, TypeError, ValueError):
+            continue
+        # NaN is the only value that doesn't equal itself
+        if value == value:
+            values.append(value)
+    return sum(values) / len(values) if len(values) > 0 else None
+
+
+def rank(test_configs, scores, metric):
+    """
+    :return: The test configurations, best first. Those without a score come last, in their original order.
+    """
+    sign = -1.0 if metric in LOWER_IS_BETTER else 1.0
+    return sorted(test_configs, key=lambda t: (scores[t] is None, -sign * scores[t] if scores[t] is not None else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screens many test configurations with cheap tests and only runs the "
+                                                 "best of them as configured.")
+    parser.add_argument("-c", "--testconfigs", type=str, nargs='+', default=[], help="Test configuration files (YAML)")
+    parser.add_argument("-l", "--list", type=str, help="File listing test configuration files, one per line")
+    parser.add_argument("-s", "--symbols", type=str, required=True,
+                        help="Comma separated symbols to screen on. Round r of n uses the first r/n of them.")
+    parser.add_argument("-m", "--model", type=int, default=2,
+                        help="Test model of the screening rounds, defaults to 2 (open prices)")
+    parser.add_argument("--rounds", type=int, default=1, help="Number of screening rounds (defaults to 1)")
+    parser.add_argument("--eta", type=float, default=3, help="Only the best 1/eta of the configurations are promoted "
+                                                             "to the next round (defaults to 3)")
+    parser.add_argument("--metric", type=str, default="Total net profit",
+                        help="RESULTS.csv column to rank the configurations by, averaged over the screened symbols "
+                             "(defaults to 'Total net profit')")
+    parser.add_argument("--sample", type=int, default=None,
+                        help="Start with a random sample of this many configurations rather than all of them")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed of the sample")
+    parser.add_argument("-n", "--nocache", action='store_true', help="Run all tests, even those with results in the "
+                                                                     "result cache")
+    parser.add_argument("-o", "--output", type=str, default="HALVING.csv", help="Ranking of each round (CSV)")
+    args = parser.parse_args()
+
+    test_configs = args.testconfigs
+    if args.list is not None:
+        test_configs += read_queue_file(args.list)
+    screen_symbols = [s.strip() for s in args.symbols.split(',') if s.strip()]
+    if len(test_configs) == 0 or len(screen_symbols) == 0:
+        parser.print_help()
+        logging.error("Please provide test configuration files (-c/-l) and the symbols to screen on (-s)")
+        sys.exit(37)
+    if args.rounds < 1 or args.eta <= 1:
+        logging.error("Successive halving needs at least one round (--rounds) and an eta above 1 (--eta)")
+        sys.exit(38)
+
+    if args.sample is not None and args.sample < len(test_configs):
+        picked = set(random.Random(args.seed).sample(range(len(test_configs)), args.sample))
+        test_configs = [t for i, t in enumerate(test_configs) if i in picked]
+
+    conf = GlobalConfig()
+    conf.ingest_global_config()
+    signal.signal(signal.SIGINT, partial(signal_handler, conf))
+    nocache = ["-n"] if args.nocache else []
+
+    s_time = time.time()
+    ranking = []
+    for r in range(args.rounds):
+        symbols = screen_symbols[:math.ceil(len(screen_symbols) * (r + 1) / args.rounds)]
+        print("\n=== Screening round {}/{}: {} configuration(s) on {} with TestModel={} ===".format(
+            r + 1, args.rounds, len(test_configs), ",".join(symbols), args.model))
+        # Repair (-r) mode only runs the symbols missing from previous rounds (or from an interrupted run)
+        batches = Round(conf, ["-r", "-m", str(args.model), "-p", ",".join(symbols), "-x", "_SH_M{}".format(args.model)]
+                        + nocache).run(test_configs)
+
+        scores = {t: score(batches[t], symbols, args.metric) for t in test_configs}
+        ranked = rank(test_configs, scores, args.metric)
+        promoted = ranked[:math.ceil(len(ranked) / args.eta)]
+        for position, t in enumerate(ranked):
+            ranking.append({'Round': r + 1, 'Rank': position + 1, 'Test config': t, args.metric: scores[t],
+                            'Promoted': t in promoted})
+        dict_to_csv(ranking, args.output, overwrite=True)
+        test_configs = promoted
+        print("\nPromoted {} configuration(s): {}".format(len(promoted), ", ".join(promoted)))
+
+    print("\n=== Final round: {} configuration(s) as configured ===".format(len(test_configs)))
+    Round(conf, ["-r"] + nocache).run(test_configs)
+
+    elapsed_time = time.time() - s_time
+    now = datetime.datetime.now()
+    print("\n[{}] All done! Successive halving took {:.2f} secs, see {} for the ranking of each round".format(
+        now.strftime("%Y-%m-%d %H:%M:%S"), elapsed_time, args.output))
+
+
+if __name__ == "__main__":
+    main()
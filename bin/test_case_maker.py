@@ -1,5 +1,6 @@
 import logging
 import argparse
+import os
 import sys
 
 sys.path.append("..")
@@ -7,32 +8,68 @@ from src import SetMaker
 from src import GlobalConfig
 
 
+def parse_shard(shard):
+    """
+    :param shard: "i/n", the i-th of n shards (i from 1 to n)
+    :return: (i, n)
+    """
+    try:
+        index, count = (int(v) for v in shard.split('/'))
+    except ValueError:
+        index = count = 0
+    if count < 1 or not 1 <= index <= count:
+        logging.error("Shard must be given as 'i/n' with 1 <= i <= n, e.g. '--shard 2/4', not '{}'".format(shard))
+        sys.exit(82)
+    return index, count
+
+
 def main():
     parser = argparse.ArgumentParser()
     # Usage: python parse_strategy_report.py -c launcher_config.yaml
     parser.add_argument("-c", "--config", type=str, help="Configuration file that defines which test cases to create"
                         " in YAML format.")
+    parser.add_argument("-n", "--dry-run", action='store_true', help="Only count the test cases, without creating "
+                                                                     "any files.")
+    parser.add_argument("--shard", type=str, default=None, help="Only create the i-th of every n test cases ('i/n'), "
+                                                                "to split large sweeps across machines. Each shard "
+                                                                "gets its own *.bat file.")
+    parser.add_argument("--sample", type=int, default=None, help="Only create a random sample of this many test "
+                                                                 "cases, for search spaces too large to test them all.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed of the sample, give the same seed to all "
+                                                               "shards of a sampled sweep.")
     args = parser.parse_args()
     test_case_config = args.config
 
     if test_case_config is None:
         logging.error("Missing configuration file (-c), terminating.")
         sys.exit(81)
+    shard = parse_shard(args.shard) if args.shard is not None else None
+    if args.sample is not None and args.sample < 1:
+        logging.error("The sample size must be a positive number of test cases")
+        sys.exit(83)
+    if args.sample is not None and shard is not None and args.seed is None:
+        logging.error("Sharded samples need a seed (--seed), so that all shards draw the same sample")
+        sys.exit(84)
 
     global_conf = GlobalConfig()
     global_conf.ingest_global_config()
     global_conf.ingest_test_maker_config(test_case_config)
 
+    # Inputs are checked even for a dry run
     all_cases = SetMaker.make_indi_cases(global_conf)
+    num_cases = SetMaker.count_indi_cases(global_conf, shard, args.sample)
+    if args.dry_run:
+        print("\n>>> {} cases to create{}, out of {} combinations.".format(
+            num_cases, "" if shard is None else " in shard {}/{}".format(shard[0], shard[1]),
+            SetMaker.count_indi_cases(global_conf)))
+        return
 
-    print(all_cases)
-
-    SetMaker.create_experiment_files(global_conf, all_cases)
+    if shard is not None:
+        global_conf.bat_file = "{}_{}of{}.bat".format(os.path.splitext(global_conf.bat_file)[0], shard[0], shard[1])
+    print("Creating {} cases".format(num_cases))
+    all_cases = SetMaker.sample_cases(global_conf, all_cases, args.sample, args.seed)
+    SetMaker.create_experiment_files(global_conf, SetMaker.shard_cases(all_cases, shard))
 
 
 if __name__ == "__main__":
     main()
-
-
-
-
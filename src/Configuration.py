@@ -7,9 +7,20 @@ import argparse
 import hashlib
 from src import Terminal
 from src import Utils
+from src import Launcher
+from src.FieldTemplate import FieldTemplate
+from src.HTMParser import HTMParser
+from src.ProcessPool import DISPATCH_ORDERS
+from src.PassSelector import METRICS as PASS_METRICS
 
+# Supported file formats for the individual trades of each symbol
+TRADES_FORMATS = ['csv', 'npz', 'both']
 
-def parse_arguments():
+
+def parse_arguments(argv=None):
+    """
+    :param argv: Command line arguments to parse, defaults to sys.argv
+    """
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-e", "--expertconfig", type=str, help="hpFX expert configuration file (*.set) "
@@ -35,7 +46,15 @@ def parse_arguments():
 
     parser.add_argument("-r", "--repair", action='store_true', help="Identifies missing tests compared to the input"
                                                                     " configuration and runs them. It checks for"
-                                                                    " missing HTM files and blank lines in the Results CSV.")
+                                                                    " missing HTM files and blank lines in the Results CSV."
+                                                                    " Symbols with a valid HTM report that wasn't"
+                                                                    " parsed are only parsed again.")
+    parser.add_argument("-n", "--nocache", action='store_true', help="Runs all tests, even those with results in the"
+                                                                     " result cache (see 'result_cache' in global "
+                                                                     "config). Their results are still cached.")
+    parser.add_argument("-x", "--namesuffix", type=str, help="Appended to the test name (TestUniqueName), to keep the"
+                                                             " results of variations of a test apart (e.g. the "
+                                                             "screening runs of successive_halving.py)")
     parser.add_argument("-b", "--bugfix", action='store_true', help="Starts hpFX in debugging node. generates "
                                                                     "verbose output and keeps MT4 open after tests.")
 
@@ -44,7 +63,7 @@ def parse_arguments():
     required_args = parser.add_argument_group('Required Arguments')
     required_args.add_argument("-c", "--testconfig", type=str, required=True,
                                help="Test specific configuration file in YAML format")
-    args = vars(parser.parse_args())
+    args = vars(parser.parse_args(argv))
 
     if args['testconfig'] is None:
         parser.print_help()
@@ -71,11 +90,40 @@ class GlobalConfig:
         self.date_from = None
         self.date_to = None
         self.work_inputs = []
+        # Symbol tested by each of the work_inputs (ini file -> symbol)
+        self.work_symbols = {}
 
         # Sharpe Ratio configuration parameters (v1.0)
         self.calculate_sharpe = False
         self.risk_free_rate = 0.0
 
+        # HTM report post-processing parameters
+        self.parser_workers = 1
+        self.streaming_parser = False
+        self.trades_format = 'csv'
+        self.parse_while_running = True
+        self.portfolio_analysis = False
+        # Selection of the best passes of optimization reports
+        self.optimization_metrics = []
+        self.optimization_top = 0
+
+        # Order in which the work inputs are handed over to the terminals
+        self.dispatch_order = 'listed'
+
+        # Per-test timeouts (secs, 0 for none) and how many times a timed out test is run again on another terminal
+        self.test_timeout = 0
+        self.test_timeout_scale = 0
+        self.test_retries = 1
+
+        # Early abort of unpromising batches: once 'prune_after' symbols are done and all of them fall short of the
+        # thresholds, the remaining symbols are cancelled (0 to run all symbols)
+        self.prune_after = 0
+        self.prune_profit_factor = None
+        self.prune_net_profit = None
+
+        # MT4_ID of the first symbol, each symbol gets its own. Batches sharing the terminals need distinct ranges.
+        self.mt4_id_start = 1
+
         # Global (system) configuration parameters
         self.global_config = os.path.join("../config", "global_config.yaml")
         # Where to keep all configurations and processed results
@@ -93,14 +141,29 @@ class GlobalConfig:
         self.broker_server = None
         self.broker_login = None
         self.broker_password = None
+        # Reuse the reports of tests that were already run (see ResultCache.py)
+        self.result_cache = False
+        # Parsed reports, so unchanged reports aren't parsed again (see ReportCache.py). None if disabled.
+        self.report_cache = None
+        self.report_cache_size = 0
+        # Write the ini and set files of the tests to a temporary file first, then move them in place
+        self.atomic_writes = False
 
         # Internal parameters
         self.is_delete = None
         self.is_repair = None
         self.is_debug = False
+        self.is_nocache = False
         self.htm_reports = {}
+        # Symbols of a repair (-r) that only need their existing HTM report parsed, they aren't part of work_inputs
+        self.reparse_symbols = []
+        # Symbols whose tests were cancelled by the pruning rule (see 'PruneAfter'), they have no report to parse
+        self.pruned_symbols = []
         self.test_report_csv = None
         self.trades_report_csv = None  # v1.0: Added for individual trades export
+        # All trades of the batch, indexed by symbol and time (see TradeStore.py)
+        self.trades_store = None
+        self.portfolio_csv = None
         # Absolute path for the test specific folder
         self.abs_test_specific_folder = None
         # Relative path for the test specific folder (terminal.exe only supports relative paths to save reports)
@@ -112,6 +175,7 @@ class GlobalConfig:
         self.abs_reports_folder = None
         self.relative_reports_folder = None
         self.abs_expert_path = None
+        self.abs_expert_ex4 = None
 
         # test_case_maker specific parameters
         # BASELINECROSS,    // < indi_parameters >; < indi_filename >; < buffer1 >
@@ -143,8 +207,12 @@ class GlobalConfig:
         self.EXIT = None
         self.Entry_Permutations = False
 
-    def ingest_args(self):
-        args = parse_arguments()
+    def ingest_args(self, argv=None):
+        """
+        :param argv: Command line arguments, defaults to sys.argv. hpFX_queue.py uses this to load a test
+                     configuration the same way hpFX.py would.
+        """
+        args = parse_arguments(argv)
 
         # This must be the first step in argument parsing: There's nothing to run if there's no global config.
         self.ingest_global_config()
@@ -193,9 +261,15 @@ class GlobalConfig:
             logging.error("Delete (-d) and Repair (-r) options are mutually exclusive! You need to pick one.")
             sys.exit(55)
 
+        if args['nocache']:
+            self.is_nocache = True
+
         if args['bugfix']:
             self.is_debug = True
 
+        if args['namesuffix'] is not None:
+            self.testUniqueName += args['namesuffix']
+
         # Moving
         # Append date range to testUniqueName to avoid accidental overwrites
         date_string = self.date_from.replace('.', '') + "-" + self.date_to.replace('.', '')
@@ -244,6 +318,20 @@ class GlobalConfig:
 
         self.num_terminals = len(tmp_args['mt4_terminals'])
 
+        # Optional: reuse the reports of tests that were already run
+        self.result_cache = tmp_args.get('result_cache', False)
+
+        # Optional: keep the parsed reports, in MB
+        if tmp_args.get('report_cache', False):
+            self.report_cache = os.path.join(self.abs_mt4_results_folder, "PARSED")
+        self.report_cache_size = int(tmp_args.get('report_cache_size', 1024)) * (1 << 20)
+
+        # Optional: never leave half written ini/set files behind, e.g. on network shares
+        self.atomic_writes = tmp_args.get('atomic_writes', False)
+
+        # Optional: how terminals are started, see Launcher.py
+        launcher_name = tmp_args.get('terminal_launcher', 'shell')
+
         app_data_root = os.path.join(os.getenv('APPDATA'), 'MetaQuotes', 'Terminal')
         for t in range(self.num_terminals):
             name = "MT4_Core_{}".format(t + 1)
@@ -258,7 +346,7 @@ class GlobalConfig:
                     "Unable to identify data folder {} location for '{}'. Please check the path you provided in "
                     "'global_config.yaml' file. Do not use double quotes in this path.".format(data_folder, path))
                 sys.exit(11)
-            tmp_terminal = Terminal.Terminal(name, path, exe, data_folder)
+            tmp_terminal = Terminal.Terminal(name, path, exe, data_folder, Launcher.make_launcher(launcher_name))
             self.terminals.append(tmp_terminal)
 
         # Create the worker pool of MT4 terminals to be used at runtime
@@ -328,6 +416,57 @@ class GlobalConfig:
         self.calculate_sharpe = tmp_args.get('CalculateSharpe', False)
         self.risk_free_rate = tmp_args.get('RiskFreeRate', 0.0)
 
+        # Optional HTM report post-processing parameters: number of processes parsing reports concurrently, and
+        # whether to use the single pass streaming parser (recommended for large, every tick reports)
+        self.parser_workers = max(1, int(tmp_args.get('ParserWorkers', 1)))
+        self.streaming_parser = tmp_args.get('StreamingParser', False)
+        # Individual trades are written as <SYMBOL>_TRADES.csv, <SYMBOL>_TRADES.npz (compact, see TradeTable) or both
+        self.trades_format = str(tmp_args.get('TradesFormat', 'csv')).lower()
+        if self.trades_format not in TRADES_FORMATS:
+            logging.error("TradesFormat must be one of: {}".format(", ".join(TRADES_FORMATS)))
+            sys.exit(20)
+        # Optionally keep only the best passes of optimization reports in RESULTS.csv: the top 'OptimizationTop' passes
+        # by a single metric, or the Pareto front over several metrics (see PassSelector.py)
+        self.optimization_metrics = tmp_args.get('OptimizationMetrics', []) or []
+        if isinstance(self.optimization_metrics, str):
+            self.optimization_metrics = [self.optimization_metrics]
+        self.optimization_top = int(tmp_args.get('OptimizationTop', 0) or 0)
+        for metric in self.optimization_metrics:
+            if metric not in PASS_METRICS:
+                logging.error("OptimizationMetrics must be among: {}".format(", ".join(PASS_METRICS)))
+                sys.exit(21)
+        if len(self.optimization_metrics) == 1 and self.optimization_top <= 0:
+            logging.error("OptimizationTop is needed to select the best passes by a single metric")
+            sys.exit(21)
+
+        # Analyze the symbols of the batch as a single portfolio once all reports are parsed (see Portfolio.py)
+        self.portfolio_analysis = tmp_args.get('PortfolioAnalysis', False)
+        # Parse each report as soon as its test is completed, rather than after the entire batch
+        self.parse_while_running = tmp_args.get('ParseWhileRunning', True)
+
+        # Optional order to hand over the symbols to the terminals (as listed, reverse, shuffle or longest first)
+        self.dispatch_order = str(tmp_args.get('DispatchOrder', 'listed')).lower()
+        if self.dispatch_order not in DISPATCH_ORDERS:
+            logging.error("DispatchOrder must be one of: {}".format(", ".join(DISPATCH_ORDERS)))
+            sys.exit(19)
+
+        # Optional per-test timeouts. A test running longer than its timeout is considered hung: its terminal is killed
+        # and the test is queued again for another terminal, up to 'TestRetries' times.
+        self.test_timeout = float(tmp_args.get('TestTimeout', 0))
+        self.test_timeout_scale = float(tmp_args.get('TestTimeoutScale', 0))
+        self.test_retries = max(0, int(tmp_args.get('TestRetries', 1)))
+
+        # Optional pruning rule, evaluated as the tests of the batch complete. A symbol falls short when its profit
+        # factor or net profit is below the given threshold.
+        self.prune_after = max(0, int(tmp_args.get('PruneAfter', 0) or 0))
+        prune_profit_factor = tmp_args.get('PruneProfitFactor', None)
+        self.prune_profit_factor = float(prune_profit_factor) if prune_profit_factor is not None else None
+        prune_net_profit = tmp_args.get('PruneNetProfit', None)
+        self.prune_net_profit = float(prune_net_profit) if prune_net_profit is not None else None
+        if self.prune_after > 0 and self.prune_profit_factor is None and self.prune_net_profit is None:
+            logging.error("PruneAfter needs a threshold to prune by (PruneProfitFactor and/or PruneNetProfit)")
+            sys.exit(22)
+
     def ingest_test_maker_config(self, custom_config_fn):
         """
         This configuration is meant to be used for 'test_case_maker.py' only. It ingests the provided input to decide
@@ -418,6 +557,7 @@ class GlobalConfig:
 
         This structure assumes hard linked data folders and tests will fail if the MT4 instances are not configured
         in that way.
+        :return: False if there's nothing to run, i.e. repairing results that are already complete
         """
 
         # In case only one symbol is defined as a variable rather than list in the YAML file,
@@ -458,6 +598,10 @@ class GlobalConfig:
 
         # The full path to the expert parameters file (*.set)
         self.abs_expert_path = os.path.join(self.global_shared_folder, 'tester', self.expert_config)
+        # The compiled expert itself, terminal.exe looks it up under MQL4\Experts
+        self.abs_expert_ex4 = os.path.join(self.global_shared_folder, 'MQL4', 'Experts', self.expert)
+        if os.path.splitext(self.abs_expert_ex4)[1] == '':
+            self.abs_expert_ex4 += '.ex4'
 
         # Move the expert parameters file and test YAML configuration to results folders as a backup/reference
         # TODO: CONSIDER DOING THIS AFTER CHECKING IF A RUN IS NEEDED
@@ -474,55 +618,37 @@ class GlobalConfig:
         self.test_report_csv = os.path.join(self.abs_test_specific_folder, "RESULTS.csv")
         self.trades_report_csv = os.path.join(self.abs_test_specific_folder,
                                               "TRADES.csv")  # v1.0: Added for individual trades
+        self.trades_store = os.path.join(self.abs_test_specific_folder, "TRADES.npz")
+        self.portfolio_csv = os.path.join(self.abs_test_specific_folder, "PORTFOLIO.csv")
 
         # Identify if the request if for a new set of symbols, or repairing a set with missing results.
-        # print("DEBUG >>> self.symbols: {}".format(self.symbols))
-        if os.path.exists(self.test_report_csv):
-            if self.is_repair:
-                results_dict = Utils.csv_to_dict(self.test_report_csv)
-                # print("DEBUG >>> results_dict: {}".format(results_dict))
-                for line in results_dict:
-                    # Sometimes a symbol is processed, but the result may be blank
-                    if int(line['Total trades']) == 0:
-                        continue
-                    else:
-                        # Remove symbols that are already processed correctly
-                        try:
-                            self.symbols.remove(line['Symbol'])
-                        except ValueError:
-                            pass
-
-                    # At this point, symbols missing from the CSV file and symbols with a blank line should
-                    # remain in the list to be processed
-            elif self.is_delete:
+        # A repair also looks at the reports on disk when there are no results, e.g. an earlier run was stopped before
+        # parsing its reports.
+        if self.is_repair:
+            self.__plan_repair()
+            if len(self.symbols) == 0:
+                print("Could not find any symbols to process/repair, all of the results look complete and intact.")
+                return False
+        elif os.path.exists(self.test_report_csv):
+            if self.is_delete:
                 print("Overwrite (-d) requested, all existing results will be overwritten.")
             else:
                 logging.error("Found existing results for this case. You must specify either '-r' to repair missing "
                               "results or '-d' to overwrite existing.")
                 sys.exit(61)
 
-            if len(self.symbols) == 0:
-                print("Could not find any symbols to process/repair, all of the results look complete and intact.")
-                sys.exit(0)
-
-            print("Identified symbols to process/repair: ", self.symbols)
-            current_csv = Utils.csv_to_dict(self.test_report_csv)
-            retained_csv = []
-            for line in current_csv:
-                if line['Symbol'] in self.symbols:
-                    continue
-                else:
-                    retained_csv.append(line)
-            # If the retained_csv is of size zero, dict_to_csv() doesn't know what to do with it.
-            # So we simply remove the existing CVS as there're no results to salvage.
-            if len(retained_csv) == 0:
-                os.remove(self.test_report_csv)
-            else:
-                Utils.dict_to_csv(retained_csv, self.test_report_csv, overwrite=True)
-
+        reparse_symbols = set(self.reparse_symbols)
         # terminal.exe doesn't know how to handle multiple pairs (wouldn't it be nice!), so we create a file for each
-        mt4_id_counter = 1
+        # The expert parameters are read once, each symbol's set file only differs by its MT4_ID
+        set_template = None
+        if any(symbol not in reparse_symbols for symbol in self.symbols):
+            set_template = FieldTemplate(self.abs_expert_path)
+        mt4_id_counter = self.mt4_id_start
         for symbol in self.symbols:
+            if symbol in reparse_symbols:
+                # Its report is fine, it's only parsed again
+                self.htm_reports[symbol] = os.path.join(self.abs_reports_folder, symbol + ".htm")
+                continue
             tmp_symbol_ini_fn = os.path.join(self.ini_dir, symbol + ".ini")
             # License changes after 20-BETA requires a separate set file for each test (for different MT4 IDs)
             tmp_symbol_set_fn = os.path.join(self.set_dir, symbol + ".set")
@@ -532,16 +658,13 @@ class GlobalConfig:
             # print("DEBUG: tmp_symbol_set_fn = {}".format(tmp_symbol_set_fn))
             # print("DEBUG: tmp_symbol_set_fn_abs = {}".format(tmp_symbol_set_fn_abs))
 
-            try:
-                # Each symbol gets its own set file starting from 20 BETA version
-                shutil.copy(self.abs_expert_path, tmp_symbol_set_fn_abs)
-            except shutil.SameFileError:
-                pass
-
-            Utils.modify_fields_in_place({"MT4_ID": mt4_id_counter}, tmp_symbol_set_fn_abs)
+            # Each symbol gets its own set file starting from 20 BETA version
+            Utils.write_file(tmp_symbol_set_fn_abs, set_template.render({"MT4_ID": mt4_id_counter}),
+                             atomic=self.atomic_writes)
             mt4_id_counter += 1
 
             self.work_inputs.append(tmp_symbol_ini_fn)
+            self.work_symbols[tmp_symbol_ini_fn] = symbol
             # terminal.exe expects a relative path
             tmp_test_report_htm = os.path.join(self.relative_reports_folder, symbol + ".htm")
             # we also need the absolute path for the htm->csv parser
@@ -549,7 +672,7 @@ class GlobalConfig:
             abs_tmp_report_gif = os.path.join(self.abs_reports_folder, symbol + ".gif")
             # We need to delete existing gif files if re-running the case because MT4 doesn't overwrite them.
             # While we are on it, we delete .htm files too, although MT4 overwrites them.
-            for f in abs_tmp_report_gif, abs_test_report_htm, tmp_symbol_ini_fn:
+            for f in abs_tmp_report_gif, abs_test_report_htm:
                 if os.path.exists(f):
                     try:
                         print("Removing existing file: ", f)
@@ -560,36 +683,104 @@ class GlobalConfig:
                         sys.exit(69)
 
             self.htm_reports[symbol] = abs_test_report_htm
-            with open(tmp_symbol_ini_fn, 'w') as ini_file:
-                ini_file.write("; Automatically generated by hpFX -- do not edit\n")
-                ini_file.write("; Broker Login Information \n")
-                ini_file.write("Server={}\n".format(self.broker_server))
-                ini_file.write("Login={}\n".format(self.broker_login))
-                ini_file.write("Password={}\n".format(self.broker_password))
-                ini_file.write("; System Configuration \n")
-                ini_file.write("ExpertsEnable=true\n")
-                ini_file.write("ExpertsDllImport=true\n")
-                ini_file.write("ExpertsExpImport=true\n")
-                ini_file.write("; Test Expert Information \n")
-                ini_file.write("TestExpert={}\n".format(self.expert))
+            Utils.write_file(tmp_symbol_ini_fn, self.__ini_content(symbol, tmp_symbol_set_fn, tmp_test_report_htm),
+                             atomic=self.atomic_writes)
+
+        return True
+
+    def __ini_content(self, symbol, set_fn, report_htm):
+        """
+        :param set_fn: Expert parameters of the test, relative to '<data_folder>\\tester'
+        :param report_htm: Report of the test, relative to '<data_folder>'
+        :return: Test configuration (ini) of the given symbol, as a list of lines
+        """
+        shut_down_terminal = 'true'
+        if self.is_debug:
+            shut_down_terminal = 'false'
+        return ["; Automatically generated by hpFX -- do not edit\n",
+                "; Broker Login Information \n",
+                "Server={}\n".format(self.broker_server),
+                "Login={}\n".format(self.broker_login),
+                "Password={}\n".format(self.broker_password),
+                "; System Configuration \n",
+                "ExpertsEnable=true\n",
+                "ExpertsDllImport=true\n",
+                "ExpertsExpImport=true\n",
+                "; Test Expert Information \n",
+                "TestExpert={}\n".format(self.expert),
                 # IMPORTANT: TestExpertParameters must be relative to the '<data_folder>\tester'
-                ini_file.write("TestExpertParameters={}\n".format(tmp_symbol_set_fn))
-                ini_file.write("TestSymbol={}\n".format(symbol))
-                ini_file.write("TestPeriod={}\n".format(self.time_frame))
-                ini_file.write("TestModel={}\n".format(self.test_model))
-                ini_file.write("TestSpread={}\n".format(self.spread))
-                ini_file.write("TestOptimization={}\n".format(self.optimization))
-                ini_file.write("TestDateEnable=true\n")
-                ini_file.write("TestFromDate={}\n".format(self.date_from))
-                ini_file.write("TestToDate={}\n".format(self.date_to))
+                "TestExpertParameters={}\n".format(set_fn),
+                "TestSymbol={}\n".format(symbol),
+                "TestPeriod={}\n".format(self.time_frame),
+                "TestModel={}\n".format(self.test_model),
+                "TestSpread={}\n".format(self.spread),
+                "TestOptimization={}\n".format(self.optimization),
+                "TestDateEnable=true\n",
+                "TestFromDate={}\n".format(self.date_from),
+                "TestToDate={}\n".format(self.date_to),
                 # IMPORTANT: TestReport must be relative to the '<data_folder>' UNLIKE TestExpertParameters!!!
-                ini_file.write("TestReport={}\n".format(tmp_test_report_htm))
-                ini_file.write("TestReplaceReport=true\n")
-                shut_down_terminal = 'true'
-                if self.is_debug:
-                    shut_down_terminal = 'false'
-                ini_file.write("TestShutdownTerminal={}\n".format(shut_down_terminal))
-                ini_file.write("TestVisualEnable=false\n")
+                "TestReport={}\n".format(report_htm),
+                "TestReplaceReport=true\n",
+                "TestShutdownTerminal={}\n".format(shut_down_terminal),
+                "TestVisualEnable=false\n"]
+
+    @staticmethod
+    def __has_trades(total_trades):
+        # Sometimes a symbol is processed, but the result may be blank
+        try:
+            return int(total_trades) > 0
+        except (TypeError, ValueError):
+            return False
+
+    def __is_valid_report(self, symbol, htm_fn):
+        """
+        :return: True if htm_fn is a complete Strategy Tester Report of the symbol, with trades
+        """
+        if not os.path.exists(htm_fn):
+            return False
+        try:
+            summary = HTMParser(htm_fn).summary
+        # HTMParser calls sys.exit() on reports it can't read
+        except (Exception, SystemExit):
+            return False
+        return summary is not None and summary['Symbol'] == symbol and self.__has_trades(summary.get('Total trades'))
+
+    def __plan_repair(self):
+        """
+        Sorts the symbols to repair out in a single pass over RESULTS.csv (if any):
+        - symbols with valid results are left alone, their rows are kept
+        - symbols with a valid HTM report that wasn't parsed (e.g. hpFX was stopped while parsing) are only parsed again
+          (see reparse_symbols)
+        - the remaining ones are tested again
+        self.symbols is left with the last two, in their original order.
+        """
+        rows = []
+        if os.path.exists(self.test_report_csv):
+            rows = Utils.csv_to_dict(self.test_report_csv)
+        completed = set(row.get('Symbol') for row in rows if self.__has_trades(row.get('Total trades')))
+
+        to_repair = [s for s in self.symbols if s not in completed]
+        self.reparse_symbols = [s for s in to_repair
+                                if self.__is_valid_report(s, os.path.join(self.abs_reports_folder, s + ".htm"))]
+        self.symbols = to_repair
+        if len(to_repair) == 0:
+            return
+
+        if len(self.reparse_symbols) > 0:
+            print("Identified symbols to parse again: ", self.reparse_symbols)
+        reparse_symbols = set(self.reparse_symbols)
+        print("Identified symbols to process/repair: ", [s for s in to_repair if s not in reparse_symbols])
+
+        to_repair = set(to_repair)
+        retained_rows = [row for row in rows if row.get('Symbol') not in to_repair]
+        if len(retained_rows) == len(rows):
+            return
+        # If the retained_csv is of size zero, dict_to_csv() doesn't know what to do with it.
+        # So we simply remove the existing CVS as there're no results to salvage.
+        if len(retained_rows) == 0:
+            os.remove(self.test_report_csv)
+        else:
+            Utils.dict_to_csv(retained_rows, self.test_report_csv, overwrite=True)
 
 
 class ExpertIni:
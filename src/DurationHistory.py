@@ -0,0 +1,54 @@
+from datetime import datetime
+from src import Utils
+import logging
+import os
+
+
+class DurationHistory:
+    """
+    Wall-clock durations of completed tests, kept in a CSV file so that later runs can predict how long each symbol
+    will take and dispatch the longest tests first.
+
+    Durations are stored along with the length of the tested date range and predictions are scaled to the requested
+    range, so a 3 year history is still useful to predict a 1 year test of the same symbol, period and model.
+    """
+
+    # Only the most recent runs are used for predictions, so they follow hardware/data changes
+    RECENT_RUNS = 5
+
+    def __init__(self, history_csv):
+        self.history_csv = history_csv
+        # (symbol, period, model) -> list of seconds per tested day, oldest first
+        self.__rates = {}
+
+        if os.path.exists(self.history_csv):
+            for row in Utils.csv_to_dict(self.history_csv):
+                try:
+                    rate = float(row['Seconds']) / max(int(row['Days']), 1)
+                    self.__rates.setdefault((row['Symbol'], row['Period'], row['Model']), []).append(rate)
+                except (KeyError, ValueError, TypeError):
+                    logging.warning("Skipping malformed line in {}: {}".format(self.history_csv, row))
+
+    @staticmethod
+    def test_days(date_from, date_to):
+        """
+        :return: Number of days between the 'YYYY.MM.DD' formatted test dates (at least 1)
+        """
+        days = (datetime.strptime(date_to, '%Y.%m.%d') - datetime.strptime(date_from, '%Y.%m.%d')).days
+        return max(days, 1)
+
+    def predict(self, symbol, period, model, days):
+        """
+        :return: Predicted duration in seconds, or None if the symbol/period/model was never tested before
+        """
+        rates = self.__rates.get((symbol, str(period), str(model)))
+        if not rates:
+            return None
+        recent = rates[-self.RECENT_RUNS:]
+        return sum(recent) / len(recent) * days
+
+    def record(self, symbol, period, model, days, seconds):
+        self.__rates.setdefault((symbol, str(period), str(model)), []).append(seconds / max(days, 1))
+        Utils.dict_to_csv([{'Symbol': symbol, 'Period': period, 'Model': model, 'Days': days,
+                            'Seconds': round(seconds, 2), 'Date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}],
+                          self.history_csv)
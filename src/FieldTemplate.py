@@ -0,0 +1,30 @@
+from src.Utils import keyword_slots, read_set_file, render_fields
+
+
+class FieldTemplate:
+    """
+    A *.set or hpFX YAML template, read once and indexed by the lines of its keyword_dict{} fields, so many variations
+    of it can be rendered in memory:
+
+        set_template = FieldTemplate("template.set")
+        content = set_template.render({"SIGNAL": "...", "SIGNAL_USAGE": 0}, {"MT4_ID": 3})
+
+    Rendering gives the same result as copying the template and calling modify_fields_in_place() with each of the
+    dictionaries in turn.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.lines = read_set_file(fn)
+        # keyword_dict{} key -> indices of the lines holding its value
+        self.slots = keyword_slots(self.lines)
+
+    def render(self, *values):
+        """
+        :param values: Dictionaries of values to replace, by keyword_dict{} key (GIVEN_NAME is ignored). Later ones
+                       take precedence.
+        :return: The content of the rendered file
+        """
+        lines = self.lines
+        for fields in values:
+            lines = render_fields(fields, lines, self.slots)
+        return "".join(lines)
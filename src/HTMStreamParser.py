@@ -0,0 +1,268 @@
+from lxml import etree
+
+"""
+    Single pass, streaming reader for MT4 HTM reports. It is used by HTMParser as an alternative to BeautifulSoup when
+    the reports are too large to be loaded into a tree and walked several times.
+
+    The reader is driven by lxml's HTML target parser, i.e. the same event stream BeautifulSoup consumes when it is
+    used with the "lxml" backend. Only the <tr> being parsed is kept as a (tiny) tree; everything else is reduced to
+    the values HTMParser needs as soon as the row closes, so the results match the BeautifulSoup based helpers.
+"""
+
+REPORT_TYPES = ("Strategy Tester Report", "Optimization Report")
+
+_PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+# Background color MT4 uses for the header row of the trades table
+_TRADE_HEADER_BGCOLOR = "#C0C0C0"
+
+
+class _Comment(str):
+    pass
+
+
+class _Node:
+    """Bare minimum of a parsed element, only built for the contents of a <tr>."""
+    __slots__ = ('tag', 'attrs', 'children')
+
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+
+    def iter(self, tag):
+        # Pre-order, same as BeautifulSoup's find_all()
+        for child in self.children:
+            if isinstance(child, _Node):
+                if child.tag == tag:
+                    yield child
+                yield from child.iter(tag)
+
+    @property
+    def text(self):
+        return "".join(self.__strings())
+
+    def __strings(self):
+        for child in self.children:
+            if isinstance(child, _Node):
+                yield from child.__strings()
+            elif not isinstance(child, _Comment):
+                yield child
+
+    @property
+    def string(self):
+        # Mirrors Tag.string: the only child if it is a string, or the only child's .string
+        if len(self.children) != 1:
+            return None
+        child = self.children[0]
+        if isinstance(child, _Node):
+            return child.string
+        return child
+
+
+class _Table:
+    __slots__ = ('index', 'rows', 'status')
+
+    def __init__(self, index):
+        self.index = index
+        self.rows = []
+        # None until the first header row is seen, then either 'trades' or 'other'
+        self.status = None
+
+
+class HTMStreamParser:
+    """
+    Collects everything HTMParser extracts from a report in one streaming pass:
+    report type strings, summary fields, initial deposit and the trades table. Optimization passes are read by
+    OptimizationReader.
+    """
+
+    # Characters fed to lxml at a time, the whole report is never held in memory
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, fn, summary_passes):
+        """
+        :param fn: HTM report to read
+        :param summary_passes: (extract_fields, shift_by) tuples, as used by HTMParser.__parse_experiment_report()
+        """
+        self.__fn = fn
+        self.__summary_passes = [(tuple(fields), shift_by) for fields, shift_by in summary_passes]
+
+        # Results
+        self.report_types = []
+        self.summary = {p: {} for p in self.__summary_passes}
+        self.initial_deposit = None
+        self.trade_rows = None
+
+        # Parser state
+        self.__data = []
+        self.__preserve_whitespace = 0
+        self.__nodes = []
+        self.__pending_rows = []
+        self.__open_tables = []
+        self.__table_counter = 0
+        self.__trade_table = None
+        self.__until = None
+        self.__stopped = False
+        # False if the parsing was stopped before the end of the report, see parse()
+        self.is_complete = False
+
+    def parse(self, until=None):
+        """
+        :param until: Optional function of the parser, checked once the report type is found and whenever a top level
+                      table ends. The rest of the report is skipped as soon as it returns True, e.g. once the summary
+                      fields are found. The trades table isn't collected then.
+        """
+        self.__until = until
+        parser = etree.HTMLParser(target=self, recover=True, huge_tree=False, encoding=None)
+        with open(self.__fn) as input_htm:
+            data = input_htm.read(self.CHUNK_SIZE)
+            # BeautifulSoup drops the byte order mark before handing the markup to lxml
+            if data.startswith('\N{BYTE ORDER MARK}'):
+                data = data[1:]
+            parser.feed(data)
+            while data and not self.__stopped:
+                data = input_htm.read(self.CHUNK_SIZE)
+                if data:
+                    parser.feed(data)
+        parser.close()
+        self.is_complete = not self.__stopped
+        return self
+
+    # ---- lxml target interface ----
+
+    def start(self, tag, attrib, nsmap=None):
+        if self.__stopped:
+            return
+        self.__end_data()
+        if tag in _PRESERVE_WHITESPACE_TAGS:
+            self.__preserve_whitespace += 1
+
+        if tag == 'table':
+            table = _Table(self.__table_counter)
+            self.__table_counter += 1
+            self.__open_tables.append(table)
+
+        if tag == 'tr' or self.__nodes:
+            node = _Node(tag, dict(attrib))
+            if self.__nodes:
+                self.__nodes[-1].children.append(node)
+            self.__nodes.append(node)
+            if tag == 'tr':
+                # Rows are handled in document order once the outermost <tr> is complete
+                self.__pending_rows.append((node, list(self.__open_tables)))
+
+    def end(self, tag):
+        if self.__stopped:
+            return
+        self.__end_data()
+        if tag in _PRESERVE_WHITESPACE_TAGS:
+            self.__preserve_whitespace -= 1
+
+        if self.__nodes:
+            self.__nodes.pop()
+            if not self.__nodes:
+                for row, tables in self.__pending_rows:
+                    self.__process_row(row, tables)
+                self.__pending_rows = []
+
+        if tag == 'table' and self.__open_tables:
+            table = self.__open_tables.pop()
+            # A table that ended without a header row can't be the trades table. Its rows are only released when the
+            # table isn't nested in a row that is still pending.
+            if table.status is None and not self.__nodes:
+                table.status = 'other'
+                table.rows = []
+            if self.__until is not None and not self.__open_tables and not self.__nodes and self.__until(self):
+                # Stopped: whatever is left of the current chunk is ignored
+                self.__end_data()
+                self.__stopped = True
+
+    def data(self, content):
+        if not self.__stopped:
+            self.__data.append(content)
+
+    def comment(self, text):
+        if self.__stopped:
+            return
+        self.__end_data()
+        if self.__nodes:
+            self.__nodes[-1].children.append(_Comment(text))
+
+    def doctype(self, *args):
+        self.__end_data()
+
+    def pi(self, *args):
+        self.__end_data()
+
+    def close(self):
+        if self.__stopped:
+            return
+        self.__end_data()
+        if self.__trade_table is not None:
+            self.trade_rows = self.__trade_table.rows
+
+    # ---- internals ----
+
+    def __end_data(self):
+        if not self.__data:
+            return
+        current_data = "".join(self.__data)
+        self.__data = []
+        # Whitespace only strings are collapsed exactly like BeautifulSoup.endData() does
+        if not self.__preserve_whitespace and all(c in _ASCII_SPACES for c in current_data):
+            current_data = "\n" if "\n" in current_data else " "
+
+        if current_data in REPORT_TYPES:
+            self.report_types.append(current_data)
+            # The report type comes before the first table, a pass that only identifies the report stops right here
+            if self.__until is not None and not self.__open_tables and not self.__nodes and self.__until(self):
+                self.__stopped = True
+        if self.__nodes:
+            self.__nodes[-1].children.append(current_data)
+
+    def __process_row(self, row, tables):
+        cells = list(row.iter('td'))
+        cell_strings = [c.string for c in cells]
+        texts = None
+
+        for extract_fields, shift_by in self.__summary_passes:
+            if any(s in extract_fields for s in cell_strings if s is not None):
+                texts = texts or [c.text for c in cells]
+                cell = iter(texts[shift_by:])
+                for field, val in zip(cell, cell):
+                    if field:
+                        self.summary[(extract_fields, shift_by)][field] = val
+
+        if self.initial_deposit is None and "Initial deposit" in cell_strings and len(cells) >= 2:
+            texts = texts or [c.text for c in cells]
+            try:
+                self.initial_deposit = float(texts[1].strip())
+            except ValueError:
+                pass
+
+        self.__collect_trade_row(row, cells, tables)
+
+    def __collect_trade_row(self, row, cells, tables):
+        # Optimization reports don't have trades, don't bother buffering their (possibly huge) tables
+        if self.report_types == ["Optimization Report"]:
+            return
+
+        for table in tables:
+            if table.status == 'other':
+                continue
+            # Only a table that started before the trades table found so far can still take its place
+            if self.__trade_table is not None and table.index > self.__trade_table.index:
+                continue
+            table.rows.append([c.text.strip() for c in cells])
+
+            if table.status is None and row.attrs.get('bgcolor') == _TRADE_HEADER_BGCOLOR:
+                headers = table.rows[-1]
+                if "Time" in headers and "Type" in headers and "Order" in headers:
+                    table.status = 'trades'
+                    if self.__trade_table is None or table.index < self.__trade_table.index:
+                        self.__trade_table = table
+                else:
+                    table.status = 'other'
+                    table.rows = []
@@ -0,0 +1,113 @@
+import os
+import subprocess
+import logging
+import sys
+
+"""
+    Launchers start a terminal for a given test input (ini file) and wait until it exits. They are attached to each
+    Terminal, so ProcessPool doesn't need to know how (or where) a terminal is actually started.
+
+    run() returns the exit status of the terminal, or None if it was still running after 'timeout' seconds, in which
+    case it's killed.
+"""
+
+
+def kill_executable(exe):
+    """
+    Kills every instance started from the given executable, no matter which process launched it (Windows only)
+    """
+    command = "WMIC Process Where \"ExecutablePath=\'{}\'\" Call Terminate  2>&1>NUL".format(exe)
+    command = command.replace('\\', '\\\\')
+    os.system(command)
+
+
+class ShellLauncher:
+    """
+    Launches MT4 through the Windows shell, in a minimized window. This is how hpFX always launched terminals.
+    """
+    def run(self, terminal, input_ini, timeout=None):
+        # command = 'call "{}" "{}"'.format(terminal.exe, input_ini)
+        # Switched to using 'start' because unlike 'call' it offers an option to start in a minimized window
+        command = 'start /b /wait /min "" "{}" "{}"'.format(terminal.exe, input_ini)
+        if timeout is None:
+            return os.system(command)
+
+        # Same command, but we need a handle on the shell to stop waiting for it
+        shell = subprocess.Popen(command, shell=True)
+        try:
+            return shell.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # Killing the shell would leave the terminal running, kill the terminal and the shell returns
+            self.kill(terminal)
+            shell.wait()
+            return None
+
+    def kill(self, terminal):
+        kill_executable(terminal.exe)
+
+
+class SubprocessLauncher:
+    """
+    Launches the terminal as a child process, without going through a shell. It works on any platform, so it can also
+    run a stand-in for terminal.exe (see bin/fake_terminal.py) to test and benchmark hpFX where MT4 isn't available.
+    """
+    def __init__(self, command=None, cwd=None):
+        """
+        :param command: Command line (list) to run instead of the terminal's executable. The ini file is appended.
+        :param cwd: Working directory for the launched process, defaults to the terminal's data folder
+        """
+        self.command = command
+        self.cwd = cwd
+        self.__process = None
+
+    def run(self, terminal, input_ini, timeout=None):
+        command = (self.command or [terminal.exe]) + [input_ini]
+        cwd = self.cwd or terminal.data_folder
+        startupinfo = None
+        if sys.platform == 'win32':
+            # Same as 'start /min': keep the terminal window minimized
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = 7  # SW_SHOWMINNOACTIVE
+        try:
+            self.__process = subprocess.Popen(command, cwd=cwd, startupinfo=startupinfo)
+        except OSError as e:
+            logging.error("Cannot launch {}: {}".format(" ".join(command), e))
+            return -1
+        try:
+            return self.__process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.__process.kill()
+            self.__process.wait()
+            return None
+        finally:
+            self.__process = None
+
+    def kill(self, terminal):
+        # The process started by this launcher is only known in the worker process running it. kill_all_terminals()
+        # runs in the main process, so stray terminals are killed by their executable path, like ShellLauncher does.
+        # A stand-in command (e.g. fake_terminal.py run by the Python interpreter) is never killed by path.
+        if self.__process is not None:
+            self.__process.kill()
+        if self.command is None and sys.platform == 'win32':
+            kill_executable(terminal.exe)
+
+    def __getstate__(self):
+        # A running Popen can't be handed over to another process
+        state = self.__dict__.copy()
+        state['_SubprocessLauncher__process'] = None
+        return state
+
+
+LAUNCHERS = {'shell': ShellLauncher, 'subprocess': SubprocessLauncher}
+
+
+def make_launcher(name):
+    """
+    :param name: One of the LAUNCHERS, as given by 'terminal_launcher' in the global configuration
+    """
+    try:
+        return LAUNCHERS[name]()
+    except KeyError:
+        logging.error("Unknown terminal launcher '{}', must be one of: {}".format(name, ", ".join(LAUNCHERS)))
+        sys.exit(12)
@@ -0,0 +1,197 @@
+from lxml import etree
+import csv
+import logging
+import re
+import numpy as np
+
+# Visible columns of each pass in MT4 Optimization Reports, and the types of their values
+RESULT_COLUMNS = ['Pass', 'Profit', 'Total trades', 'Profit factor', 'Expected Payoff', 'Drawdown $', 'Drawdown %',
+                  'OnTester result']
+RESULT_TYPES = [int, float, int, float, float, float, float, float]
+
+# The expert inputs of each pass are only listed in the title of its first cell: "INPUT_A=1; INPUT_B=2.5; ..."
+INPUT_PATTERN = re.compile('(INPUT_[^=;]*)=([^;]*);')
+
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+def typed_value(text, value_type=None):
+    """
+    :param value_type: int or float, or None to guess it from the text (strings that aren't numbers are kept as is)
+    :return: The value of the text, None if it's not of the given type
+    """
+    if value_type is not None:
+        try:
+            return value_type(text)
+        except ValueError:
+            return None
+    for guessed_type in (int, float):
+        try:
+            return guessed_type(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _collapse(text):
+    # Whitespace only strings are collapsed like BeautifulSoup does, so cell texts match HTMParser's
+    if text.strip(_ASCII_SPACES) != '':
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def _cell_text(cell):
+    if len(cell) == 0:
+        # Plain cells, i.e. nearly all of them
+        return _collapse(cell.text) if cell.text else ''
+    return "".join(_collapse(t) for t in cell.itertext())
+
+
+class OptimizationReader:
+    """
+    Streaming reader for MT4 Optimization Reports, which may list hundreds of thousands of passes (e.g. genetic
+    optimizations). The report is fed to lxml in chunks and the passes are handed out as soon as their row is parsed,
+    so only one chunk of the report is in memory at a time.
+
+    The names of the expert inputs (INPUT_...) are taken from the report itself, i.e. from the first pass.
+
+        reader = OptimizationReader("OptimizationReport.htm")
+        for optimization_pass in reader.passes():   # typed values
+            ...
+        reader.to_csv("OPTIMIZATION.csv")           # or straight to disk
+    """
+
+    # Characters fed to lxml at a time
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.symbol = None
+        # Names of the expert inputs, known once the first pass is read
+        self.input_names = None
+
+    @property
+    def columns(self):
+        """
+        :return: Names of the values of each pass: pair, results and inputs. Inputs are only known once a pass is read.
+        """
+        return ['Pair'] + RESULT_COLUMNS + (self.input_names or [])
+
+    def __html_rows(self):
+        """
+        Yields the cells of each <tr> as (title, text) tuples, as soon as the row is parsed.
+        """
+        parser = etree.HTMLPullParser(events=('end',), tag='tr', recover=True)
+        with open(self.fn) as input_htm:
+            data = input_htm.read(self.CHUNK_SIZE)
+            # BeautifulSoup drops the byte order mark before handing the markup to lxml
+            if data.startswith('\N{BYTE ORDER MARK}'):
+                data = data[1:]
+            while data:
+                parser.feed(data)
+                yield from self.__release_rows(parser)
+                data = input_htm.read(self.CHUNK_SIZE)
+        parser.close()
+        yield from self.__release_rows(parser)
+
+    @staticmethod
+    def __release_rows(parser):
+        for _, row in parser.read_events():
+            yield [(cell.get('title'), _cell_text(cell)) for cell in row.iter('td')]
+            # Drop the rows already read, so the tree doesn't grow with the report
+            row.clear(keep_tail=True)
+            while row.getprevious() is not None:
+                del row.getparent()[0]
+
+    def raw_passes(self):
+        """
+        Yields the passes as (pair, result texts, [(input name, input text), ...]), exactly as found in the report.
+        """
+        for cells in self.__html_rows():
+            texts = [text for _, text in cells]
+            if 'Symbol' in texts and len(texts) > 1:
+                # "EURUSD (Euro vs US Dollar)"
+                self.symbol = texts[1].split()[0] if texts[1].split() else None
+                continue
+            # Pass rows are the only ones with a title, listing the inputs of the pass
+            title = next((title for title, _ in cells if title is not None), None)
+            if title is None:
+                continue
+            inputs = INPUT_PATTERN.findall(title)
+            if self.input_names is None:
+                self.input_names = [name for name, _ in inputs]
+            yield self.symbol, texts, inputs
+
+    def rows(self):
+        """
+        Yields the passes as dicts of their texts, as written to the CSV file.
+        """
+        for symbol, texts, inputs in self.raw_passes():
+            row = {'Pair': symbol}
+            row.update(zip(RESULT_COLUMNS, texts))
+            row.update(inputs)
+            yield row
+
+    def passes(self):
+        """
+        Yields the passes as dicts of typed values: ints and floats for the results (None if a value can't be read),
+        and ints, floats or strings for the inputs.
+        """
+        for symbol, texts, inputs in self.raw_passes():
+            optimization_pass = {'Pair': symbol}
+            for column, value_type, text in zip(RESULT_COLUMNS, RESULT_TYPES, texts):
+                optimization_pass[column] = typed_value(text, value_type)
+            for name, text in inputs:
+                optimization_pass[name] = typed_value(text)
+            yield optimization_pass
+
+    def chunks(self, size=10000):
+        """
+        Yields the passes in chunks of (up to) 'size' passes, as dicts of column -> NumPy array. Results are float
+        arrays (NaN if a value can't be read), the pair and inputs are string arrays.
+        """
+        buffer = []
+        for raw_pass in self.raw_passes():
+            buffer.append(raw_pass)
+            if len(buffer) == size:
+                yield self.__to_arrays(buffer)
+                buffer = []
+        if len(buffer) > 0:
+            yield self.__to_arrays(buffer)
+
+    def __to_arrays(self, raw_passes):
+        arrays = {'Pair': np.array([str(symbol) for symbol, _, _ in raw_passes])}
+        for c, column in enumerate(RESULT_COLUMNS):
+            values = np.full(len(raw_passes), np.nan)
+            for i, (_, texts, _) in enumerate(raw_passes):
+                if c < len(texts):
+                    value = typed_value(texts[c], float)
+                    values[i] = value if value is not None else np.nan
+            arrays[column] = values
+        for name in self.input_names:
+            arrays[name] = np.array([dict(inputs).get(name, '') for _, _, inputs in raw_passes])
+        return arrays
+
+    def to_csv(self, fn, overwrite=True):
+        """
+        Writes the passes to a CSV file as they are read, appending to fn unless overwrite is set.
+        :return: Number of passes written
+        """
+        num_passes = 0
+        unknown_inputs = set()
+        with open(fn, 'w' if overwrite else 'a+', newline='') as output_file:
+            is_blank = output_file.tell() == 0
+            csv_buffer = None
+            for row in self.rows():
+                if csv_buffer is None:
+                    # The header is only known once the first pass is read
+                    csv_buffer = csv.DictWriter(output_file, self.columns, restval='', extrasaction='ignore')
+                    if is_blank:
+                        csv_buffer.writeheader()
+                for name in set(row).difference(self.columns).difference(unknown_inputs):
+                    logging.warning("Input {} isn't listed for the first pass of {}, it's left out".format(name,
+                                                                                                          self.fn))
+                    unknown_inputs.add(name)
+                csv_buffer.writerow(row)
+                num_passes += 1
+        return num_passes
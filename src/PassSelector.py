@@ -0,0 +1,116 @@
+import heapq
+import numpy as np
+
+# Metrics passes can be selected by, and whether higher values are better
+METRICS = {'Profit': True, 'Total trades': True, 'Profit factor': True, 'Expected Payoff': True,
+           'Drawdown $': False, 'Drawdown %': False, 'OnTester result': True}
+
+
+class PassSelector:
+    """
+    Keeps the best passes of an optimization as they stream in (see OptimizationReader), rather than collecting all
+    of them first:
+    - A single metric keeps the 'top' best passes in a heap, memory never goes beyond 'top' passes
+    - Several metrics keep the Pareto front, i.e. the passes no other pass beats on all metrics at once (e.g. higher
+      Profit with a lower Drawdown %). Only the front is kept, which is a small fraction of the passes in practice.
+
+        selector = PassSelector(['Profit', 'Drawdown %'])
+        best = selector.select(OptimizationReader("OptimizationReport.htm").rows())
+
+    Passes can be dicts of texts or typed values. Passes without a valid value for each metric are left out.
+    """
+    # Size of the Pareto front from which it's faster to compare passes against it with NumPy
+    VECTORIZE_FRONT = 64
+
+    def __init__(self, metrics, top=0):
+        """
+        :param metrics: Metric(s) to select the passes by, see METRICS
+        :param top: Number of passes to keep. Required for a single metric, it limits the number of passes returned
+                    from the Pareto front otherwise (0 for the whole front).
+        """
+        self.metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+        for metric in self.metrics:
+            if metric not in METRICS:
+                raise ValueError("Cannot select passes by '{}', must be one of: {}".format(metric, ", ".join(METRICS)))
+        if len(self.metrics) == 0:
+            raise ValueError("At least one metric is needed to select passes")
+        if len(self.metrics) == 1 and top <= 0:
+            raise ValueError("The number of passes to keep is needed to select passes by a single metric")
+        self.top = top
+        # Scores are negated for the metrics where lower is better, so higher is always better
+        self.__signs = [1.0 if METRICS[m] else -1.0 for m in self.metrics]
+
+        self.__count = 0
+        # Top K: min-heap of (score, -count, pass), the worst of the kept passes at the top
+        self.__heap = []
+        # Pareto front: scores and passes
+        self.__front_scores = []
+        self.__front = []
+        self.__front_array = None
+
+    def __scores(self, optimization_pass):
+        try:
+            scores = [sign * float(optimization_pass[m]) for sign, m in zip(self.__signs, self.metrics)]
+        except (KeyError, TypeError, ValueError):
+            return None
+        # NaN is the only value that doesn't equal itself
+        return scores if all(score == score for score in scores) else None
+
+    def add(self, optimization_pass):
+        scores = self.__scores(optimization_pass)
+        if scores is None:
+            return
+        self.__count += 1
+
+        if len(self.metrics) == 1:
+            # Among passes of the same score, the earlier ones are kept
+            entry = (scores[0], -self.__count, optimization_pass)
+            if len(self.__heap) < self.top:
+                heapq.heappush(self.__heap, entry)
+            elif entry[:2] > self.__heap[0][:2]:
+                heapq.heapreplace(self.__heap, entry)
+            return
+
+        scores = tuple(scores)
+        if self.__is_dominated(scores):
+            return
+        keep = [not (all(s >= f for s, f in zip(scores, front)) and scores != front) for front in self.__front_scores]
+        if not all(keep):
+            self.__front = [p for p, k in zip(self.__front, keep) if k]
+            self.__front_scores = [f for f, k in zip(self.__front_scores, keep) if k]
+        self.__front_scores.append(scores)
+        self.__front.append(optimization_pass)
+        self.__front_array = None
+
+    def __is_dominated(self, scores):
+        # Dominated: another pass is at least as good on all metrics, and better on one. Most passes are, and the front
+        # hardly changes, so large fronts are compared as an array kept until the front changes.
+        if len(self.__front_scores) < self.VECTORIZE_FRONT:
+            return any(all(f >= s for f, s in zip(front, scores)) and front != scores
+                       for front in self.__front_scores)
+        if self.__front_array is None:
+            self.__front_array = np.array(self.__front_scores)
+        front = self.__front_array
+        return bool(np.any(np.all(front >= scores, axis=1) & np.any(front > scores, axis=1)))
+
+    def select(self, passes):
+        """
+        Adds all the given passes.
+        :return: The selected passes, see result()
+        """
+        for optimization_pass in passes:
+            self.add(optimization_pass)
+        return self.result()
+
+    def result(self):
+        """
+        :return: The selected passes, best first (by the first metric for a Pareto front), in order of appearance among
+                 equals
+        """
+        if len(self.metrics) == 1:
+            return [p for _, _, p in sorted(self.__heap, reverse=True)]
+
+        order = sorted(range(len(self.__front)), key=lambda i: (-self.__front_scores[i][0], i))
+        if self.top > 0:
+            order = order[:self.top]
+        return [self.__front[i] for i in order]
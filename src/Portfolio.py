@@ -0,0 +1,165 @@
+import csv
+import logging
+import math
+from datetime import datetime
+import numpy as np
+
+
+class Portfolio:
+    """
+    The symbols of a batch traded together as a single basket: closed trades of all symbols are merged into one time
+    ordered equity curve, starting with the sum of the initial deposits of the symbols.
+
+    Everything is calculated with array operations over the whole batch (cumulative sums, running maximum, monthly
+    buckets), so it scales to multi-year every tick batches with millions of trades:
+    - Drawdown: largest drop of the equity from its running peak, in money and % of the peak
+    - Sharpe and Sortino Ratios of the monthly portfolio returns, annualized like the per-symbol Sharpe Ratios
+    - Correlation matrix of the monthly profits of the symbols
+
+    Note that the equity only moves when trades are closed, floating profits aren't part of the reports.
+    """
+    def __init__(self, trades, date_from, date_to, risk_free_rate=0.0):
+        """
+        :param trades: TradeTable (or TradeStore) with the trades of the symbols
+        :param date_from: Test start date as string 'YYYY.MM.DD'
+        :param date_to: Test end date as string 'YYYY.MM.DD'
+        :param risk_free_rate: Annual risk-free rate as decimal (e.g., 0.02 for 2%)
+        """
+        table = getattr(trades, 'table', trades)
+        self.symbols = list(table.symbols)
+        self.risk_free_rate = risk_free_rate
+        self.first_month = self.__month_index(date_from)
+        self.num_months = max(0, self.__month_index(date_to) - self.first_month + 1)
+
+        closed = table.closed() & ~np.isnan(table['Profit']) & ~np.isnat(table['Time'])
+        if np.count_nonzero(table.closed()) > np.count_nonzero(closed):
+            logging.warning("Ignoring {} closed trade(s) without a valid time or profit in the portfolio".format(
+                np.count_nonzero(table.closed()) - np.count_nonzero(closed)))
+        codes = table['Symbol'][closed]
+        profits = table['Profit'][closed]
+
+        # Deposit of each symbol: its balance before its first closed trade
+        self.deposits = np.zeros(len(self.symbols))
+        if len(codes) > 0:
+            balances = table['Balance'][closed]
+            traded, first = np.unique(codes, return_index=True)
+            self.deposits[traded] = balances[first] - profits[first]
+        self.initial_capital = float(self.deposits.sum())
+
+        # Trades of all symbols, by close time. The sort is stable, trades of the same minute keep their order.
+        order = np.argsort(table['Time'][closed], kind='stable')
+        self.times = table['Time'][closed][order]
+        self.codes = codes[order]
+        self.profits = profits[order]
+
+        self.equity = self.initial_capital + np.cumsum(self.profits)
+        peaks = np.maximum.accumulate(np.concatenate(([self.initial_capital], self.equity)))[1:]
+        self.drawdown = peaks - self.equity
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.drawdown_pct = np.where(peaks > 0, self.drawdown / peaks * 100, 0.0)
+
+    @staticmethod
+    def __month_index(date):
+        date = datetime.strptime(date, '%Y.%m.%d')
+        return date.year * 12 + date.month - 1
+
+    def __month_bounds(self):
+        # First minute of each month of the test period, and of the month after it
+        months = np.arange(self.first_month, self.first_month + self.num_months + 1) - 1970 * 12
+        return months.astype('datetime64[M]').astype('datetime64[m]')
+
+    def monthly_returns(self):
+        """
+        :return: Return of the portfolio in each month of the test period, in % of the equity at the start of the month
+        """
+        # Equity at each month boundary: initial capital plus the profits of all trades closed before it
+        closed_before = np.searchsorted(self.times, self.__month_bounds(), side='left')
+        equity = self.initial_capital + np.concatenate(([0.0], np.cumsum(self.profits)))[closed_before]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = (equity[1:] / equity[:-1] - 1) * 100
+        return np.where(equity[:-1] > 0, returns, 0.0)
+
+    def monthly_profits(self):
+        """
+        :return: (symbols x months) array of the profits of each symbol in each month of the test period
+        """
+        periods = self.times.astype('datetime64[M]').astype(np.int64) + 1970 * 12 - self.first_month
+        keep = (periods >= 0) & (periods < self.num_months)
+        buckets = self.codes[keep].astype(np.int64) * self.num_months + periods[keep]
+        return np.bincount(buckets, weights=self.profits[keep],
+                           minlength=len(self.symbols) * self.num_months).reshape(len(self.symbols), self.num_months)
+
+    def __ratios(self):
+        # Need at least 2 periods to calculate standard deviation
+        if self.num_months < 2:
+            logging.warning("Insufficient periods for portfolio Sharpe/Sortino calculation (need >= 2)")
+            return 'N/A', 'N/A'
+
+        excess = self.monthly_returns() - (self.risk_free_rate / 12.0) * 100
+        mean_excess = float(excess.mean())
+        std_return = float(excess.std(ddof=1))
+        # Downside deviation only accounts for the months below the risk-free rate
+        downside = math.sqrt(float(np.mean(np.minimum(excess, 0.0) ** 2)))
+
+        sharpe = round(mean_excess / std_return * math.sqrt(12), 2) if std_return > 0 else 'N/A'
+        sortino = round(mean_excess / downside * math.sqrt(12), 2) if downside > 0 else 'N/A'
+        return sharpe, sortino
+
+    def metrics(self):
+        """
+        :return: dict of the portfolio statistics, in the style of a RESULTS.csv row
+        """
+        net_profit = float(self.profits.sum())
+        max_dd = max_dd_pct = 0.0
+        max_dd_time = ''
+        if len(self.equity) > 0:
+            worst = int(np.argmax(self.drawdown))
+            max_dd = float(self.drawdown[worst])
+            max_dd_pct = float(self.drawdown_pct.max())
+            if max_dd > 0:
+                max_dd_time = str(self.times[worst]).replace('-', '.').replace('T', ' ')
+        sharpe, sortino = self.__ratios()
+
+        return {'Symbols': len(self.symbols),
+                'Total trades': len(self.profits),
+                'Initial capital': round(self.initial_capital, 2),
+                'Total net profit': round(net_profit, 2),
+                'Return %': round(net_profit / self.initial_capital * 100, 2) if self.initial_capital > 0 else 'N/A',
+                'Max DD': round(max_dd, 2),
+                'Max DD %': round(max_dd_pct, 2),
+                'Max DD time': max_dd_time,
+                'Recov factor': round(net_profit / max_dd, 2) if max_dd > 0 else 'N/A',
+                'Shrp(A-mo)': sharpe,
+                'Sortino(A-mo)': sortino}
+
+    def correlation(self):
+        """
+        :return: (symbols x symbols) correlation matrix of the monthly profits, NaN for symbols with flat months
+        """
+        if len(self.symbols) == 0 or self.num_months < 2:
+            return np.full((len(self.symbols), len(self.symbols)), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.atleast_2d(np.corrcoef(self.monthly_profits()))
+
+    def equity_to_csv(self, fn):
+        """
+        Writes the equity curve, one row per closed trade.
+        """
+        times = np.datetime_as_string(self.times, unit='m').tolist()
+        with open(fn, 'w', newline='') as output_file:
+            csv_buffer = csv.writer(output_file)
+            csv_buffer.writerow(['Time', 'Symbol', 'Profit', 'Equity', 'Drawdown', 'Drawdown %'])
+            csv_buffer.writerows(zip([t.replace('-', '.').replace('T', ' ') for t in times],
+                                     [self.symbols[c] for c in self.codes.tolist()],
+                                     np.round(self.profits, 2).tolist(),
+                                     np.round(self.equity, 2).tolist(),
+                                     np.round(self.drawdown, 2).tolist(),
+                                     np.round(self.drawdown_pct, 2).tolist()))
+
+    def correlation_to_csv(self, fn):
+        matrix = self.correlation()
+        with open(fn, 'w', newline='') as output_file:
+            csv_buffer = csv.writer(output_file)
+            csv_buffer.writerow(['Symbol'] + self.symbols)
+            for symbol, row in zip(self.symbols, matrix.tolist()):
+                csv_buffer.writerow([symbol] + ['N/A' if v != v else round(v, 2) for v in row])
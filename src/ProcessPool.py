@@ -1,50 +1,519 @@
-from multiprocessing import Pool, Process, Manager
+from multiprocessing import Manager, Pipe, Process, Queue
+from multiprocessing.connection import wait
 from src.Utils import kill_all_terminals
+from src.HTMParser import HTMParser
+from src.DurationHistory import DurationHistory
+from src.ResultCache import ResultCache
 import os
 import time
+import random
+import logging
+import sys
+
+# Supported orders to dispatch the work inputs (ini files) to the terminals
+DISPATCH_ORDERS = ['listed', 'reverse', 'shuffle', 'longest']
+
+# Timeouts scaled from the duration history are never shorter than this (secs), short tests vary a lot
+MIN_SCALED_TIMEOUT = 60
+
+
+def falls_short(conf, summary):
+    """
+    :param summary: Summary of a Strategy Tester Report, see HTMParser.summary
+    :return: True if its profit factor or net profit is below the pruning threshold of the batch
+    """
+    for field, threshold in (('Profit factor', conf.prune_profit_factor), ('Total net profit', conf.prune_net_profit)):
+        if threshold is None:
+            continue
+        try:
+            value = float(summary.get(field))
+        except (TypeError, ValueError):
+            continue
+        if value < threshold:
+            return True
+    return False
+
+
+class PruningRule:
+    """
+    Early abort of an unpromising batch (see 'PruneAfter'), fed with the summary of each of its completed tests. The
+    rule is settled, and needs no more summaries, once it's triggered or as soon as a symbol doesn't fall short, since
+    the batch can't be pruned anymore.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+        self.shortfalls = 0
+        self.settled = not conf.prune_after
+
+    def record(self, summary):
+        """
+        :param summary: RESULTS.csv row of a completed test (or HTMParser.summary)
+        :return: True if the remaining tests of the batch should be cancelled
+        """
+        if self.settled:
+            return False
+        if not falls_short(self.conf, summary):
+            self.settled = True
+            return False
+        self.shortfalls += 1
+        self.settled = self.shortfalls >= self.conf.prune_after
+        return self.settled
 
 
 class ProcessPool:
-    def __init__(self, global_conf):
+    def __init__(self, global_conf, batches=None):
+        """
+        :param global_conf: The global configuration, with the terminals and the dispatch settings
+        :param batches: Test configurations to run in a single queue across all terminals, defaults to global_conf.
+                        More can be added while running, see run().
+        """
         self.conf = global_conf
 
-        # Take a copy of job inputs and terminals so global values remain intact
+        # Take a copy of the terminals so global values remain intact
         self.workers = self.conf.terminals.copy()
-        self.inputs = self.conf.work_inputs.copy()
+
+        # Past test durations, to dispatch the longest tests first and to compare predictions with actual durations
+        self.history = DurationHistory(os.path.join(self.conf.abs_mt4_results_folder, "DURATIONS.csv"))
+
+        # Reports of tests that were already run, see 'result_cache' in the global configuration
+        self.cache = None
+        if self.conf.result_cache:
+            self.cache = ResultCache(os.path.join(self.conf.abs_mt4_results_folder, "CACHE"))
+        self.fingerprints = {}
+        self.cached = []
+
+        # Work inputs (ini files) of all batches, along with the test configuration each of them belongs to
+        self.batches = []
+        self.inputs = []
+        self.batch_of = {}
+        self.predicted = {}
+        self.timeouts = {}
+        self.actual = {}
+        self.dispatched = []
+        self.timed_out = []
+        self.failed = []
+        # Pruning rule of each batch and the inputs of the pruned ones, shared with the terminal processes while
+        # running so they skip them (see record_summary())
+        self.rules = {}
+        self.cancelled = None
+        self.pruned = []
+        for conf in [global_conf] if batches is None else batches:
+            self.add_batch(conf)
 
         # We kill all of the terminals used by hpFX because it can't start a test on an already open instance.
         kill_all_terminals(global_conf)
 
-    def run_terminal(self, terminal, input_ini):
-        # Using a try/except to prevent failed processes to hold the pool forever
+    def add_batch(self, conf):
+        """
+        Adds the work inputs of a (prepared) test configuration to the pool.
+        :return: The newly added work inputs
+        """
+        test_days = DurationHistory.test_days(conf.date_from, conf.date_to)
+        new_inputs = []
+        for input_ini in conf.work_inputs:
+            if input_ini in self.batch_of:
+                logging.warning("{} is already queued, skipping it".format(input_ini))
+                continue
+            self.batch_of[input_ini] = conf
+            self.predicted[input_ini] = self.history.predict(conf.work_symbols[input_ini], conf.time_frame,
+                                                             conf.test_model, test_days)
+            self.timeouts[input_ini] = self.test_timeout(input_ini)
+            if self.cache is not None:
+                set_fn = os.path.join(conf.set_dir_abs, conf.work_symbols[input_ini] + ".set")
+                self.fingerprints[input_ini] = self.cache.fingerprint(input_ini, set_fn, conf.abs_expert_ex4)
+            new_inputs.append(input_ini)
+
+        self.rules[conf] = PruningRule(conf)
+        self.batches.append(conf)
+        self.inputs += new_inputs
+        return new_inputs
+
+    def symbol(self, input_ini):
+        return self.batch_of[input_ini].work_symbols[input_ini]
+
+    def label(self, input_ini):
+        """
+        :return: The symbol of the given input, prefixed with its test name when running more than one batch
+        """
+        if len(self.batches) == 1:
+            return self.symbol(input_ini)
+        return os.path.join(self.batch_of[input_ini].testUniqueName, self.symbol(input_ini))
+
+    def dispatch_order(self, inputs=None):
+        """
+        :param inputs: Work inputs to order, defaults to all of them
+        :return: The work inputs in the order they'll be handed over to the terminals, as selected by 'DispatchOrder'
+        """
+        if inputs is None:
+            inputs = self.inputs
+        order = self.conf.dispatch_order
+        if order == 'listed':
+            return inputs.copy()
+        elif order == 'reverse':
+            return inputs[::-1]
+        elif order == 'shuffle':
+            shuffled = inputs.copy()
+            random.shuffle(shuffled)
+            return shuffled
+        elif order == 'longest':
+            # Longest predicted first to minimize the time the last terminal runs alone. Symbols without history go
+            # first: they may well be the longest and it gets them measured for the next time.
+            unknown = [i for i in inputs if self.predicted[i] is None]
+            known = [i for i in inputs if self.predicted[i] is not None]
+            return unknown + sorted(known, key=lambda i: self.predicted[i], reverse=True)
+        else:
+            logging.error("Unknown dispatch order '{}', must be one of: {}".format(order, ", ".join(DISPATCH_ORDERS)))
+            sys.exit(71)
+
+    def test_timeout(self, input_ini):
+        """
+        :return: Wall-clock timeout in seconds for the given input, or None to wait for the terminal indefinitely.
+                 When 'TestTimeoutScale' is set, symbols with a duration history get a multiple of their predicted
+                 duration, others fall back to 'TestTimeout'.
+        """
+        conf = self.batch_of[input_ini]
+        predicted = self.predicted[input_ini]
+        if conf.test_timeout_scale and predicted is not None:
+            return max(conf.test_timeout_scale * predicted, MIN_SCALED_TIMEOUT)
+        if conf.test_timeout:
+            return conf.test_timeout
+        return None
+
+    def run_terminal(self, my_terminal, inputs, completed):
+        """
+        Worker loop, one process per terminal. Runs the inputs the main process hands over on this terminal's own queue
+        ('inputs'), one at a time, until it gets the 'None' sentinel. Inputs found in 'cancelled' (pruned batches) are
+        handed back without running them.
+
+        Events are sent to the main process through this worker's own pipe ('completed') as (input_ini, elapsed,
+        terminal name, status), the status being one of 'done', 'timed_out' (the terminal was killed), 'failed' (the
+        launcher raised) or 'cancelled'. Each of them tells the main process the terminal is free for the next input.
+        Unlike a Queue, a pipe sends synchronously: an event sent before the process dies is never lost.
+        """
         while True:
+            item = inputs.get()
+            if item is None:
+                return True
+
+            # Inputs may be added after this process is started, so everything needed to run them comes with the item
+            input_ini, timeout = item
+            if self.cancelled is not None and input_ini in self.cancelled:
+                completed.send((input_ini, 0, my_terminal.name, 'cancelled'))
+                continue
+
+            s_time = time.time()
             try:
-                my_terminal = terminal.pop()
-            except:
-                time.sleep(5)
-                continue
-
-            # command = 'call "{}" "{}"'.format(my_terminal.exe, input_ini)
-            # Switched to using 'start' because unlike 'call' it offers an option to start in a minimized window
-            command = 'start /b /wait /min "" "{}" "{}"'.format(my_terminal.exe, input_ini)
-            shortened_input_ini = os.path.relpath(input_ini, self.conf.abs_mt4_results_folder)
-            print("[{}] is processing: {}".format(my_terminal.name, shortened_input_ini))
-            os.system(command)
-            terminal.append(my_terminal)
-            return True
+                shortened_input_ini = os.path.relpath(input_ini, self.conf.abs_mt4_results_folder)
+                print("[{}] is processing: {}".format(my_terminal.name, shortened_input_ini))
+                status = my_terminal.run(input_ini, timeout=timeout)
+            except Exception as e:
+                # Keep the worker alive, the main process decides whether the test runs again
+                logging.error("[{}] Failed to run {}: {}".format(my_terminal.name, input_ini, e))
+                completed.send((input_ini, time.time() - s_time, my_terminal.name, 'failed'))
+                continue
+            # Completion event for the main process, status is None if the test timed out and the terminal was killed
+            completed.send((input_ini, time.time() - s_time, my_terminal.name,
+                           'timed_out' if status is None else 'done'))
+
+    def run(self, on_complete=None, on_batch_complete=None, more_batches=None):
+        """
+        Runs the work inputs of all batches in a single queue, so no terminal is left idle until the very last test.
+        The queue is held here, each terminal is handed the next input as soon as it reports being free.
+
+        The callbacks are kept out of self because self is handed over to the terminal processes.
+
+        Batches with a pruning rule (see 'PruneAfter') that parse their reports while running get the rule evaluated
+        by their ReportConsumer, which hands the summaries over to record_summary(). The reports of the other batches
+        are read here, until their rule is settled.
+        :param on_complete: Optional callable, called with the configuration and symbol of each test as soon as it's
+                            completed (while other tests may still be running), e.g. to parse its report.
+        :param on_batch_complete: Optional callable, called with the configuration of each batch once all of its tests
+                                  are done.
+        :param more_batches: Optional callable, polled while running, returning a (possibly empty) list of prepared
+                             test configurations to add to the queue. When given, run() doesn't return once the
+                             queue is empty but keeps waiting for more batches.
+        """
+        manager = None
+        if more_batches is not None or any(conf.prune_after for conf in self.batches):
+            manager = Manager()
+            self.cancelled = manager.dict()
 
-    def run(self):
-        manager = Manager()
-        workers = manager.list(self.workers)
-        inputs = self.inputs.copy()
+        def queue_inputs(new_inputs):
+            for input_ini in new_inputs:
+                pending[self.batch_of[input_ini]] = pending.get(self.batch_of[input_ini], 0) + 1
+            # Tests with a cached report are done already
+            cached = [i for i in new_inputs if self.restore_cached(i)]
+            dispatched = self.dispatch_order([i for i in new_inputs if i not in cached])
+            self.dispatched += dispatched
+            waiting.extend(dispatched)
+            for input_ini in cached:
+                if on_complete is not None:
+                    on_complete(self.batch_of[input_ini], self.symbol(input_ini))
+                self.check_report(input_ini)
+                input_done(input_ini)
+            return len(dispatched)
+
+        def input_done(input_ini):
+            conf = self.batch_of[input_ini]
+            pending[conf] -= 1
+            if pending[conf] == 0 and on_batch_complete is not None:
+                on_batch_complete(conf)
+
+        def input_failed(input_ini, terminal_name, reason, given_up):
+            """
+            Queues a failed test again, on another terminal if possible, until it runs out of retries.
+            :param given_up: List of test labels to add the test to when giving up on it
+            :return: 1 if the test was given up on, 0 if it's queued again
+            """
+            label = self.label(input_ini)
+            failed_on.setdefault(input_ini, []).append(terminal_name)
+            if len(failed_on[input_ini]) <= self.conf.test_retries:
+                logging.warning("[{}] {} {}, the test is queued again".format(terminal_name, label, reason))
+                waiting.append(input_ini)
+                return 0
+            logging.error("[{}] {} {}, giving up after {} attempt(s)".format(terminal_name, label, reason,
+                                                                          len(failed_on[input_ini])))
+            given_up.append(label)
+            input_done(input_ini)
+            return 1
+
+        def next_input(terminal_name):
+            """
+            :return: The next waiting input the given terminal should run, None if there's none. A failed test runs
+                     again on another terminal, this one may be the culprit, unless it failed on all terminals left.
+            """
+            terminals = set(events.values())
+            for input_ini in waiting:
+                tried = failed_on.get(input_ini, [])
+                if terminal_name not in tried or terminals.issubset(tried):
+                    waiting.remove(input_ini)
+                    return input_ini
+            return None
+
+        def dispatch():
+            for terminal_name in list(free):
+                input_ini = next_input(terminal_name)
+                if input_ini is None:
+                    continue
+                free.remove(terminal_name)
+                running[terminal_name] = input_ini
+                terminal_inputs[terminal_name].put((input_ini, self.timeouts[input_ini]))
+
+        # Number of tests left in each batch, and the inputs waiting for a free terminal
+        pending = {}
+        waiting = []
+        self.dispatched = []
+        remaining = queue_inputs(self.inputs)
+        # Batches without any test to run, e.g. repairs that only parse existing reports, are done already
+        if on_batch_complete is not None:
+            for conf in self.batches:
+                if conf not in pending:
+                    on_batch_complete(conf)
+
+        # No need for more workers than inputs, unless more may come
+        num_workers = len(self.workers) if more_batches is not None else len(self.dispatched)
         processes = []
-        while len(inputs) > 0:
-            p = Process(target=self.run_terminal, args=(workers, inputs.pop()))
-            processes.append(p)
+        # Receiving end of each worker's events pipe -> terminal name, and terminal name -> the worker's input queue
+        events = {}
+        terminal_inputs = {}
+        for my_terminal in self.workers[:num_workers]:
+            receiver, sender = Pipe(duplex=False)
+            terminal_inputs[my_terminal.name] = Queue()
+            processes.append(Process(target=self.run_terminal,
+                                     args=(my_terminal, terminal_inputs[my_terminal.name], sender)))
+            processes[-1].start()
+            # Only the worker keeps the sending end open, so its pipe reports EOF as soon as it dies
+            sender.close()
+            events[receiver] = my_terminal.name
 
-        for p in processes:
-            p.start()
+        # Hand over completed tests as they come in. Processes that die without reporting back must not block us: the
+        # input each terminal is running is known, so it can be queued again (or given up on) for a dead process.
+        failed_on = {}
+        running = {}
+        free = list(terminal_inputs)
+        while remaining > 0 or more_batches is not None:
+            if more_batches is not None:
+                for conf in more_batches():
+                    new_inputs = self.add_batch(conf)
+                    if len(new_inputs) > 0:
+                        remaining += queue_inputs(new_inputs)
+                    elif on_batch_complete is not None:
+                        on_batch_complete(conf)
+
+            if len(events) == 0:
+                if remaining > 0:
+                    logging.error("No terminal is left to run the remaining {} test(s)".format(remaining))
+                break
+            dispatch()
+            ready = wait(list(events), timeout=1)
+            if len(ready) == 0:
+                continue
+            try:
+                input_ini, elapsed, terminal_name, status = ready[0].recv()
+            except EOFError:
+                # Workers only exit on the sentinel, any process gone by now died
+                terminal_name = events.pop(ready[0])
+                ready[0].close()
+                if terminal_name in free:
+                    free.remove(terminal_name)
+                input_ini = running.pop(terminal_name, None)
+                logging.error("[{}] The terminal's worker process died".format(terminal_name))
+                if input_ini is not None:
+                    remaining -= input_failed(input_ini, terminal_name, "was lost with its worker process",
+                                              self.failed)
+                continue
+
+            conf = self.batch_of[input_ini]
+            running.pop(terminal_name, None)
+            # The terminal gets its next input before the report of this one is looked at
+            free.append(terminal_name)
+            dispatch()
+
+            if status == 'cancelled':
+                conf.pruned_symbols.append(self.symbol(input_ini))
+                self.pruned.append(self.label(input_ini))
+                remaining -= 1
+                input_done(input_ini)
+                continue
+
+            if status == 'timed_out':
+                remaining -= input_failed(input_ini, terminal_name, "timed out after {:.0f} secs and the terminal was "
+                                                                    "killed".format(elapsed), self.timed_out)
+                continue
+
+            if status == 'failed':
+                remaining -= input_failed(input_ini, terminal_name, "failed to run", self.failed)
+                continue
+
+            remaining -= 1
+            self.record_duration(input_ini, elapsed)
+            self.store_cached(input_ini)
+            if on_complete is not None:
+                on_complete(conf, self.symbol(input_ini))
+            self.check_report(input_ini)
+            input_done(input_ini)
+
+        # All tests are done, let the workers exit
+        for my_inputs in terminal_inputs.values():
+            my_inputs.put(None)
 
         for p in processes:
             p.join()
+        for receiver in events:
+            receiver.close()
+        if manager is not None:
+            self.cancelled = None
+            manager.shutdown()
+
+        self.print_durations()
+        if len(self.cached) > 0:
+            print("\n{} test(s) reused their results from the cache: {}".format(len(self.cached),
+                                                                             ", ".join(self.cached)))
+        if len(self.timed_out) > 0:
+            print("\nWARNING: {} test(s) timed out and were not completed: {}".format(len(self.timed_out),
+                                                                                     ", ".join(self.timed_out)))
+        if len(self.failed) > 0:
+            print("\nWARNING: {} test(s) failed to run: {}".format(len(self.failed), ", ".join(self.failed)))
+        if len(self.pruned) > 0:
+            print("\n{} test(s) of unpromising batches were cancelled: {}".format(len(self.pruned),
+                                                                                 ", ".join(self.pruned)))
 
+    def check_report(self, input_ini):
+        """
+        Evaluates the pruning rule of a batch that doesn't parse its reports while running, from the report of one of
+        its completed tests. Only the summary at the top of the report is read, and only until the rule is settled.
+        Tests that failed to produce a readable report don't count.
+        """
+        conf = self.batch_of[input_ini]
+        if conf.parse_while_running or self.rules[conf].settled:
+            return
+        htm_fn = conf.htm_reports.get(self.symbol(input_ini), "")
+        if not os.path.exists(htm_fn):
+            return
+        try:
+            summary = HTMParser(htm_fn).summary
+        # HTMParser calls sys.exit() on reports it can't read
+        except (Exception, SystemExit):
+            return
+        if summary is not None:
+            self.record_summary(conf, summary)
+
+    def record_summary(self, conf, summary):
+        """
+        Evaluates the pruning rule of a batch with the summary of one of its completed tests, and cancels the remaining
+        tests of the batch once the rule is triggered. Those already running are completed.
+        Called by ReportConsumer, possibly from its parser pool's result thread.
+        """
+        rule = self.rules.get(conf)
+        if rule is None or not rule.record(summary) or self.cancelled is None:
+            return
+        print("[prune] {}: all {} completed symbol(s) fell short of the pruning rule, cancelling the remaining "
+              "tests".format(conf.testUniqueName, rule.shortfalls))
+        try:
+            for input_ini in conf.work_inputs:
+                self.cancelled[input_ini] = True
+        # The run may be over by the time the last reports are parsed, nothing is left to cancel then
+        except (OSError, EOFError):
+            pass
+
+    def restore_cached(self, input_ini):
+        """
+        Copies the cached report of the given input in place, if there is one.
+        :return: True if the test doesn't need to run
+        """
+        conf = self.batch_of[input_ini]
+        if self.cache is None or conf.is_nocache or conf.is_debug:
+            return False
+        if not self.cache.restore(self.fingerprints[input_ini], conf.htm_reports[self.symbol(input_ini)]):
+            return False
+        print("[cache] Reusing the results of an identical test for {}".format(self.label(input_ini)))
+        self.cached.append(self.label(input_ini))
+        return True
+
+    def store_cached(self, input_ini):
+        """
+        Adds the report of a completed test to the result cache. Blank reports and reports without trades aren't cached,
+        they would be restored in place of the test on later runs, repairs (-r) included.
+        """
+        conf = self.batch_of[input_ini]
+        htm_fn = conf.htm_reports.get(self.symbol(input_ini), "")
+        if self.cache is None or conf.is_debug or not os.path.exists(htm_fn):
+            return
+        try:
+            report = HTMParser(htm_fn)
+            if report.report_type == "Strategy Tester Report" and int(report.summary.get('Total trades')) <= 0:
+                return
+        # HTMParser calls sys.exit() on reports it can't read
+        except (Exception, SystemExit):
+            return
+        self.cache.store(self.fingerprints[input_ini], htm_fn)
+
+    def record_duration(self, input_ini, elapsed):
+        conf = self.batch_of[input_ini]
+        symbol = self.symbol(input_ini)
+        self.actual[input_ini] = elapsed
+        # Terminals are kept open in debugging mode and a test without a report failed, neither is a real duration
+        if conf.is_debug or not os.path.exists(conf.htm_reports.get(symbol, "")):
+            return
+        self.history.record(symbol, conf.time_frame, conf.test_model,
+                            DurationHistory.test_days(conf.date_from, conf.date_to), elapsed)
+
+    def print_durations(self):
+        """
+        Prints predicted vs actual test durations, in the order the tests were dispatched.
+        """
+        if len(self.actual) == 0:
+            return
+        width = max([12] + [len(self.label(i)) + 2 for i in self.actual])
+        print("\n--- Test Durations (secs) ---")
+        print("{:<{w}}{:>12}{:>12}{:>12}".format("Symbol", "Predicted", "Actual", "Diff", w=width))
+        for input_ini in self.dispatched:
+            if input_ini not in self.actual:
+                continue
+            predicted = self.predicted[input_ini]
+            actual = self.actual[input_ini]
+            if predicted is None:
+                print("{:<{w}}{:>12}{:>12.1f}{:>12}".format(self.label(input_ini), "n/a", actual, "n/a", w=width))
+            else:
+                print("{:<{w}}{:>12.1f}{:>12.1f}{:>+12.1f}".format(self.label(input_ini), predicted, actual,
+                                                                   actual - predicted, w=width))
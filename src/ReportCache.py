@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from src.HTMParser import HTMParser
+
+
+class ReportCache:
+    """
+    Parsed HTM reports: the summary rows and trades HTMParser.htm_to_csv() returns, kept in a SQLite database so that
+    aggregating a results tree again doesn't parse the reports that didn't change.
+
+    Entries are keyed by the SHA-256 of the report contents and the parsing options (Sharpe settings, pass selection).
+    Reports are only hashed again when their size or modification time changed, so an unchanged report costs a stat()
+    and a lookup. A report that was copied or touched, but not modified, is still found by its hash.
+
+    The least recently used entries are evicted once the cache grows beyond max_size bytes.
+    """
+
+    # Bump when the output of HTMParser changes, so entries of older versions are no longer used
+    VERSION = 1
+
+    DB_NAME = "reports.sqlite"
+
+    def __init__(self, cache_folder, max_size=1 << 30):
+        """
+        :param cache_folder: Folder of the cache database, created if needed
+        :param max_size: Total size of the cached entries, in bytes, beyond which the least recently used are evicted
+        """
+        self.cache_folder = cache_folder
+        self.max_size = max_size
+        if not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder, exist_ok=True)
+        # Several processes may parse reports at once, they wait for each other's writes
+        self.__db = sqlite3.connect(os.path.join(self.cache_folder, self.DB_NAME), timeout=60)
+        with self.__db:
+            self.__db.execute("CREATE TABLE IF NOT EXISTS reports (path TEXT PRIMARY KEY, size INTEGER, "
+                              "mtime INTEGER, hash TEXT)")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, used REAL, "
+                              "payload BLOB)")
+
+    def close(self):
+        self.__db.close()
+
+    def __content_hash(self, fn):
+        path = os.path.abspath(fn)
+        stat = os.stat(path)
+        row = self.__db.execute("SELECT size, mtime, hash FROM reports WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return row[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as report_file:
+            for block in iter(lambda: report_file.read(1 << 20), b''):
+                digest.update(block)
+        with self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)",
+                              (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()))
+        return digest.hexdigest()
+
+    def __key(self, fn, options):
+        key = "{}|{}|{}".format(self.VERSION, self.__content_hash(fn), repr(sorted(options.items())))
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def __get(self, key):
+        row = self.__db.execute("SELECT payload FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self.__db:
+            self.__db.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def __put(self, key, parsed_report):
+        payload = pickle.dumps(parsed_report, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                              (key, len(payload), time.time(), payload))
+            self.__evict()
+
+    def __evict(self):
+        total = self.__db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size:
+            return
+        evicted = []
+        for key, size in self.__db.execute("SELECT key, size FROM entries ORDER BY used").fetchall():
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        self.__db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def htm_to_csv(self, fn, streaming=False, **options):
+        """
+        Same as HTMParser(fn, streaming).htm_to_csv(**options), from the cache when the report was parsed with the
+        same options before. Cache errors are logged and the report is parsed as if there was no cache.
+        """
+        try:
+            key = self.__key(fn, options)
+            parsed_report = self.__get(key)
+        except (OSError, sqlite3.Error, pickle.UnpicklingError, EOFError) as e:
+            logging.warning("Cannot read {} from the report cache: {}".format(fn, e))
+            key = parsed_report = None
+        if parsed_report is not None:
+            return parsed_report
+
+        parsed_report = HTMParser(fn, streaming=streaming).htm_to_csv(**options)
+        if key is not None:
+            try:
+                self.__put(key, parsed_report)
+            except sqlite3.Error as e:
+                logging.warning("Cannot add {} to the report cache: {}".format(fn, e))
+        return parsed_report
@@ -0,0 +1,159 @@
+from multiprocessing import Pool
+from src import Utils
+import logging
+import os
+
+
+class ReportConsumer:
+    """
+    Parses HTM reports as soon as ProcessPool reports a test as completed, while the remaining tests are still running,
+    so the post-processing is (mostly) done by the time the last terminal exits.
+
+    Results are appended to RESULTS.csv and <SYMBOL>_TRADES.csv in completion order, which keeps partial results
+    available during long batches. finish() then puts the rows of this run back in the original symbol order.
+    """
+    def __init__(self, conf, pool=None, on_summary=None):
+        """
+        :param pool: Optional parser pool shared with other batches (see BatchReportConsumers), left open by finish().
+                     Without it, a pool of 'ParserWorkers' processes is started for this batch when it's more than one.
+        :param on_summary: Optional callable, called with the configuration and the RESULTS.csv row of each parsed
+                           Strategy Tester Report, e.g. ProcessPool.record_summary to evaluate the pruning rule
+        """
+        self.conf = conf
+        self.on_summary = on_summary
+        self.stats = Utils.new_postprocess_stats()
+        self.pool = pool
+        self.own_pool = False
+        if pool is None and conf.parser_workers > 1:
+            self.pool = Pool(min(conf.parser_workers, len(conf.symbols)))
+            self.own_pool = True
+        # Reports of this batch handed over to the pool
+        self.jobs = []
+
+        # (symbol, number of rows written in RESULTS.csv) in completion order
+        self.completed = []
+
+        # Results retained from earlier runs (repair mode) stay at the top of RESULTS.csv
+        self.retained_rows = 0
+        if os.path.exists(conf.test_report_csv):
+            self.retained_rows = len(Utils.csv_to_dict(conf.test_report_csv))
+
+        Utils.print_sharpe_configuration(conf)
+
+        # Reports left over from an earlier run (repair mode) don't wait for any test
+        for symbol in conf.reparse_symbols:
+            self.submit(symbol)
+
+    def submit(self, symbol):
+        """
+        Completion event handler, to be called once the test for the given symbol is done (see ProcessPool.run).
+        """
+        if symbol not in self.conf.htm_reports.keys():
+            logging.warning("Missing the HTM report for {}".format(symbol))
+            print("WARNING: Missing HTM report for {}".format(symbol))
+            return
+
+        job = Utils.htm_report_job(self.conf, symbol)
+        if self.pool is None:
+            self.__record(symbol, Utils.parse_htm_report(*job))
+        else:
+            # Callbacks are run one at a time by the pool's result handler thread, so writes don't interleave
+            self.jobs.append(self.pool.apply_async(Utils.parse_htm_report, job,
+                                                   callback=lambda parsed_report: self.__record(symbol, parsed_report)))
+
+    def __record(self, symbol, parsed_report):
+        rows = Utils.record_parsed_report(self.conf, symbol, parsed_report, self.stats)
+        self.completed.append((symbol, rows))
+        summary_output = parsed_report[0]
+        # Passes of optimization reports have no symbol, they don't summarize the test
+        if self.on_summary is not None and rows > 0 and 'Symbol' in summary_output[0]:
+            self.on_summary(self.conf, summary_output[0])
+
+    def finish(self):
+        """
+        Waits for the reports that are still being parsed, restores the symbol order and prints the summary.
+        """
+        if self.own_pool:
+            self.pool.close()
+            self.pool.join()
+        else:
+            # A shared pool keeps running for the other batches, only wait for this one's reports (and their callbacks)
+            for job in self.jobs:
+                job.wait()
+
+        completed_symbols = set(c[0] for c in self.completed)
+        for s in self.conf.symbols:
+            if s not in completed_symbols and s not in self.conf.pruned_symbols:
+                logging.warning("No results were collected for {}".format(s))
+
+        self.__restore_symbol_order()
+        self.stats['trades_stored'] = Utils.update_trade_store(self.conf)
+        if self.conf.portfolio_analysis:
+            self.stats['portfolio'] = Utils.analyze_portfolio(self.conf)
+        Utils.print_postprocess_summary(self.conf, self.stats)
+
+    def __restore_symbol_order(self):
+        symbol_order = {s: i for i, s in enumerate(self.conf.symbols)}
+        ordered = sorted(self.completed, key=lambda c: symbol_order.get(c[0], len(symbol_order)))
+        if ordered == self.completed or not os.path.exists(self.conf.test_report_csv):
+            return
+
+        rows = Utils.csv_to_dict(self.conf.test_report_csv)
+        reordered = rows[:self.retained_rows]
+        chunks = {}
+        offset = self.retained_rows
+        for symbol, num_rows in self.completed:
+            chunks[symbol] = rows[offset:offset + num_rows]
+            offset += num_rows
+        for symbol, _ in ordered:
+            reordered += chunks[symbol]
+        Utils.dict_to_csv(reordered, self.conf.test_report_csv, overwrite=True)
+
+
+class BatchReportConsumers:
+    """
+    Parses the reports of many batches sharing the terminals (see hpFX_queue.py), as ProcessPool.run() callbacks:
+
+        p = ProcessPool(conf, batches)
+        consumers = BatchReportConsumers(on_summary=p.record_summary)
+        p.run(on_complete=consumers.on_complete, on_batch_complete=consumers.on_batch_complete)
+        consumers.close()
+
+    Each batch gets its ReportConsumer on its first completed test rather than up front, and batches with
+    'ParserWorkers' above one share a single parser pool, so hundreds of queued batches don't each keep a pool of idle
+    parser processes around. Batches that don't parse while running are post-processed once they're done.
+    """
+    def __init__(self, on_summary=None):
+        """
+        :param on_summary: See ReportConsumer, e.g. ProcessPool.record_summary
+        """
+        self.on_summary = on_summary
+        self.pool = None
+        self.consumers = {}
+
+    def on_complete(self, batch, symbol):
+        if not batch.parse_while_running:
+            return
+        if batch not in self.consumers:
+            pool = None
+            if batch.parser_workers > 1:
+                # Sized by the first batch that needs it
+                if self.pool is None:
+                    self.pool = Pool(batch.parser_workers)
+                pool = self.pool
+            self.consumers[batch] = ReportConsumer(batch, pool, self.on_summary)
+        self.consumers[batch].submit(symbol)
+
+    def on_batch_complete(self, batch):
+        consumer = self.consumers.pop(batch, None)
+        if consumer is not None:
+            consumer.finish()
+        else:
+            # Not parsing while running, or no test was completed (e.g. a repair that only parses existing reports)
+            Utils.postprocess_results(batch)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
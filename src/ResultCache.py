@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import os
+import shutil
+
+
+class ResultCache:
+    """
+    Reports of completed tests, stored under a fingerprint of everything that determines their results: the test
+    configuration (ini), the expert parameters (set file) and the expert itself (ex4). A test with a known fingerprint
+    doesn't need to run again, whatever category or test name it's filed under: its report is copied over instead.
+
+    Note that the price history isn't part of the fingerprint. Clear the cache folder after updating the history data.
+    """
+
+    # Paths and settings that differ between runs of the very same test. MT4_ID only tells the license which terminal
+    # runs the test.
+    IGNORED_INI_KEYS = ('TestReport', 'TestExpertParameters', 'TestReplaceReport', 'TestShutdownTerminal')
+    IGNORED_SET_KEYS = ('MT4_ID',)
+
+    # MT4 saves the balance chart next to each report
+    EXTENSIONS = ('.htm', '.gif')
+
+    def __init__(self, cache_folder):
+        self.cache_folder = cache_folder
+        if not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+        # Hashes of the expert files, along with their size and mtime to notice recompiles
+        self.__expert_hashes = {}
+        self.__missing_experts = set()
+
+    @staticmethod
+    def __config_lines(fn, ignored_keys):
+        lines = []
+        with open(fn, 'r', errors='replace') as config_file:
+            for line in config_file:
+                line = line.strip()
+                if line == '' or line.startswith(';') or line.split('=', 1)[0].strip() in ignored_keys:
+                    continue
+                lines.append(line)
+        return lines
+
+    def __expert_hash(self, expert_fn):
+        if not os.path.exists(expert_fn):
+            if expert_fn not in self.__missing_experts:
+                logging.warning("Cannot find the expert {}, it won't be part of the test fingerprints".format(
+                    expert_fn))
+                self.__missing_experts.add(expert_fn)
+            return "missing"
+        stat = os.stat(expert_fn)
+        key = (expert_fn, stat.st_size, stat.st_mtime)
+        if key not in self.__expert_hashes:
+            with open(expert_fn, 'rb') as expert_file:
+                self.__expert_hashes[key] = hashlib.sha256(expert_file.read()).hexdigest()
+        return self.__expert_hashes[key]
+
+    def fingerprint(self, ini_fn, set_fn, expert_fn):
+        """
+        :param ini_fn: Test configuration file, as generated by prepare_test_environment()
+        :param set_fn: Expert parameters file of the test
+        :param expert_fn: Compiled expert (ex4)
+        :return: Hex digest identifying the test
+        """
+        digest = hashlib.sha256()
+        for section, lines in (('ini', self.__config_lines(ini_fn, self.IGNORED_INI_KEYS)),
+                               ('set', self.__config_lines(set_fn, self.IGNORED_SET_KEYS)),
+                               ('ex4', [self.__expert_hash(expert_fn)])):
+            digest.update("[{}]\n".format(section).encode())
+            for line in lines:
+                digest.update((line + "\n").encode())
+        return digest.hexdigest()
+
+    def __cached_fn(self, fingerprint, extension):
+        # Two levels, to keep the number of files per folder reasonable
+        return os.path.join(self.cache_folder, fingerprint[:2], fingerprint + extension)
+
+    def restore(self, fingerprint, htm_fn):
+        """
+        Copies the cached report (and chart) of the given fingerprint to htm_fn.
+        :return: True if the report was found in the cache
+        """
+        cached_htm = self.__cached_fn(fingerprint, '.htm')
+        if not os.path.exists(cached_htm):
+            return False
+        for extension in self.EXTENSIONS:
+            cached_fn = self.__cached_fn(fingerprint, extension)
+            if os.path.exists(cached_fn):
+                shutil.copyfile(cached_fn, os.path.splitext(htm_fn)[0] + extension)
+        return True
+
+    def store(self, fingerprint, htm_fn):
+        """
+        Adds the report (and chart) of a completed test to the cache.
+        """
+        os.makedirs(os.path.dirname(self.__cached_fn(fingerprint, '.htm')), exist_ok=True)
+        # The report goes last and each file is moved in place at once, so a report in the cache is always complete
+        for extension in reversed(self.EXTENSIONS):
+            src_fn = os.path.splitext(htm_fn)[0] + extension
+            if not os.path.exists(src_fn):
+                continue
+            cached_fn = self.__cached_fn(fingerprint, extension)
+            try:
+                shutil.copyfile(src_fn, cached_fn + ".tmp")
+                os.replace(cached_fn + ".tmp", cached_fn)
+            except OSError as e:
+                logging.warning("Cannot add {} to the result cache: {}".format(src_fn, e))
@@ -1,10 +1,10 @@
 import sys
 import os
-from itertools import permutations, product
+from itertools import islice, permutations
 import logging
-import tempfile
-import shutil
-from src.Utils import extract_fields, modify_fields_in_place
+import random
+from src.FieldTemplate import FieldTemplate
+from src.Utils import write_file
 
 # TODO
 # - Check if the input indicator definitions include multiple names
@@ -65,20 +65,28 @@ def identify_indi_parameters(input_str, indi_type_line):
 
     return {"GIVEN_NAME": indi_given_name, indi_type_line: input_str}
 
+def permutation_case(entry, confirmation):
+    """
+    :param entry: Parsed ENTRY_PERMS candidate used as the signal, as returned by identify_indi_parameters()
+    :param confirmation: Parsed ENTRY_PERMS candidate used as the confirmation
+    :return: The combination of the two, as yielded by make_indi_cases()
+    """
+    entry_fields = dict(entry)
+    entry_fields['SIGNAL_USAGE'] = usage_class['SIGNAL']
+    conf_fields = {'GIVEN_NAME': confirmation['GIVEN_NAME'], 'CONFIRMATION1': confirmation['SIGNAL'],
+                   'CONFIRMATION1_USAGE': usage_class['CONFIRMATION']}
+    return [entry_fields, conf_fields]
+
+
 def make_indi_cases(config):
     """
+    The inputs are checked right away, but combinations are only built as they're consumed: the number of
+    permutations grows quickly with the number of ENTRY_PERMS candidates (see count_indi_cases()).
     :param config: The global configuration instance
-    :return: A list of tuples and dictionaries that represent all covered combinations,to be used by create_experiment_files()
+    :return: A generator of lists of dictionaries that represent all covered combinations, to be used by
+             create_experiment_files()
     """
-    # This is strictly for the 'Entry_Permutations==True' case.
-    # permutation_cases = []
-    # This is strictly for a linear list of 'ENTRY' or 'CONF' or 'ENTRY+CONF' (no permutations).
-    # signal_conf_cases = []
-    # signal_cases = []
-    # Switching to a unified representation:
-    trade_representations = []
-
-    print("DEBUG: config=", config)
+    logging.debug("config=%s", config)
 
     # All Confirmation indicator combinations
     if config.Entry_Permutations:
@@ -89,116 +97,104 @@ def make_indi_cases(config):
                 "follow the instructions provided in the test_case_maker configuration file ")
             sys.exit(101)
 
-        e_permutations = permutations(config.ENTRY_PERMS, 2)
-
-        for ep in e_permutations:
-            print(ep)
-            entry_fields = identify_indi_parameters(ep[0], 'SIGNAL')
-            conf_fields = identify_indi_parameters(ep[1], 'SIGNAL')
-            conf_fields['CONFIRMATION1'] = conf_fields['SIGNAL']
-            conf_fields.pop('SIGNAL')
+        # Each candidate is checked once, rather than once per permutation it's part of
+        candidates = [identify_indi_parameters(ep, 'SIGNAL') for ep in config.ENTRY_PERMS]
+        return (permutation_case(entry, confirmation) for entry, confirmation in permutations(candidates, 2))
+
+    # Check for incompatibilities between inputs and selected TestMode
+    signal_cases = []
+    conf1_cases = []
+    conf2_cases = []
+    tradeornot_cases = []
+    exit_cases = []
+    if config.SIGNAL is not None:
+        for s in config.SIGNAL:
+            entry_fields = identify_indi_parameters(s, 'SIGNAL')
             entry_fields['SIGNAL_USAGE'] = usage_class['SIGNAL']
-            conf_fields['CONFIRMATION1_USAGE'] = usage_class['CONFIRMATION']
-            trade_representations.append((entry_fields, conf_fields))
-
+            signal_cases.append(entry_fields)
+    if config.CONF1 is not None:
+        for c1 in config.CONF1:
+            entry_fields = identify_indi_parameters(c1, 'CONFIRMATION1')
+            entry_fields['CONFIRMATION1_USAGE'] = usage_class['CONFIRMATION']
+            conf1_cases.append(entry_fields)
+    if config.CONF2 is not None:
+        for c2 in config.CONFIRMATION2:
+            entry_fields = identify_indi_parameters(c2, 'CONFIRMATION2')
+            entry_fields['CONFIRMATION2_USAGE'] = usage_class['CONFIRMATION']
+            conf2_cases.append(entry_fields)
+    if config.VOL is not None:
+        for ton in config.VOL:
+            entry_fields = identify_indi_parameters(ton, 'TRADEORNOT')
+            entry_fields['TRADEORNOT_USAGE'] = usage_class['TRADEORNOT']
+            tradeornot_cases.append(entry_fields)
+    if config.EXIT is not None:
+        for e in config.EXIT:
+            entry_fields = identify_indi_parameters(e, 'EXIT')
+            entry_fields['EXIT_USAGE'] = usage_class['EXIT']
+            exit_cases.append(entry_fields)
+
+    # Each signal is combined with the indicators listed at the same position in the other categories, if they list
+    # as many indicators as there are signals
+    columns = [signal_cases] + [cases for cases in (conf1_cases, conf2_cases, tradeornot_cases, exit_cases)
+                                if len(cases) != 0 and len(cases) == len(signal_cases)]
+    return (list(case) for case in zip(*columns))
+
+
+def count_indi_cases(config, shard=None, sample=None):
+    """
+    Number of combinations make_indi_cases() yields, without building them.
+    :param config: The global configuration instance
+    :param shard: Optional (i, n), see shard_cases()
+    :param sample: Optional sample size, see sample_cases()
+    """
+    if config.Entry_Permutations:
+        candidates = len(config.ENTRY_PERMS) if config.ENTRY_PERMS is not None else 0
+        total = candidates * (candidates - 1) if candidates > 1 else 0
     else:
-        # Check for incompatibilities between inputs and selected TestMode
-        signal_cases = []
-        conf1_cases = []
-        conf2_cases = []
-        tradeornot_cases = []
-        exit_cases = []
-        if config.SIGNAL is not None:
-            for s in config.SIGNAL:
-                entry_fields = identify_indi_parameters(s, 'SIGNAL')
-                entry_fields['SIGNAL_USAGE'] = usage_class['SIGNAL']
-                signal_cases.append(entry_fields)
-        if config.CONF1 is not None:
-            for c1 in config.CONF1:
-                entry_fields = identify_indi_parameters(c1, 'CONFIRMATION1')
-                entry_fields['CONFIRMATION1_USAGE'] = usage_class['CONFIRMATION']
-                conf1_cases.append(entry_fields)
-        if config.CONF2 is not None:
-            for c2 in config.CONFIRMATION2:
-                entry_fields = identify_indi_parameters(c2, 'CONFIRMATION2')
-                entry_fields['CONFIRMATION2_USAGE'] = usage_class['CONFIRMATION']
-                conf2_cases.append(entry_fields)
-        if config.VOL is not None:
-            for ton in config.VOL:
-                entry_fields = identify_indi_parameters(ton, 'TRADEORNOT')
-                entry_fields['TRADEORNOT_USAGE'] = usage_class['TRADEORNOT']
-                tradeornot_cases.append(entry_fields)
-        if config.EXIT is not None:
-            for e in config.EXIT:
-                entry_fields = identify_indi_parameters(e, 'EXIT')
-                entry_fields['EXIT_USAGE'] = usage_class['EXIT']
-                exit_cases.append(entry_fields)
-
-        #DEBUG print("\nDEBUG=====================================================================================\n")
-        #DEBUG for c in signal_cases:
-        #DEBUG     print(c)
-        #DEBUG print("\nAFTER LIST =====================================================================================\n")
-        #DEBUG print(list(signal_cases)[0])
-        #DEBUG print("\nAFTER APPEND =====================================================================================\n")
-        #DEBUG trade_representations.append(list(signal_cases)[0])
-        #DEBUG print(trade_representations)
-
-        signal_cases_len = len(signal_cases)
-        conf1_cases_len = len(conf1_cases)
-        conf2_cases_len = len(conf2_cases)
-        ton_cases_len = len(tradeornot_cases)
-        exit_cases_len = len(exit_cases)
-
-        for c in range(signal_cases_len):
-            trade_representations.append([signal_cases[c]])
-
-            if conf1_cases_len != 0 and conf1_cases_len == signal_cases_len:
-                trade_representations[c].append(conf1_cases[c])
-            if conf2_cases_len != 0 and conf2_cases_len == signal_cases_len:
-                trade_representations[c].append(conf2_cases[c])
-            if ton_cases_len != 0 and ton_cases_len == signal_cases_len:
-                trade_representations[c].append(tradeornot_cases[c])
-            if exit_cases_len != 0 and exit_cases_len == signal_cases_len:
-                trade_representations[c].append(exit_cases[c])
-
-        # trade_representations = tuple(zip(signal_cases, conf1_cases, conf2_cases, tradeornot_cases, exit_cases))
-        for t in trade_representations:
-            print(t)
-
-    all_cases = []
-    all_cases.append(trade_representations)
-    # if permutation_cases:
-    #    all_cases.append(list(permutation_cases))
-    # if signal_conf_cases:
-    #    all_cases.append(list(signal_conf_cases))
-    # if signal_cases:
-    #    all_cases.append(list(signal_cases))
-    ##if v_cases:
-    ##    all_cases.append(list(v_cases))
-    # if exit_cases:
-    #    all_cases.append(list(exit_cases))
-
-    all_combos = list(product(*all_cases))
-
-    formatted_all_combos = []
-    for combo in all_combos:
-        combo_list = []
-        for c in combo:
-            if not isinstance(c, list):
-                combo_list.append(c)
-            else:
-                combo_list += c
-        formatted_all_combos.append(combo_list)
+        total = len(config.SIGNAL) if config.SIGNAL is not None else 0
+    if sample is not None:
+        total = min(total, sample)
+    if shard is None:
+        return total
+    index, count = shard
+    return len(range(index - 1, total, count))
 
-    return formatted_all_combos
+
+def sample_cases(config, all_indi_combos, sample, seed=None):
+    """
+    Random sample of the combinations, for search spaces too large to test exhaustively (e.g. many ENTRY_PERMS
+    candidates). Combinations are picked uniformly and kept in their original order; only the picked ones are kept.
+    :param config: The global configuration instance
+    :param all_indi_combos: Combinations, as returned by make_indi_cases()
+    :param sample: Number of combinations to keep, or None to keep all
+    :param seed: Random seed, the same seed picks the same combinations (e.g. on all machines of a sharded sweep)
+    """
+    if sample is None:
+        return all_indi_combos
+    total = count_indi_cases(config)
+    picked = set(random.Random(seed).sample(range(total), min(sample, total)))
+    return (combo for i, combo in enumerate(all_indi_combos) if i in picked)
+
+
+def shard_cases(all_indi_combos, shard):
+    """
+    Splits the combinations across machines: shard (i, n) keeps every n-th combination, starting with the i-th (i from
+    1 to n). Together, the n shards cover all combinations once.
+    :param all_indi_combos: Combinations, as returned by make_indi_cases()
+    :param shard: (i, n), or None to keep all combinations
+    """
+    if shard is None:
+        return all_indi_combos
+    index, count = shard
+    return islice(all_indi_combos, index - 1, None, count)
 
 
 def create_experiment_files(config, all_indi_combos):
     """
     :param config: Global configuration instance
-    :param all_indi_combos: A list of tuples and dictionaries that represent all covered combinations, as returned
-                            by  make_indi_cases()
-    :return: Nothing - it generates yaml and set files.
+    :param all_indi_combos: Lists of dictionaries that represent all covered combinations, as returned by
+                            make_indi_cases(). Files are generated as the combinations are consumed.
+    :return: Number of generated cases - it generates yaml and set files.
     """
 
     if not os.path.exists(config.abs_test_case_expert_template):
@@ -219,15 +215,21 @@ def create_experiment_files(config, all_indi_combos):
         logging.error("Error in creating the batch file {} in modify_fields_in_place().".format(config.bat_file))
         sys.exit(144)
 
-    print("\n=== ALL INDI COMBOS ===")
-    for c in all_indi_combos:
-        print(c)
+    # The same list of test cases for hpFX_queue.py, which runs them all in a single queue rather than one at a time
+    queue_fn = os.path.splitext(config.bat_file)[0] + ".txt"
+    try:
+        queue_file = open(queue_fn, 'w')
+    except IOError:
+        logging.error("Error in creating the queue file {} in create_experiment_files().".format(queue_fn))
+        sys.exit(145)
+
+    # Both templates are read once, each case is rendered in memory and written at once
+    set_template = FieldTemplate(config.abs_test_case_expert_template)
+    yaml_template = FieldTemplate(config.hpFX_config_template)
 
+    num_cases = 0
     for indi in all_indi_combos:
-        # We need to use a temporary file as we don't know the final filename (yet).
-        tmp_set_file = tempfile.mktemp(prefix='hpFX_')
-        shutil.copy(config.abs_test_case_expert_template, tmp_set_file)
-
+        set_fields = []
         filename = ""
         for i in indi:
             # Needing this casting because Dict is also an iterable, messing up loops
@@ -236,10 +238,8 @@ def create_experiment_files(config, all_indi_combos):
             else:
                 list_i = i
             for c in list_i:
-                # DEBUG print("Modifying {} in {}".format(c, tmp_set_file))
-                modify_fields_in_place(c, tmp_set_file)
+                set_fields.append(c)
                 filename += "+" + str(c['GIVEN_NAME'])
-                # DEBUG print("-> ", c)
 
         # We generate the combination test experts by concatenating the indicator for each category using
         # a '+' sign. The first one gets one too, so we need to strip it.
@@ -249,21 +249,24 @@ def create_experiment_files(config, all_indi_combos):
         abs_set_fn = os.path.join(config.abs_experts_path, set_fn)
         abs_yaml_fn = os.path.join(config.abs_experts_path, yaml_fn)
 
-        print("Creating set file  : ", abs_set_fn)
-        print("Creating yaml file : ", abs_yaml_fn)
+        print("Creating set/yaml files : ", os.path.splitext(abs_yaml_fn)[0])
 
-        shutil.move(tmp_set_file, abs_set_fn)
+        write_file(abs_set_fn, set_template.render(*set_fields))
 
         # Next, we insert the *.set filename in the *.yaml file "TEST_CATEGORY": "TestCategory: "
         yaml_dict = {"EXPERT_FILE": os.path.join(config.experts_path, set_fn), "TEST_CATEGORY": config.testCategory}
-        shutil.copy(config.hpFX_config_template, abs_yaml_fn)
-        modify_fields_in_place(yaml_dict, abs_yaml_fn)
+        write_file(abs_yaml_fn, yaml_template.render(yaml_dict))
 
         # Finally, create a *.bat file to run all these experiments in batch
         command = "python \"{}\" -c \"{}\" -r\n".format(hpFX_exe, abs_yaml_fn)
         bat_file.write(command)
-        print(command)
+        queue_file.write(abs_yaml_fn + "\n")
+        num_cases += 1
 
-    print("\n>>> Processed {} cases in total.".format(len(all_indi_combos)))
+    print("\n>>> Processed {} cases in total.".format(num_cases))
     print("\n>>> You can run all cases using '{}'".format(config.bat_file))
+    print(">>> or, keeping all terminals busy across cases: python \"{}\" -l \"{}\"".format(
+        os.path.join(os.path.dirname(hpFX_exe), "hpFX_queue.py"), os.path.abspath(queue_fn)))
     bat_file.close()
+    queue_file.close()
+    return num_cases
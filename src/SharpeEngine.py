@@ -0,0 +1,210 @@
+import csv
+import logging
+import math
+from datetime import datetime
+import numpy as np
+
+# Layout of the trade times in MT4 reports: 'YYYY.MM.DD HH:MM'
+TIME_FORMAT = '%Y.%m.%d %H:%M'
+TIME_LENGTH = 16
+DIGIT_POSITIONS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15]
+SEPARATORS = {4: '.', 7: '.', 10: ' ', 13: ':'}
+
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def days_in_month(year, month):
+    """
+    :param year: Year(s), int or array
+    :param month: Month(s) 1-12, int or array
+    """
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return DAYS_IN_MONTH[np.asarray(month) - 1] + ((np.asarray(month) == 2) & leap)
+
+
+def parse_times(times):
+    """
+    Parses trade times with integer arithmetic on their characters, rather than one strptime() per trade.
+    :param times: Sequence of 'YYYY.MM.DD HH:MM' strings, or a datetime64 array (e.g. the 'Time' column of a TradeTable)
+    :return: (years, months, valid) arrays, 'valid' is False where the time can't be parsed
+    """
+    if isinstance(times, np.ndarray) and np.issubdtype(times.dtype, np.datetime64):
+        valid = ~np.isnat(times)
+        months = np.where(valid, times.astype('datetime64[M]').astype(np.int64), 0)
+        return months // 12 + 1970, months % 12 + 1, valid
+
+    n = len(times)
+    years = np.zeros(n, dtype=np.int64)
+    months = np.ones(n, dtype=np.int64)
+    if n == 0:
+        return years, months, np.zeros(0, dtype=bool)
+
+    text = np.asarray(times, dtype=str)
+    lengths = np.char.str_len(text)
+    try:
+        chars = text.astype('S{}'.format(TIME_LENGTH)).view(np.uint8).reshape(n, TIME_LENGTH).astype(np.int64)
+    except UnicodeEncodeError:
+        chars = np.zeros((n, TIME_LENGTH), dtype=np.int64)
+        lengths = np.zeros(n, dtype=np.int64)
+
+    valid = lengths == TIME_LENGTH
+    digits = chars[:, DIGIT_POSITIONS] - ord('0')
+    valid &= np.all((digits >= 0) & (digits <= 9), axis=1)
+    for position, separator in SEPARATORS.items():
+        valid &= chars[:, position] == ord(separator)
+
+    years = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    months = digits[:, 4] * 10 + digits[:, 5]
+    days = digits[:, 6] * 10 + digits[:, 7]
+    hours = digits[:, 8] * 10 + digits[:, 9]
+    minutes = digits[:, 10] * 10 + digits[:, 11]
+    valid &= (months >= 1) & (months <= 12) & (hours < 24) & (minutes < 60)
+    months = np.where(valid, months, 1)
+    valid &= (days >= 1) & (days <= days_in_month(years, months))
+
+    # Anything else strptime would still accept (e.g. no zero padding) is parsed the slow way
+    for i in np.flatnonzero(~valid):
+        try:
+            trade_time = datetime.strptime(times[i], TIME_FORMAT)
+        except (ValueError, TypeError):
+            logging.warning("Could not parse trade time: {}".format(times[i]))
+            continue
+        years[i] = trade_time.year
+        months[i] = trade_time.month
+        valid[i] = True
+
+    return years, np.where(valid, months, 1), valid
+
+
+class SharpeEngine:
+    """
+    Monthly and annual Sharpe Ratios of closed trade returns, for a given test period.
+
+    Trades are bucketed into months/years with array operations, so it's cheap to run on many trade lists (e.g. the
+    <SYMBOL>_TRADES.csv of every test in a batch). The values are exactly those HTMParser always reported: periods
+    without trades count as zero returns, trades outside the test period are ignored and the annual ratio is only
+    calculated for tests spanning at least a year.
+    """
+    def __init__(self, date_from, date_to, risk_free_rate=0.0):
+        """
+        :param date_from: Test start date as string 'YYYY.MM.DD'
+        :param date_to: Test end date as string 'YYYY.MM.DD'
+        :param risk_free_rate: Annual risk-free rate as decimal (e.g., 0.02 for 2%)
+        """
+        self.risk_free_rate = risk_free_rate
+        self.start_date = datetime.strptime(date_from, '%Y.%m.%d')
+        self.end_date = datetime.strptime(date_to, '%Y.%m.%d')
+        self.duration_years = (self.end_date - self.start_date).days / 365.25
+
+        self.first_month = self.start_date.year * 12 + self.start_date.month - 1
+        self.num_months = self.__count_months()
+        self.num_years = self.__count_years()
+
+    def __count_months(self):
+        # Same periods as stepping one calendar month at a time from the start date, while not past the end date. The
+        # day of the month sticks to the shortest month on the way (Jan 31 -> Feb 28 -> Mar 28).
+        last_month = self.end_date.year * 12 + self.end_date.month - 1
+        if last_month < self.first_month:
+            return 0
+        day = self.start_date.day
+        for month in range(self.first_month + 1, last_month + 1):
+            day = min(day, int(days_in_month(month // 12, month % 12 + 1)))
+        return last_month - self.first_month + (1 if day <= self.end_date.day else 0)
+
+    def __count_years(self):
+        # Same as stepping one year at a time, where Feb 29 becomes Feb 28 for good
+        start, end = self.start_date, self.end_date
+        if end.year < start.year:
+            return 0
+        day = start.day
+        if end.year > start.year and start.month == 2 and start.day == 29:
+            day = 28
+        return end.year - start.year + (1 if (start.month, day) <= (end.month, end.day) else 0)
+
+    def sharpe(self, times, returns):
+        """
+        :param times: Close times of the trades, 'YYYY.MM.DD HH:MM' strings or a datetime64 array
+        :param returns: Returns of the trades in %, as a float array
+        :return: dict: {'monthly': value or 'N/A', 'annual': value or 'N/A'}
+        """
+        if len(times) == 0:
+            logging.warning("No closed trades found for Sharpe calculation")
+            return {'monthly': 'N/A', 'annual': 'N/A'}
+
+        returns = np.asarray(returns, dtype=np.float64)
+        years, months, valid = parse_times(times)
+
+        monthly = self.__period_sharpe(years * 12 + months - 1 - self.first_month, returns, valid, self.num_months,
+                                       (self.risk_free_rate / 12.0) * 100, 12)
+        if self.duration_years >= 1.0:
+            annual = self.__period_sharpe(years - self.start_date.year, returns, valid, self.num_years,
+                                          self.risk_free_rate * 100, 1)
+        else:
+            annual = 'N/A'
+            logging.warning("Test period < 1 year, Annual Sharpe not calculated")
+
+        return {'monthly': monthly, 'annual': annual}
+
+    @staticmethod
+    def __period_sharpe(period_index, returns, valid, num_periods, period_rf, periods_per_year):
+        # Need at least 2 periods to calculate standard deviation
+        if num_periods < 2:
+            logging.warning("Insufficient periods for Sharpe calculation (need >= 2)")
+            return 'N/A'
+
+        keep = valid & (period_index >= 0) & (period_index < num_periods)
+        # bincount adds up the returns of each period in trade order, just like a running sum would
+        returns_list = np.bincount(period_index[keep], weights=returns[keep], minlength=num_periods).tolist()
+
+        # Only a handful of periods left, plain floats keep the results identical to the original calculation
+        mean_return = sum(returns_list) / len(returns_list)
+        variance = sum((r - mean_return) ** 2 for r in returns_list) / (len(returns_list) - 1)
+        std_return = math.sqrt(variance)
+
+        # Avoid division by zero
+        if std_return == 0:
+            logging.warning("Zero standard deviation, Sharpe cannot be calculated")
+            return 'N/A'
+
+        # Sharpe = (Mean Return - Risk Free Rate) / Std Dev * sqrt(periods per year)
+        sharpe = ((mean_return - period_rf) / std_return) * math.sqrt(periods_per_year)
+        return round(sharpe, 2)
+
+    def sharpe_of_trades(self, trades):
+        """
+        :param trades: List of trade dicts with 'Time' and 'Return %', as extracted by HTMParser. Rows without a return
+                       (i.e. trade entries) are skipped.
+        """
+        times = []
+        returns = []
+        for trade in trades:
+            if trade['Return %'] == '':
+                continue
+            try:
+                returns.append(float(trade['Return %']))
+            except ValueError:
+                continue
+            times.append(trade['Time'])
+        return self.sharpe(times, returns)
+
+    def sharpe_of_table(self, table):
+        """
+        :param table: TradeTable of a single symbol
+        """
+        closed = table.closed()
+        times = table['Time'][closed]
+        if any(column == 'Time' for _, column in table.raw):
+            # Some times are in a layout the table can't hold, but strptime may still make sense of them
+            times = [row['Time'] for row, is_closed in zip(table, closed) if is_closed]
+        return self.sharpe(times, table['Return %'][closed])
+
+    def sharpe_of_trades_csv(self, trades_csv):
+        """
+        :param trades_csv: A <SYMBOL>_TRADES.csv file written by hpFX (or any CSV with Symbol, Time and Return % columns)
+        :return: dict of symbol -> {'monthly': value or 'N/A', 'annual': value or 'N/A'}
+        """
+        trades = {}
+        with open(trades_csv, 'r', newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                trades.setdefault(row['Symbol'], []).append(row)
+        return {symbol: self.sharpe_of_trades(symbol_trades) for symbol, symbol_trades in trades.items()}
@@ -1,19 +1,33 @@
+from src.Launcher import ShellLauncher
+
+
 class Terminal:
-    def __init__(self, name, path, exe, data_folder):
+    def __init__(self, name, path, exe, data_folder, launcher=None):
         self.name = name
         self.path = path
         self.exe = exe
         self.data_folder = data_folder
+        # How the terminal is started, see Launcher.py
+        self.launcher = launcher or ShellLauncher()
 
     def print(self):
         print("name         :    {}".format(self.name))
         print("path         :    {}".format(self.path))
         print("data_folder  :    {}".format(self.data_folder))
         print("exe          :    {}".format(self.exe))
+        print("launcher     :    {}".format(type(self.launcher).__name__))
         print()
 
-    def run(self):
-        pass
+    def run(self, input_ini, timeout=None):
+        """
+        Runs the test defined by the given ini file and waits until the terminal exits.
+        :param timeout: Seconds to wait before killing the terminal, None to wait as long as it takes
+        :return: The exit status reported by the launcher, None if the terminal was killed after the timeout
+        """
+        return self.launcher.run(self, input_ini, timeout=timeout)
+
+    def kill(self):
+        self.launcher.kill(self)
 
 
 
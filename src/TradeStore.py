@@ -0,0 +1,132 @@
+import os
+import numpy as np
+from src.TradeTable import TradeTable
+
+# Layouts accepted for the bounds of time range queries
+TIME_LENGTH = 16
+DATE_LENGTH = 10
+
+
+class TradeStore:
+    """
+    The trades of every symbol of a batch in a single file (TRADES.npz under the test specific folder), for portfolio
+    analysis without reloading and concatenating the <SYMBOL>_TRADES files by hand.
+
+    Trades are kept sorted by symbol and then by time, so a query only slices the rows of the requested symbols and
+    finds the time range with a binary search, rather than scanning the whole batch:
+
+        store = TradeStore.load(os.path.join(test_specific_folder, "TRADES.npz"))
+        trades = store.query(symbols=['EURUSD', 'GBPUSD'], time_from='2022.01.01', time_to='2022.12.31',
+                             closed_only=True)
+    """
+    def __init__(self, table=None):
+        """
+        :param table: TradeTable with the trades of the batch, in any order
+        """
+        self.table = TradeTable() if table is None else table
+        self.__index()
+
+    def __index(self):
+        codes = self.table['Symbol']
+        times = self.table['Time']
+        # NaT (times the table couldn't parse) sort last within each symbol
+        if len(codes) > 1 and not self.__is_sorted(codes, times):
+            self.table = self.table.take(np.lexsort((times, codes)))
+            codes = self.table['Symbol']
+        # Rows [start, end) of each symbol
+        self.ranges = {}
+        bounds = np.searchsorted(codes, np.arange(len(self.table.symbols) + 1))
+        for code, symbol in enumerate(self.table.symbols):
+            if bounds[code + 1] > bounds[code]:
+                self.ranges[symbol] = (int(bounds[code]), int(bounds[code + 1]))
+
+    @staticmethod
+    def __is_sorted(codes, times):
+        same_symbol = codes[1:] == codes[:-1]
+        # NaT compares False with anything, it's only in order when followed by NaT (or another symbol)
+        in_order = (times[1:] >= times[:-1]) | np.isnat(times[1:])
+        return bool(np.all((codes[1:] > codes[:-1]) | (same_symbol & in_order)))
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def symbols(self):
+        """
+        :return: Symbols with at least one trade in the store
+        """
+        return list(self.ranges)
+
+    @classmethod
+    def load(cls, fn):
+        """
+        :param fn: A store written by save()
+        """
+        return cls(TradeTable.load(fn))
+
+    def save(self, fn):
+        self.table.save(fn)
+
+    @classmethod
+    def from_reports_folder(cls, reports_folder, symbols, extensions=('.npz', '.csv')):
+        """
+        Collects the <SYMBOL>_TRADES files of the given symbols.
+        :param extensions: Trade files to look for, in order of preference
+        """
+        tables = []
+        for symbol in symbols:
+            for extension in extensions:
+                trades_fn = os.path.join(reports_folder, "{}_TRADES{}".format(symbol, extension))
+                if os.path.exists(trades_fn):
+                    tables.append(TradeTable.load(trades_fn))
+                    break
+        return cls(TradeTable.concat(tables))
+
+    @staticmethod
+    def __to_time(value, is_end):
+        # 'YYYY.MM.DD' bounds cover the entire day, so time_to='2022.12.31' includes the trades of Dec 31st
+        if isinstance(value, str):
+            value = value.strip()
+            if len(value) not in (DATE_LENGTH, TIME_LENGTH):
+                raise ValueError("Invalid time '{}', expected 'YYYY.MM.DD' or 'YYYY.MM.DD HH:MM'".format(value))
+            time = np.datetime64(value.replace('.', '-').replace(' ', 'T'), 'm')
+            if len(value) == DATE_LENGTH and is_end:
+                time += np.timedelta64(1, 'D') - np.timedelta64(1, 'm')
+            return time
+        return np.datetime64(value, 'm')
+
+    def query(self, symbols=None, time_from=None, time_to=None, closed_only=False):
+        """
+        :param symbols: Symbol or list of symbols to select, all of them if None
+        :param time_from: Earliest trade time, 'YYYY.MM.DD', 'YYYY.MM.DD HH:MM' or datetime64 (inclusive)
+        :param time_to: Latest trade time, same formats as time_from (inclusive)
+        :param closed_only: Only the rows closing a trade, i.e. those with a return
+        :return: TradeTable of the matching trades, by symbol and then by time
+        """
+        if symbols is None:
+            symbols = self.symbols
+        elif isinstance(symbols, str):
+            symbols = [symbols]
+
+        times = self.table['Time']
+        slices = []
+        for symbol in symbols:
+            if symbol not in self.ranges:
+                continue
+            start, end = self.ranges[symbol]
+            if time_from is not None or time_to is not None:
+                # Leave the NaT rows at the end of the symbol out of the search, they don't match any range
+                symbol_times = times[start:end]
+                end = start + int(np.searchsorted(symbol_times, np.datetime64('NaT'), side='left'))
+                symbol_times = times[start:end]
+                if time_to is not None:
+                    end = start + int(np.searchsorted(symbol_times, self.__to_time(time_to, True), side='right'))
+                if time_from is not None:
+                    start += int(np.searchsorted(symbol_times, self.__to_time(time_from, False), side='left'))
+            if end > start:
+                slices.append(np.arange(start, end))
+
+        rows = np.concatenate(slices) if len(slices) > 0 else np.zeros(0, dtype=np.int64)
+        if closed_only:
+            rows = rows[~np.isnan(self.table['Return %'][rows])]
+        return self.table.take(rows)
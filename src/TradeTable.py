@@ -0,0 +1,309 @@
+import csv
+import logging
+import os
+import numpy as np
+
+# Columns of the trade table, in the order of <SYMBOL>_TRADES.csv
+COLUMNS = ['Symbol', '#', 'Time', 'Type', 'Order', 'Size', 'Price', 'S/L', 'T/P', 'Profit', 'Balance', 'Return %']
+INT_COLUMNS = ['#', 'Order']
+FLOAT_COLUMNS = ['Size', 'Price', 'S/L', 'T/P', 'Profit', 'Balance']
+
+# Names of the columns in the binary (npz) format
+NPZ_NAMES = {'Symbol': 'symbol', '#': 'number', 'Time': 'time', 'Type': 'type', 'Order': 'order', 'Size': 'size',
+             'Price': 'price', 'S/L': 'sl', 'T/P': 'tp', 'Profit': 'profit', 'Balance': 'balance',
+             'Return %': 'return_pct'}
+
+
+class TradeTable:
+    """
+    Trades of one or more symbols, held column by column in typed arrays rather than one dict of strings per trade.
+    Symbols and trade types are small integer codes (see 'symbols' and 'types'), times are datetime64[m] and prices,
+    profits, etc. are floats, NaN where the report leaves them blank (e.g. profit of trade entries).
+
+    Iterating over the table yields the rows as dicts, exactly as they'd appear in <SYMBOL>_TRADES.csv: the number of
+    decimals of each column is kept per symbol and cells that wouldn't read back the same are kept as they were.
+    """
+    def __init__(self):
+        self.symbols = []
+        self.types = []
+        self.columns = {'Symbol': np.zeros(0, dtype=np.uint16),
+                        '#': np.zeros(0, dtype=np.int32),
+                        'Time': np.zeros(0, dtype='datetime64[m]'),
+                        'Type': np.zeros(0, dtype=np.uint8),
+                        'Order': np.zeros(0, dtype=np.int32),
+                        'Return %': np.zeros(0, dtype=np.float64)}
+        for column in FLOAT_COLUMNS:
+            self.columns[column] = np.zeros(0, dtype=np.float64)
+        # (symbol, column) -> number of decimals in the report
+        self.decimals = {}
+        # (row, column) -> original text, for the few cells the arrays can't reproduce
+        self.raw = {}
+
+    def __len__(self):
+        return len(self.columns['#'])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @classmethod
+    def from_rows(cls, symbol, rows, initial_deposit):
+        """
+        :param symbol: Symbol of the trades
+        :param rows: Cell texts of the trade table rows, header excluded
+        :param initial_deposit: Balance before the first trade, to calculate the return of each trade
+        """
+        table = cls()
+        rows = [cells for cells in rows if len(cells) >= 8]  # Minimum required columns
+        n = len(rows)
+        table.symbols = [symbol]
+
+        texts = {}
+        for c, column in enumerate(COLUMNS[1:9]):
+            texts[column] = [cells[c] for cells in rows]
+        # Profit and Balance may be empty for entry rows
+        texts['Profit'] = [cells[8] if len(cells) >= 10 else "" for cells in rows]
+        texts['Balance'] = [cells[9] if len(cells) >= 10 else "" for cells in rows]
+
+        table.columns['Symbol'] = np.zeros(n, dtype=np.uint16)
+        table.columns['Time'] = table.__parse_times(texts['Time'])
+        types = {}
+        table.columns['Type'] = np.array([types.setdefault(t, len(types)) for t in texts['Type']], dtype=np.uint8)
+        table.types = list(types)
+        for column in INT_COLUMNS:
+            table.columns[column] = table.__parse_ints(column, texts[column])
+        for column in FLOAT_COLUMNS:
+            table.columns[column] = table.__parse_floats(symbol, column, texts[column])
+
+        # Return % for close rows (those with profit/balance) = (Profit / Balance_before_trade) * 100
+        profit = table.columns['Profit']
+        balance = table.columns['Balance']
+        closed = np.flatnonzero(~np.isnan(profit) & ~np.isnan(balance) & np.array([p != "" and b != "" for p, b in
+                                                                                  zip(texts['Profit'],
+                                                                                      texts['Balance'])], dtype=bool))
+        previous_balance = np.concatenate(([initial_deposit], balance[closed][:-1]))
+        returns = np.full(n, np.nan)
+        # Python's round() rather than NumPy's, they don't always agree on the last digit
+        returns[closed] = [round(r, 4) for r in ((profit[closed] / previous_balance) * 100).tolist()]
+        table.columns['Return %'] = returns
+        return table
+
+    def __parse_times(self, texts):
+        try:
+            times = np.array([t.replace('.', '-').replace(' ', 'T') for t in texts], dtype='datetime64[m]')
+        except ValueError:
+            times = np.full(len(texts), np.datetime64('NaT'), dtype='datetime64[m]')
+            for i, text in enumerate(texts):
+                try:
+                    times[i] = np.datetime64(text.replace('.', '-').replace(' ', 'T'), 'm')
+                except ValueError:
+                    pass
+        # Anything that doesn't format back the same is kept as is
+        self.__keep_mismatches('Time', texts, self.__format_times(times))
+        return times
+
+    @staticmethod
+    def __format_times(times):
+        iso = np.datetime_as_string(times, unit='m').tolist()
+        return [t.replace('-', '.').replace('T', ' ') if t != 'NaT' else '' for t in iso]
+
+    def __keep_mismatches(self, column, texts, formatted):
+        if formatted == texts:
+            return
+        for i in np.flatnonzero(np.array(formatted, dtype=object) != np.array(texts, dtype=object)):
+            self.raw[(int(i), column)] = texts[i]
+
+    def __parse_ints(self, column, texts):
+        try:
+            values = np.array(texts, dtype=np.int64).astype(np.int32)
+        except (ValueError, OverflowError):
+            values = np.full(len(texts), -1, dtype=np.int32)
+            for i, text in enumerate(texts):
+                try:
+                    values[i] = int(text)
+                except (ValueError, OverflowError):
+                    pass
+        self.__keep_mismatches(column, texts, [str(v) for v in values.tolist()])
+        return values
+
+    def __parse_floats(self, symbol, column, texts):
+        try:
+            values = np.array([t if t != "" else "nan" for t in texts], dtype=np.float64)
+        except ValueError:
+            values = np.full(len(texts), np.nan)
+            for i, text in enumerate(texts):
+                try:
+                    values[i] = float(text)
+                except ValueError:
+                    pass
+        decimals = 0
+        for text in texts:
+            if text != "":
+                decimals = len(text) - text.index('.') - 1 if '.' in text else 0
+                break
+        self.decimals[(symbol, column)] = decimals
+        self.__keep_mismatches(column, texts, self.__format_floats(values, decimals))
+        return values
+
+    @staticmethod
+    def __format_floats(values, decimals):
+        formatted = list(map('{{:.{}f}}'.format(decimals).format, values.tolist()))
+        for i in np.flatnonzero(np.isnan(values)).tolist():
+            formatted[i] = ""
+        return formatted
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        :return: A single table with the trades of all given tables, one after the other
+        """
+        table = cls()
+        tables = [t for t in tables if len(t) > 0]
+        symbol_codes = {}
+        type_codes = {}
+        offset = 0
+        parts = {column: [] for column in COLUMNS}
+        for t in tables:
+            symbol_map = np.array([symbol_codes.setdefault(s, len(symbol_codes)) for s in t.symbols], dtype=np.uint16)
+            type_map = np.array([type_codes.setdefault(s, len(type_codes)) for s in t.types], dtype=np.uint8)
+            for column in COLUMNS:
+                parts[column].append(t.columns[column])
+            parts['Symbol'][-1] = symbol_map[t.columns['Symbol']]
+            parts['Type'][-1] = type_map[t.columns['Type']]
+            table.decimals.update(t.decimals)
+            for (row, column), text in t.raw.items():
+                table.raw[(row + offset, column)] = text
+            offset += len(t)
+        if len(tables) > 0:
+            for column in COLUMNS:
+                table.columns[column] = np.concatenate(parts[column])
+        table.symbols = list(symbol_codes)
+        table.types = list(type_codes)
+        return table
+
+    def take(self, rows):
+        """
+        :param rows: Boolean mask or indices of the rows to keep
+        :return: A new table with the selected rows
+        """
+        indices = np.arange(len(self))[rows]
+        table = TradeTable()
+        table.symbols = self.symbols.copy()
+        table.types = self.types.copy()
+        table.decimals = self.decimals.copy()
+        for column in COLUMNS:
+            table.columns[column] = self.columns[column][indices]
+        new_rows = {old: new for new, old in enumerate(indices.tolist())}
+        for (row, column), text in self.raw.items():
+            if row in new_rows:
+                table.raw[(new_rows[row], column)] = text
+        return table
+
+    def closed(self):
+        """
+        :return: Boolean mask of the rows closing a trade, i.e. those with a return
+        """
+        return ~np.isnan(self.columns['Return %'])
+
+    def __formatted_columns(self):
+        """
+        :return: The columns of the CSV view, as lists of values
+        """
+        formatted = {'Symbol': [self.symbols[c] for c in self.columns['Symbol'].tolist()],
+                     'Time': self.__format_times(self.columns['Time']),
+                     'Type': [self.types[c] for c in self.columns['Type'].tolist()],
+                     'Return %': ['' if r != r else r for r in self.columns['Return %'].tolist()]}
+        for column in INT_COLUMNS:
+            formatted[column] = [str(v) for v in self.columns[column].tolist()]
+        for column in FLOAT_COLUMNS:
+            formatted[column] = [""] * len(self)
+            for code, symbol in enumerate(self.symbols):
+                rows = np.flatnonzero(self.columns['Symbol'] == code)
+                if len(self.symbols) == 1:
+                    rows = slice(None)
+                values = self.__format_floats(self.columns[column][rows], self.decimals.get((symbol, column), 0))
+                if len(self.symbols) == 1:
+                    formatted[column] = values
+                else:
+                    for i, value in zip(rows.tolist(), values):
+                        formatted[column][i] = value
+        for (row, column), text in self.raw.items():
+            formatted[column][row] = text
+        return formatted
+
+    def __iter__(self):
+        """
+        Yields the rows as dicts of <SYMBOL>_TRADES.csv, i.e. the CSV view of the table.
+        """
+        formatted = self.__formatted_columns()
+        for i in range(len(self)):
+            yield {column: formatted[column][i] for column in COLUMNS}
+
+    def to_csv(self, fn, overwrite=True):
+        """
+        Writes the CSV view of the table, appending to fn unless overwrite is set.
+        """
+        if len(self) == 0:
+            return
+        is_blank = overwrite or not os.path.exists(fn) or os.stat(fn).st_size == 0
+        formatted = self.__formatted_columns()
+        with open(fn, 'w' if overwrite else 'a+', newline='') as output_file:
+            csv_buffer = csv.writer(output_file)
+            if is_blank:
+                csv_buffer.writerow(COLUMNS)
+            csv_buffer.writerows(zip(*[formatted[column] for column in COLUMNS]))
+
+    def save(self, fn):
+        """
+        Writes the table in NumPy's compressed binary format (npz), considerably smaller and faster to load than CSV.
+        """
+        arrays = {NPZ_NAMES[column]: self.columns[column] for column in COLUMNS}
+        arrays['symbols'] = np.array(self.symbols, dtype=str)
+        arrays['types'] = np.array(self.types, dtype=str)
+        arrays['decimals'] = np.array([[s, c, str(d)] for (s, c), d in self.decimals.items()], dtype=str)
+        arrays['raw'] = np.array([[str(r), c, t] for (r, c), t in self.raw.items()], dtype=str)
+        # Written aside and moved in place, so readers never see a partial file
+        tmp_fn = fn + ".tmp.npz"
+        np.savez_compressed(tmp_fn, **arrays)
+        os.replace(tmp_fn, fn)
+
+    @classmethod
+    def load(cls, fn):
+        """
+        :param fn: A table written by save() (npz) or a <SYMBOL>_TRADES.csv
+        """
+        if os.path.splitext(fn)[1].lower() == '.csv':
+            return cls.from_csv(fn)
+
+        table = cls()
+        with np.load(fn) as arrays:
+            for column in COLUMNS:
+                table.columns[column] = arrays[NPZ_NAMES[column]]
+            table.symbols = arrays['symbols'].tolist()
+            table.types = arrays['types'].tolist()
+            table.decimals = {(s, c): int(d) for s, c, d in arrays['decimals'].reshape(-1, 3).tolist()}
+            table.raw = {(int(r), c): t for r, c, t in arrays['raw'].reshape(-1, 3).tolist()}
+        return table
+
+    @classmethod
+    def from_csv(cls, fn):
+        """
+        Reads a <SYMBOL>_TRADES.csv (or a concatenation of them) back into a table.
+        """
+        by_symbol = {}
+        with open(fn, 'r', newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                by_symbol.setdefault(row['Symbol'], []).append(row)
+
+        tables = []
+        for symbol, rows in by_symbol.items():
+            table = cls.from_rows(symbol, [[row[c] for c in COLUMNS[1:11]] for row in rows], 1.0)
+            # The returns were calculated when the report was parsed, don't recalculate them
+            returns = np.full(len(rows), np.nan)
+            for i, row in enumerate(rows):
+                try:
+                    returns[i] = float(row['Return %']) if row['Return %'] != '' else np.nan
+                except ValueError:
+                    logging.warning("Ignoring invalid return in {}: {}".format(fn, row['Return %']))
+            table.columns['Return %'] = returns
+            tables.append(table)
+        return cls.concat(tables)
@@ -36,10 +36,28 @@ def kill_all_terminals(conf):
     print("Terminating all open MT4 back testing instances (if any) to launch new tests.")
     for t in workers:
         print("Killing: ", t.exe)
-        command = "WMIC Process Where \"ExecutablePath=\'{}\'\" Call Terminate  2>&1>NUL".format(t.exe)
-        command = command.replace('\\', '\\\\')
-        #print(command)
-        os.system(command)
+        t.kill()
+
+
+def signal_handler(conf, sig, frame):
+    """
+    SIGINT (Ctrl+C) handler of the scripts running tests, kills all terminals and exits once confirmed:
+        signal.signal(signal.SIGINT, partial(signal_handler, conf))
+    """
+    if input("Are you sure you'd like to terminate all tests and exit? (y/n)").upper() == "Y":
+        kill_all_terminals(conf)
+        sys.exit(0)
+    else:
+        return
+
+
+def read_queue_file(fn):
+    """
+    :param fn: File listing test configuration files (YAML), one per line, as created by test_case_maker.py
+    :return: The test configuration files, leaving out blank and comment ('#') lines
+    """
+    with open(fn, 'r') as queue_file:
+        return [line.strip().strip('"') for line in queue_file if line.strip() and not line.startswith('#')]
 
 def read_set_file(fn):
     """
@@ -52,6 +70,26 @@ def read_set_file(fn):
     return set_content
 
 
+def keyword_slots(lines):
+    """
+    Prefix index of the keyword_dict{} fields: the lines holding each of them, found in a single pass. Each line is
+    looked up by its prefix up to the first '=' (or ': '), rather than compared with every keyword.
+
+    :param lines: Lines of a *.set (or hpFX YAML) file, as returned by read_set_file()
+    :return: A dictionary of keyword_dict{} key -> list of line indices
+    """
+    keys = {prefix: key for key, prefix in keyword_dict.items()}
+    slots = {}
+    for i, line in enumerate(lines):
+        for separator in ('=', ': '):
+            end = line.find(separator)
+            if end >= 0:
+                key = keys.get(line[:end + len(separator)])
+                if key is not None:
+                    slots.setdefault(key, []).append(i)
+    return slots
+
+
 def extract_fields(set_fn):
     """
     Extracts given fields from the input expert configuration (set) file.
@@ -64,15 +102,67 @@ def extract_fields(set_fn):
         logging.error("Can't find the file to extract parameters from: {}".format(set_fn))
         sys.exit(301)
 
-    with open(set_fn, 'r') as set_file:
-        for line in set_file:
-            for keyword in keyword_dict.keys():
-                if line.startswith(keyword_dict[keyword]):
-                    extracted_fields[keyword] = line.split('=')[1].strip()
+    lines = read_set_file(set_fn)
+    for keyword, indices in keyword_slots(lines).items():
+        extracted_fields[keyword] = lines[indices[-1]].split('=')[1].strip()
 
     return extracted_fields
 
 
+def render_fields(values, lines, slots=None):
+    """
+    Replaces the lines of the given fields with their new values, see modify_fields_in_place().
+
+    :param values: A dictionary of values to replace, by keyword_dict{} key
+    :param lines: Lines of a *.set file, as returned by read_set_file()
+    :param slots: keyword_slots() of the lines, if already known
+    :return: The modified lines
+    """
+    if slots is None:
+        slots = keyword_slots(lines)
+    modified_lines = list(lines)
+    for value in values.keys():
+        if value == 'GIVEN_NAME':
+            continue
+        prefix = keyword_dict[value]
+        for i in slots.get(value, ()):
+            modified_lines[i] = prefix + str(values[value]) + "\n"
+    return modified_lines
+
+
+def write_file(fn, content, atomic=False):
+    """
+    Writes the whole content of a file at once.
+
+    :param content: String, or list of lines
+    :param atomic: Write to a temporary file next to fn first and move it in place, so fn is never seen half written
+    """
+    if not isinstance(content, str):
+        content = "".join(content)
+    output_fn = fn + ".tmp" if atomic else fn
+    with open(output_fn, 'w') as output_file:
+        output_file.write(content)
+    if atomic:
+        os.replace(output_fn, fn)
+
+
+def modify_fields_in_files(updates, atomic=True):
+    """
+    Batch version of modify_fields_in_place(): each file is read, indexed and written once, whatever the number of
+    fields to replace in it.
+
+    :param updates: A dictionary of file name -> dictionary of values to search and replace in it (or a list of
+                    such dictionaries, applied in order)
+    :param atomic: See write_file()
+    """
+    for fn, values in updates.items():
+        lines = read_set_file(fn)
+        slots = keyword_slots(lines)
+        for fields in [values] if isinstance(values, dict) else values:
+            lines = render_fields(fields, lines, slots)
+        write_file(fn, lines, atomic=atomic)
+
+
 def modify_fields_in_place(values, input_fn):
     """
     Finds given values in given file, and replaces them with their corresponding values in the
@@ -84,28 +174,7 @@ def modify_fields_in_place(values, input_fn):
     :param input_fn: input file to read values from
     :return:
     """
-
-    file_desc, tmp_fn = tempfile.mkstemp(prefix='hpFX_')
-    try:
-        tmp_file = os.fdopen(file_desc, 'w')
-    except IOError:
-        logging.error("An error occurred creating a temp file in modify_fields_in_place(). Please send a bug report.")
-        sys.exit(141)
-
-    #DEBUG print("==== INPUT FN ===== : ", input_fn)
-    with open(input_fn, 'r') as input_file:
-        for line in input_file:
-            modified_line = line
-            for value in values.keys():
-                if value == 'GIVEN_NAME':
-                    continue
-                if line.startswith(keyword_dict[value]):
-                    modified_line = keyword_dict[value] + str(values[value]) + "\n"
-            tmp_file.write(modified_line)
-
-    input_file.close()
-    tmp_file.close()
-    shutil.move(tmp_fn, input_fn)
+    modify_fields_in_files({input_fn: values})
 
 
 def dict_to_csv(input_dict, file_name, overwrite=False):
@@ -243,22 +312,62 @@ def update_hpfx_csv_headers(src_set, dest_csv):
     shutil.move(tmp_fn, dest_csv)
 
 
-def postprocess_results(conf):
+def parse_htm_report(symbol, html_report, reports_folder, calculate_sharpe=False, risk_free_rate=0.0,
+                     date_from=None, date_to=None, streaming=False, trades_format='csv', optimization_metrics=None,
+                     optimization_top=0, report_cache=None, report_cache_size=0):
     """
-    Process HTM reports to generate RESULTS.csv and individual TRADES.csv files.
-    Calculates Sharpe Ratios (Monthly and Annual) when enabled in configuration.
+    Parses a single symbol's HTM report and writes its {SYMBOL}_TRADES.csv (and/or .npz, as per trades_format). Kept
+    at module level so it can be handed to a multiprocessing pool by postprocess_results().
 
-    Args:
-        conf: GlobalConfig object containing test configuration and paths
+    :return: (summary_output, number_of_trades, error) where error is None on success. Failures are returned rather
+             than raised so a single broken report can't take the rest of the batch down with it.
+    :param report_cache: Folder of the parsed report cache (see ReportCache.py), None to always parse the report
+    :param report_cache_size: Size of the parsed report cache, in bytes
+    """
+    from src import HTMParser, ReportCache
 
-    Writes:
-        - RESULTS.csv: Summary metrics for all symbols (includes Sharpe ratios if enabled)
-        - {SYMBOL}_TRADES.csv: Individual trade data per symbol in htm_reports folder
+    try:
+        options = {'calculate_sharpe': calculate_sharpe, 'risk_free_rate': risk_free_rate, 'date_from': date_from,
+                   'date_to': date_to, 'optimization_metrics': optimization_metrics,
+                   'optimization_top': optimization_top}
+        if report_cache is not None:
+            cache = ReportCache(report_cache, report_cache_size)
+            try:
+                summary_output, trades_output = cache.htm_to_csv(html_report, streaming=streaming, **options)
+            finally:
+                cache.close()
+        else:
+            summary_output, trades_output = HTMParser(html_report, streaming=streaming).htm_to_csv(**options)
+
+        # Write individual trades to {SYMBOL}_TRADES.csv and/or {SYMBOL}_TRADES.npz in htm_reports folder
+        if len(trades_output) > 0:
+            if trades_format in ('csv', 'both'):
+                trades_output.to_csv(os.path.join(reports_folder, "{}_TRADES.csv".format(symbol)))
+            if trades_format in ('npz', 'both'):
+                trades_output.save(os.path.join(reports_folder, "{}_TRADES.npz".format(symbol)))
+
+        return summary_output, len(trades_output), None
+
+    # HTMParser calls sys.exit() on unreadable reports, which would otherwise kill a pool worker
+    except (Exception, SystemExit) as e:
+        return None, 0, e
+
+
+def _parse_htm_report_job(job):
+    # Pool.imap() hands over a single argument
+    return parse_htm_report(*job)
+
+
+def htm_report_job(conf, symbol):
+    """
+    :return: The parse_htm_report() arguments for a given symbol of the batch
     """
-    import os
-    import logging
-    from src import HTMParser
+    return (symbol, conf.htm_reports[symbol], conf.abs_reports_folder, conf.calculate_sharpe, conf.risk_free_rate,
+            conf.date_from, conf.date_to, conf.streaming_parser, conf.trades_format, conf.optimization_metrics,
+            conf.optimization_top, conf.report_cache, conf.report_cache_size)
+
 
+def print_sharpe_configuration(conf):
     # Display Sharpe Ratio configuration status
     if conf.calculate_sharpe:
         print("\n=== Sharpe Ratio Calculation Enabled ===")
@@ -267,57 +376,118 @@ def postprocess_results(conf):
         print("Calculating Monthly and Annual Sharpe Ratios...")
         print("==========================================\n")
 
-    # Track symbols with Sharpe calculation warnings
-    sharpe_warnings = []
-    trades_processed = 0
 
-    for s in conf.symbols:
-        if s in conf.htm_reports.keys():
-            html_report = conf.htm_reports[s]
-            parsed_results = HTMParser(html_report)
+def new_postprocess_stats():
+    # Track symbols with Sharpe calculation warnings, the number of trade rows written and those in the trade store,
+    # and the portfolio statistics when requested
+    return {'trades_processed': 0, 'sharpe_warnings': [], 'trades_stored': 0, 'portfolio': None}
 
-            try:
-                summary_output, trades_output = parsed_results.htm_to_csv(
-                    calculate_sharpe=conf.calculate_sharpe,
-                    risk_free_rate=conf.risk_free_rate,
-                    date_from=conf.date_from,
-                    date_to=conf.date_to
-                )
-
-                # Write summary to RESULTS.csv
-                dict_to_csv(summary_output, conf.test_report_csv)
-
-                # Write individual trades to {SYMBOL}_TRADES.csv in htm_reports folder
-                if len(trades_output) > 0:
-                    symbol_trades_csv = os.path.join(conf.abs_reports_folder, "{}_TRADES.csv".format(s))
-                    dict_to_csv(trades_output, symbol_trades_csv, overwrite=True)
-                    trades_processed += len(trades_output)
-                    print("Processed {} - {} trades extracted".format(s, len(trades_output)))
-                else:
-                    print("Processed {} - No trades found".format(s))
-
-                # Check if Sharpe calculation had issues
-                if conf.calculate_sharpe and summary_output[0].get('Shrp(A-mo)') == 'N/A':
-                    sharpe_warnings.append(s)
-
-            except Exception as e:
-                logging.error("Error processing HTM report for {}: {}".format(s, e))
-                print("ERROR: Failed to process {}".format(s))
-                continue
 
-        else:
-            logging.warning("Missing the HTM report for {}".format(s))
-            print("WARNING: Missing HTM report for {}".format(s))
+def record_parsed_report(conf, symbol, parsed_report, stats):
+    """
+    Appends the summary returned by parse_htm_report() to RESULTS.csv and updates the post-processing stats.
+
+    :return: Number of rows written to RESULTS.csv (zero if the report couldn't be parsed)
+    """
+    summary_output, num_trades, error = parsed_report
+
+    if error is not None:
+        logging.error("Error processing HTM report for {}: {}".format(symbol, error))
+        print("ERROR: Failed to process {}".format(symbol))
+        return 0
+
+    # Write summary to RESULTS.csv
+    dict_to_csv(summary_output, conf.test_report_csv)
+
+    if num_trades > 0:
+        stats['trades_processed'] += num_trades
+        print("Processed {} - {} trades extracted".format(symbol, num_trades))
+    else:
+        print("Processed {} - No trades found".format(symbol))
+
+    # Check if Sharpe calculation had issues
+    if conf.calculate_sharpe and summary_output[0].get('Shrp(A-mo)') == 'N/A':
+        stats['sharpe_warnings'].append(symbol)
+
+    return len(summary_output)
+
+
+def update_trade_store(conf):
+    """
+    Collects the trades of every symbol in RESULTS.csv (i.e. including those retained from earlier runs in repair mode)
+    into the batch-wide trade store, TRADES.npz, and its CSV view TRADES.csv when trades are written as CSV.
+
+    :return: Number of trade rows in the store
+    """
+    from src.TradeStore import TradeStore
+
+    symbols = conf.symbols
+    if os.path.exists(conf.test_report_csv):
+        # Rows of optimization passes have no Symbol, optimization reports list no trades to collect
+        symbols = list(dict.fromkeys(row['Symbol'] for row in csv_to_dict(conf.test_report_csv)
+                                     if row.get('Symbol')))
+
+    # Read the trade files of this run's format first, in case an earlier run left the other format behind
+    extensions = ('.csv', '.npz') if conf.trades_format == 'csv' else ('.npz', '.csv')
+    store = TradeStore.from_reports_folder(conf.abs_reports_folder, symbols, extensions)
+    for fn in (conf.trades_store, conf.trades_report_csv):
+        if os.path.exists(fn):
+            os.remove(fn)
+    if len(store) == 0:
+        return 0
+
+    store.save(conf.trades_store)
+    if conf.trades_format in ('csv', 'both'):
+        store.table.to_csv(conf.trades_report_csv)
+    return len(store)
+
+
+def analyze_portfolio(conf):
+    """
+    Analyzes the trades in the batch-wide trade store as a single portfolio (see Portfolio.py). Writes PORTFOLIO.csv,
+    PORTFOLIO_EQUITY.csv and PORTFOLIO_CORRELATION.csv next to RESULTS.csv.
+
+    :return: dict of the portfolio statistics, None if there are no trades to analyze
+    """
+    from src.Portfolio import Portfolio
+    from src.TradeStore import TradeStore
 
+    if not os.path.exists(conf.trades_store):
+        logging.warning("No trades found for the portfolio analysis")
+        return None
+
+    portfolio = Portfolio(TradeStore.load(conf.trades_store), conf.date_from, conf.date_to, conf.risk_free_rate)
+    metrics = portfolio.metrics()
+    dict_to_csv([metrics], conf.portfolio_csv, overwrite=True)
+    portfolio_fn = os.path.splitext(conf.portfolio_csv)[0]
+    portfolio.equity_to_csv(portfolio_fn + "_EQUITY.csv")
+    portfolio.correlation_to_csv(portfolio_fn + "_CORRELATION.csv")
+    return metrics
+
+
+def print_postprocess_summary(conf, stats):
     # Display completion summary
     print("\nResults written to: {}".format(conf.test_report_csv))
 
-    if trades_processed > 0:
+    if stats['trades_processed'] > 0:
         print("Trades written to:  {}/<SYMBOL>_TRADES.csv".format(conf.abs_reports_folder))
-        print("Total trade rows:   {}".format(trades_processed))
+        print("Total trade rows:   {}".format(stats['trades_processed']))
+    if stats['trades_stored'] > 0:
+        print("Trade store:        {} ({} trades of the batch)".format(conf.trades_store, stats['trades_stored']))
+
+    portfolio = stats['portfolio']
+    if portfolio is not None:
+        print("\n--- Portfolio ({} symbols, {} closed trades) ---".format(portfolio['Symbols'],
+                                                                     portfolio['Total trades']))
+        print("Net profit: {} ({}%)  Max DD: {} ({}%)  Recov factor: {}".format(
+            portfolio['Total net profit'], portfolio['Return %'], portfolio['Max DD'], portfolio['Max DD %'],
+            portfolio['Recov factor']))
+        print("Sharpe: {}  Sortino: {}".format(portfolio['Shrp(A-mo)'], portfolio['Sortino(A-mo)']))
+        print("Portfolio written to: {}".format(conf.portfolio_csv))
 
     # Display Sharpe calculation warnings
     if conf.calculate_sharpe:
+        sharpe_warnings = stats['sharpe_warnings']
         print("\n--- Sharpe Ratio Calculation Summary ---")
         if len(sharpe_warnings) == 0:
             print("SUCCESS: All symbols calculated successfully")
@@ -329,4 +499,57 @@ def postprocess_results(conf):
             print("  * Test period < 1 year (Annual Sharpe)")
             print("  * Insufficient closed trades (< 2 periods)")
             print("  * All returns identical (zero std deviation)")
-            print("\nCheck logs for detailed error messages.")
\ No newline at end of file
+            print("\nCheck logs for detailed error messages.")
+
+
+def postprocess_results(conf):
+    """
+    Process HTM reports to generate RESULTS.csv and individual TRADES.csv files.
+    Calculates Sharpe Ratios (Monthly and Annual) when enabled in configuration.
+
+    Reports are parsed by a pool of 'conf.parser_workers' processes when it's more than one. Results are still
+    written to RESULTS.csv in the original symbol order.
+
+    Args:
+        conf: GlobalConfig object containing test configuration and paths
+
+    Writes:
+        - RESULTS.csv: Summary metrics for all symbols (includes Sharpe ratios if enabled)
+        - {SYMBOL}_TRADES.csv: Individual trade data per symbol in htm_reports folder
+        - TRADES.npz (and TRADES.csv): All trades of the batch, see update_trade_store()
+        - PORTFOLIO*.csv: Portfolio statistics of the batch, if enabled (see analyze_portfolio())
+    """
+    from multiprocessing import Pool
+
+    print_sharpe_configuration(conf)
+    stats = new_postprocess_stats()
+
+    # Symbols cancelled by the pruning rule weren't tested, see ProcessPool.prune()
+    symbols = [s for s in conf.symbols if s not in conf.pruned_symbols]
+    jobs = [htm_report_job(conf, s) for s in symbols if s in conf.htm_reports.keys()]
+
+    pool = None
+    num_workers = min(conf.parser_workers, len(jobs))
+    if num_workers > 1:
+        print("Parsing {} HTM reports using {} workers".format(len(jobs), num_workers))
+        pool = Pool(num_workers)
+        parsed_reports = pool.imap(_parse_htm_report_job, jobs)
+    else:
+        parsed_reports = map(_parse_htm_report_job, jobs)
+
+    try:
+        for s in symbols:
+            if s in conf.htm_reports.keys():
+                record_parsed_report(conf, s, next(parsed_reports), stats)
+            else:
+                logging.warning("Missing the HTM report for {}".format(s))
+                print("WARNING: Missing HTM report for {}".format(s))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    stats['trades_stored'] = update_trade_store(conf)
+    if conf.portfolio_analysis:
+        stats['portfolio'] = analyze_portfolio(conf)
+    print_postprocess_summary(conf, stats)
@@ -4,6 +4,16 @@ from .Terminal import Terminal
 from .HTMParser import HTMParser
 from .Utils import dict_to_csv
 from .ProcessPool import ProcessPool
+from .ReportConsumer import ReportConsumer
+from .ResultCache import ResultCache
+from .ReportCache import ReportCache
+from .SharpeEngine import SharpeEngine
+from .TradeTable import TradeTable
+from .TradeStore import TradeStore
+from .Portfolio import Portfolio
+from .OptimizationReader import OptimizationReader
+from .PassSelector import PassSelector
+from .FieldTemplate import FieldTemplate
 
 
 
@@ -0,0 +1,28 @@
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The scripts in bin/ import the package the same way, from the root of the repository
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bin'))
+
+from fake_terminal import make_report
+
+
+@pytest.fixture
+def write_report(tmp_path):
+    """
+    :return: Function writing a synthetic Strategy Tester Report (see fake_terminal.py), returning its file name
+    """
+    def write(symbol="EURUSD", date_from="2021.01.01", date_to="2024.01.01", num_trades=50, seed=1, edit=None):
+        report = make_report(symbol, date_from, date_to, num_trades, random.Random(seed))
+        if edit is not None:
+            report = edit(report)
+        fn = str(tmp_path / "{}.htm".format(symbol))
+        with open(fn, 'w') as htm_file:
+            htm_file.write(report)
+        return fn
+    return write
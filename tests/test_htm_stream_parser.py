@@ -0,0 +1,73 @@
+import filecmp
+
+import pytest
+
+from src.HTMParser import HTMParser
+from src.HTMStreamParser import HTMStreamParser
+
+
+def edit_layout(report):
+    # Markup BeautifulSoup and the streaming parser must agree on: comments, entities, nested tags and whitespace
+    report = report.replace('<td>buy</td>', '<td> <b>buy</b><!-- entry --> </td>', 3)
+    report = report.replace('<td class=mspt>0.50</td>', '<td class=mspt>\n0.50&nbsp;</td>', 5)
+    return report.replace('</table><br>', '</table><br><table><tr><td>Initial deposit</td><td>1.0</td></tr></table>')
+
+
+def parse_both(fn):
+    soup = HTMParser(fn)
+    stream = HTMParser(fn, streaming=True)
+    return soup, stream
+
+
+@pytest.mark.parametrize("num_trades", [0, 1, 50, 2000])
+def test_same_output_as_beautifulsoup(write_report, num_trades):
+    # 2000 trades span several chunks of the streaming parser
+    fn = write_report(num_trades=num_trades)
+    soup, stream = parse_both(fn)
+
+    assert stream.report_type == soup.report_type == "Strategy Tester Report"
+    assert stream.summary == soup.summary
+    assert stream.initial_deposit == soup.initial_deposit
+    assert len(stream.trades) == len(soup.trades) == 2 * num_trades
+    assert list(stream.trades) == list(soup.trades)
+    assert stream.sharpe_ratio(0.02, "2021.01.01", "2024.01.01") == soup.sharpe_ratio(0.02, "2021.01.01", "2024.01.01")
+
+
+@pytest.mark.parametrize("edit", [None, edit_layout, lambda report: '\N{BYTE ORDER MARK}' + report],
+                         ids=["plain", "layout", "bom"])
+def test_same_trade_csv_bytes(write_report, tmp_path, edit):
+    fn = write_report(edit=edit)
+    soup, stream = parse_both(fn)
+    soup_csv = str(tmp_path / "soup.csv")
+    stream_csv = str(tmp_path / "stream.csv")
+
+    soup_results, soup_trades = soup.htm_to_csv(calculate_sharpe=True, date_from="2021.01.01", date_to="2024.01.01")
+    stream_results, stream_trades = stream.htm_to_csv(calculate_sharpe=True, date_from="2021.01.01",
+                                                      date_to="2024.01.01")
+    soup_trades.to_csv(soup_csv)
+    stream_trades.to_csv(stream_csv)
+
+    assert stream_results == soup_results
+    assert filecmp.cmp(soup_csv, stream_csv, shallow=False)
+
+
+def test_summary_pass_stops_early(write_report):
+    fn = write_report(num_trades=2000)
+    head = HTMStreamParser(fn, []).parse(until=lambda stream: len(stream.report_types) > 0)
+
+    assert head.report_types == ["Strategy Tester Report"]
+    assert not head.is_complete
+    assert head.trade_rows is None
+    # The summary alone reads the same values as the whole report
+    for streaming in (False, True):
+        whole = HTMParser(fn, streaming=streaming)
+        assert len(whole.trades) == 4000
+        assert HTMParser(fn, streaming=streaming).summary == whole.summary
+
+
+def test_optimization_report_type(write_report):
+    fn = write_report(edit=lambda report: report.replace("Strategy Tester Report", "Optimization Report"))
+    soup, stream = parse_both(fn)
+
+    assert stream.report_type == soup.report_type == "Optimization Report"
+    assert stream.summary is None and soup.summary is None
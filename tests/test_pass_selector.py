@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from src.PassSelector import METRICS, PassSelector
+
+
+def random_passes(seed, count, correlated=False):
+    rng = random.Random(seed)
+    passes = []
+    for number in range(1, count + 1):
+        profit = round(rng.uniform(-500, 2000), 1)
+        # Drawdowns rising with the profits make most passes part of the Pareto front
+        drawdown = profit / 100 + rng.uniform(0, 1) if correlated else rng.uniform(0, 40)
+        passes.append({'Pass': str(number), 'Profit': "{:.2f}".format(profit),
+                       'Total trades': str(rng.randrange(5, 50)), 'Profit factor': "{:.2f}".format(rng.uniform(0, 3)),
+                       'Drawdown %': "{:.2f}".format(drawdown)})
+    return passes
+
+
+def scores(optimization_pass, metrics):
+    return [float(optimization_pass[m]) * (1 if METRICS[m] else -1) for m in metrics]
+
+
+def brute_force_front(passes, metrics, top=0):
+    def dominates(a, b):
+        return all(x >= y for x, y in zip(a, b)) and a != b
+
+    all_scores = [scores(p, metrics) for p in passes]
+    front = [i for i, s in enumerate(all_scores) if not any(dominates(other, s) for other in all_scores)]
+    front.sort(key=lambda i: (-all_scores[i][0], i))
+    return [passes[i] for i in (front[:top] if top > 0 else front)]
+
+
+def brute_force_top(passes, metric, top):
+    order = sorted(range(len(passes)), key=lambda i: (-scores(passes[i], [metric])[0], i))
+    return [passes[i] for i in order[:top]]
+
+
+@pytest.mark.parametrize("metric", ['Profit', 'Drawdown %', 'Total trades'])
+@pytest.mark.parametrize("top", [1, 10, 500])
+def test_top_passes(metric, top):
+    # Few distinct trade counts: among passes of the same score, the earlier ones come first
+    passes = random_passes(1, 300)
+    assert PassSelector(metric, top).select(passes) == brute_force_top(passes, metric, top)
+
+
+@pytest.mark.parametrize("metrics", [['Profit', 'Drawdown %'], ['Profit factor', 'Total trades', 'Drawdown %']])
+@pytest.mark.parametrize("correlated", [False, True])
+@pytest.mark.parametrize("top", [0, 5])
+def test_pareto_front(metrics, correlated, top):
+    passes = random_passes(2, 1000, correlated)
+    # Identical passes are both kept, neither is better
+    passes.append(dict(passes[10], Pass='1001'))
+    selected = PassSelector(metrics, top).select(passes)
+
+    assert selected == brute_force_front(passes, metrics, top)
+
+
+def test_large_pareto_front():
+    # Large fronts are compared as arrays
+    passes = random_passes(4, 2000, correlated=True)
+    selected = PassSelector(['Profit', 'Drawdown %']).select(passes)
+
+    assert len(selected) > PassSelector.VECTORIZE_FRONT
+    assert selected == brute_force_front(passes, ['Profit', 'Drawdown %'])
+
+
+def test_passes_without_a_value_are_left_out():
+    passes = random_passes(3, 20)
+    passes[0]['Profit'] = ''
+    passes[1]['Profit'] = 'nan'
+    del passes[2]['Drawdown %']
+    passes[3]['Profit'] = '1e9'
+    passes[4]['Drawdown %'] = 'n/a'
+
+    selected = PassSelector(['Profit', 'Drawdown %']).select(passes)
+    assert selected[0] is passes[3]
+    assert all(p not in selected for p in passes[:3] + passes[4:5])
+    assert selected == brute_force_front(passes[3:4] + passes[5:], ['Profit', 'Drawdown %'])
+
+
+@pytest.mark.parametrize("metrics, top", [(['Sharpe'], 5), ([], 5), ('Profit', 0)])
+def test_invalid_selection(metrics, top):
+    with pytest.raises(ValueError):
+        PassSelector(metrics, top)
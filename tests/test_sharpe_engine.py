@@ -0,0 +1,99 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from src.HTMParser import HTMParser
+from src.SharpeEngine import SharpeEngine
+from src.TradeTable import TradeTable
+
+
+def per_trade_sharpe(closed_trades, risk_free_rate, date_from, date_to):
+    """
+    The Sharpe Ratios as HTMParser calculated them one trade at a time, before SharpeEngine
+    """
+    start_date = datetime.strptime(date_from, '%Y.%m.%d')
+    end_date = datetime.strptime(date_to, '%Y.%m.%d')
+
+    def period_sharpe(period):
+        period_returns = {}
+        for trade in closed_trades:
+            try:
+                trade_time = datetime.strptime(trade['Time'], '%Y.%m.%d %H:%M')
+            except ValueError:
+                continue
+            period_key = trade_time.strftime('%Y-%m' if period == 'monthly' else '%Y')
+            period_returns[period_key] = period_returns.get(period_key, 0.0) + float(trade['Return %'])
+
+        all_periods = []
+        current = start_date
+        while current <= end_date:
+            all_periods.append(current.strftime('%Y-%m' if period == 'monthly' else '%Y'))
+            current += relativedelta(months=1) if period == 'monthly' else relativedelta(years=1)
+        returns_list = [period_returns.get(period_key, 0.0) for period_key in all_periods]
+        if len(returns_list) < 2:
+            return 'N/A'
+
+        mean_return = sum(returns_list) / len(returns_list)
+        variance = sum((r - mean_return) ** 2 for r in returns_list) / (len(returns_list) - 1)
+        std_return = math.sqrt(variance)
+        if std_return == 0:
+            return 'N/A'
+        if period == 'monthly':
+            period_rf, periods_per_year = (risk_free_rate / 12.0) * 100, 12
+        else:
+            period_rf, periods_per_year = risk_free_rate * 100, 1
+        return round(((mean_return - period_rf) / std_return) * math.sqrt(periods_per_year), 2)
+
+    if len(closed_trades) == 0:
+        return {'monthly': 'N/A', 'annual': 'N/A'}
+    duration_years = (end_date - start_date).days / 365.25
+    return {'monthly': period_sharpe('monthly'),
+            'annual': period_sharpe('annual') if duration_years >= 1.0 else 'N/A'}
+
+
+def random_trades(seed, date_from, date_to, count):
+    rng = random.Random(seed)
+    # Trades may fall a little outside of the test period, those are ignored
+    start = datetime.strptime(date_from, '%Y.%m.%d') - timedelta(days=20)
+    span = (datetime.strptime(date_to, '%Y.%m.%d') - start).days + 40
+    times = sorted(start + timedelta(minutes=rng.randrange(span * 24 * 60)) for _ in range(count))
+    return [{'Time': t.strftime('%Y.%m.%d %H:%M'), 'Return %': "{:.4f}".format(rng.uniform(-2.0, 2.5))}
+            for t in times]
+
+
+PERIODS = [("2021.01.01", "2024.01.01"), ("2020.01.31", "2021.03.30"), ("2020.02.29", "2023.02.28"),
+           ("2022.03.15", "2022.11.14"), ("2022.05.10", "2022.05.20")]
+
+
+@pytest.mark.parametrize("date_from, date_to", PERIODS)
+@pytest.mark.parametrize("risk_free_rate", [0.0, 0.03])
+@pytest.mark.parametrize("seed", range(5))
+def test_same_as_per_trade_calculation(date_from, date_to, risk_free_rate, seed):
+    trades = random_trades(seed, date_from, date_to, count=seed * 40)
+    engine = SharpeEngine(date_from, date_to, risk_free_rate)
+
+    assert engine.sharpe_of_trades(trades) == per_trade_sharpe(trades, risk_free_rate, date_from, date_to)
+
+
+def test_entries_and_unparsed_times():
+    trades = random_trades(7, "2021.01.01", "2023.01.01", count=100)
+    closed = list(trades)
+    # Entries have no return, odd but valid times still count, and times nobody can read are skipped
+    trades += [{'Time': '2021.06.01 10:00', 'Return %': ''}, {'Time': 'not a time', 'Return %': '1.0'}]
+    closed += [{'Time': 'not a time', 'Return %': '1.0'}]
+    trades[3]['Time'] = trades[3]['Time'].replace('.0', '.', 1)
+
+    engine = SharpeEngine("2021.01.01", "2023.01.01", 0.01)
+    assert engine.sharpe_of_trades(trades) == per_trade_sharpe(closed, 0.01, "2021.01.01", "2023.01.01")
+
+
+def test_same_from_a_trade_table(write_report):
+    parser = HTMParser(write_report(num_trades=300))
+    closed = [trade for trade in parser.trades if trade['Return %'] != '']
+    engine = SharpeEngine("2021.01.01", "2024.01.01", 0.02)
+
+    assert engine.sharpe_of_table(parser.trades) == per_trade_sharpe(closed, 0.02, "2021.01.01", "2024.01.01")
+    assert engine.sharpe_of_table(TradeTable()) == {'monthly': 'N/A', 'annual': 'N/A'}
@@ -0,0 +1,80 @@
+import random
+
+import numpy as np
+import pytest
+from fake_terminal import make_report
+
+from src.HTMParser import HTMParser
+from src.TradeStore import TradeStore
+
+SYMBOLS = ["USDJPY", "EURUSD", "GBPUSD"]
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("reports")
+    for seed, symbol in enumerate(SYMBOLS):
+        report = make_report(symbol, "2021.01.01", "2024.01.01", 60, random.Random(seed))
+        # Times the table can't hold sort last within their symbol
+        if seed > 0:
+            report = report.replace('<td class=msdate>2021.', '<td class=msdate>2021.0', 1)
+        htm_fn = str(folder / "{}.htm".format(symbol))
+        with open(htm_fn, 'w') as htm_file:
+            htm_file.write(report)
+        HTMParser(htm_fn).trades.save(str(folder / "{}_TRADES.npz".format(symbol)))
+    TradeStore.from_reports_folder(str(folder), SYMBOLS).save(str(folder / "TRADES.npz"))
+    return TradeStore.load(str(folder / "TRADES.npz"))
+
+
+def brute_force(store, symbols=None, time_from=None, time_to=None, closed_only=False):
+    # Rows of the store (all of them, in the same order as a query) that match, checked one by one
+    symbols = SYMBOLS if symbols is None else symbols
+    trades = list(store.table)
+    matches = []
+    for symbol in symbols:
+        for row, trade in enumerate(trades):
+            if trade['Symbol'] != symbol:
+                continue
+            time = store.table['Time'][row]
+            if (time_from is not None or time_to is not None) and np.isnat(time):
+                continue
+            if time_from is not None and time < np.datetime64(time_from):
+                continue
+            if time_to is not None and time > np.datetime64(time_to):
+                continue
+            if closed_only and trade['Return %'] == '':
+                continue
+            matches.append(trade)
+    return matches
+
+
+def test_store_is_complete(store):
+    assert len(store) == 3 * 120
+    assert sorted(store.symbols) == sorted(SYMBOLS)
+
+
+@pytest.mark.parametrize("symbols", [None, ["EURUSD"], "GBPUSD", ["GBPUSD", "USDJPY"], ["CHFJPY"]])
+@pytest.mark.parametrize("closed_only", [False, True])
+def test_symbols(store, symbols, closed_only):
+    expected = brute_force(store, [symbols] if isinstance(symbols, str) else symbols, closed_only=closed_only)
+    assert list(store.query(symbols=symbols, closed_only=closed_only)) == expected
+
+
+@pytest.mark.parametrize("time_from, time_to, bounds", [
+    ("2022.01.01", None, ("2022-01-01T00:00", None)),
+    (None, "2022.12.31", (None, "2022-12-31T23:59")),
+    ("2022.03.01 12:00", "2022.03.31 12:00", ("2022-03-01T12:00", "2022-03-31T12:00")),
+    (np.datetime64("2023-06-01T00:00"), None, ("2023-06-01T00:00", None)),
+    ("2030.01.01", None, ("2030-01-01T00:00", None)),
+])
+def test_time_range(store, time_from, time_to, bounds):
+    expected = brute_force(store, ["EURUSD", "USDJPY"], bounds[0], bounds[1], closed_only=True)
+    trades = store.query(symbols=["EURUSD", "USDJPY"], time_from=time_from, time_to=time_to, closed_only=True)
+
+    assert list(trades) == expected
+    assert trades.symbols == store.table.symbols
+
+
+def test_invalid_time(store):
+    with pytest.raises(ValueError):
+        store.query(time_from="2022.1.1")
@@ -0,0 +1,68 @@
+import filecmp
+
+import numpy as np
+import pytest
+
+from src.HTMParser import HTMParser
+from src.TradeTable import TradeTable
+
+
+def odd_cells(report):
+    # Cells the typed columns can't reproduce as they are, they must still come back unchanged
+    report = report.replace('<td class=msdate>2021.', '<td class=msdate>2021.0', 1)
+    report = report.replace('<td class=mspt>0.50</td>', '<td class=mspt>0.5</td>', 1)
+    return report.replace('<td>1.09000</td>', '<td>n/a</td>', 1)
+
+
+@pytest.fixture(params=[None, odd_cells], ids=["plain", "odd_cells"])
+def trades(request, write_report):
+    tables = [HTMParser(write_report(symbol=symbol, num_trades=40, seed=seed, edit=request.param)).trades
+              for seed, symbol in enumerate(["EURUSD", "USDJPY"])]
+    return TradeTable.concat(tables)
+
+
+def test_csv_round_trip(trades, tmp_path):
+    csv_fn = str(tmp_path / "TRADES.csv")
+    again_fn = str(tmp_path / "TRADES_AGAIN.csv")
+    trades.to_csv(csv_fn)
+    loaded = TradeTable.load(csv_fn)
+    loaded.to_csv(again_fn)
+
+    assert list(loaded) == list(trades)
+    assert filecmp.cmp(csv_fn, again_fn, shallow=False)
+
+
+def test_npz_round_trip(trades, tmp_path):
+    npz_fn = str(tmp_path / "TRADES.npz")
+    trades.save(npz_fn)
+    loaded = TradeTable.load(npz_fn)
+
+    assert loaded.symbols == trades.symbols
+    assert loaded.raw == trades.raw
+    for column, values in trades.columns.items():
+        np.testing.assert_array_equal(loaded[column], values)
+    assert list(loaded) == list(trades)
+
+    csv_fn = str(tmp_path / "TRADES.csv")
+    npz_csv_fn = str(tmp_path / "TRADES_FROM_NPZ.csv")
+    trades.to_csv(csv_fn)
+    loaded.to_csv(npz_csv_fn)
+    assert filecmp.cmp(csv_fn, npz_csv_fn, shallow=False)
+
+
+def test_append_to_csv(trades, tmp_path):
+    csv_fn = str(tmp_path / "TRADES.csv")
+    first = trades.take(np.arange(10))
+    rest = trades.take(np.arange(10, len(trades)))
+    first.to_csv(csv_fn)
+    rest.to_csv(csv_fn, overwrite=False)
+
+    assert list(TradeTable.load(csv_fn)) == list(trades)
+
+
+def test_empty_table(tmp_path):
+    npz_fn = str(tmp_path / "TRADES.npz")
+    TradeTable().save(npz_fn)
+
+    assert len(TradeTable.load(npz_fn)) == 0
+    assert list(TradeTable.load(npz_fn)) == []